@@ -1,3 +1,33 @@
 from django.contrib import admin
+from django.http import Http404
+from django.template.response import TemplateResponse
+
+from board.profiling import get_profile_ring
 
 # Register your models here.
+
+
+def profile_list(req):
+    """
+    The admin page listing the request profiles kept by every worker process, newest first.
+
+    See `board.profiling` for how requests are profiled.
+    """
+    return TemplateResponse(req, 'admin/board/profile_list.html', {
+        **admin.site.each_context(req),
+        'title': 'Request profiles',
+        'profiles': get_profile_ring().list(),
+    })
+
+
+def profile_detail(req, profile_id):
+    """The admin page showing a request profile, with its SQL queries and its slowest calls."""
+    profile = get_profile_ring().get(profile_id)
+    if profile is None:
+        raise Http404('The profile was dropped.')
+    return TemplateResponse(req, 'admin/board/profile_detail.html', {
+        **admin.site.each_context(req),
+        'title': f'Profile {profile.id}: {profile.method} {profile.path}',
+        'profile': profile,
+        'sql_duration': sum(query.duration for query in profile.queries),
+    })
@@ -0,0 +1,166 @@
+"""
+Archival of the images of inactive boards.
+
+Boards which have not been posted to in a long time keep all of their image BLOBs in the
+database, which bloats it and slows down backups. The images of such boards can be moved into
+a compressed pack on disk, one zip file per board under `IMAGE_ARCHIVE_ROOT`, leaving an empty
+BLOB and the name of the pack behind. Archived images are restored into the database the first
+time they are requested again (see `restore_image`), so archival is invisible to clients.
+Deleting an archived image removes it from its pack, and deleting a board removes its pack.
+
+Images are copied in and out of packs in chunks, whatever storage backend holds them.
+"""
+import os
+import shutil
+import zipfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import F, Max
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from board.models import Board, Image
+from board.routers import using_shard
+from board.storage import BlobStorage, default_storage, get_storage
+
+
+def inactive_boards(days):
+    """
+    Return the boards which have had no activity in the last `days` days.
+
+    The last activity of a board is the creation of its latest post, or of the board itself if
+    it has no posts.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    return Board.objects \
+        .annotate(last_activity=Greatest('created_at', Coalesce(Max('post__created_at'), 'created_at'))) \
+        .filter(last_activity__lt=cutoff)
+
+
+def board_images(board):
+    """Return the images of a board which are still stored in the database."""
+    return Image.objects.for_board(board).filter(archive='')
+
+
+def archive_path(name):
+    """Return the path of the archive pack with the given name."""
+    return settings.IMAGE_ARCHIVE_ROOT / name
+
+
+def pack_name(board_uuid):
+    """Return the name of the archive pack of the board with the given uuid."""
+    return f'{board_uuid}.zip'
+
+
+def archive_board(board):
+    """
+    Move the images of a board from the database into its archive pack.
+
+    Images are written to the pack one at a time, and only emptied in the database once the
+    pack has been written and closed, so an interrupted run never loses an image.
+
+    Params:
+        board -> `Board`: the board to archive.
+
+    Returns:
+        The number of images archived.
+    """
+    name = pack_name(board.uuid)
+    settings.IMAGE_ARCHIVE_ROOT.mkdir(parents=True, exist_ok=True)
+
+    archived = []
+    with zipfile.ZipFile(archive_path(name), 'a', compression=zipfile.ZIP_DEFLATED) as pack:
+        packed = set(pack.namelist())
+        # BLOBs are deferred, so they are only loaded one at a time.
+        for image in board_images(board).defer('photo').iterator():
+            # Images never change, so an image packed before (and restored since) is kept as is.
+            if str(image.uuid) not in packed:
+                with pack.open(str(image.uuid), 'w', force_zip64=True) as f:
+                    for chunk in image.iter_chunks():
+                        f.write(chunk)
+            archived.append(image.id)
+
+    images = Image.objects.filter(id__in=archived)
+    with transaction.atomic(using=router.db_for_write(Image)):
+        for image in images.exclude(storage=BlobStorage.name).only('id', 'storage', 'oid'):
+            get_storage(image.storage).delete(image)
+        images.update(photo=b'', archive=name, storage=BlobStorage.name, oid=None)
+    return len(archived)
+
+
+def iter_archived_chunks(image):
+    """
+    Yield the bytes of an archived image from its pack, in chunks.
+
+    Params:
+        image -> `Image`: an image whose `archive` is set.
+    """
+    with zipfile.ZipFile(archive_path(image.archive)) as pack, pack.open(str(image.uuid)) as f:
+        yield from iter(lambda: f.read(settings.IMAGE_STORAGE_CHUNK_SIZE), b'')
+
+
+def restore_image(image):
+    """
+    Move an archived image back into the default storage backend.
+
+    The image is locked while it is restored, so an image requested by several clients at once
+    is only restored once, and the others reload it once restored.
+
+    Params:
+        image -> `Image`: an image whose `archive` is set.
+    """
+    # The image is restored on the shard it was read from, even if it is not the current one.
+    using = router.db_for_write(Image, instance=image)
+    images = Image.objects.using(using).filter(pk=image.pk)
+    with using_shard(using), transaction.atomic(using=using):
+        # Updating the row locks it (the whole database on SQLite) until the transaction ends.
+        images.update(archive=F('archive'))
+        if not images.exclude(archive='').exists():
+            image.refresh_from_db(using=using)
+            return
+        default_storage().write(image, iter_archived_chunks(image))
+        image.archive = ''
+        image.save(update_fields=['photo', 'archive', 'storage', 'size', 'oid', 'chunk_size'])
+
+
+def delete_archived_image(image):
+    """
+    Remove an archived image from its pack, and the pack once it is empty.
+
+    Entries cannot be removed from a zip file in place, so the other images are copied to a new
+    pack, which then replaces it.
+
+    Params:
+        image -> `Image`: a deleted image whose `archive` is set.
+    """
+    path = archive_path(image.archive)
+    if not path.exists():
+        return
+    with zipfile.ZipFile(path) as pack:
+        entries = [info for info in pack.infolist() if info.filename != str(image.uuid)]
+        if len(entries) == len(pack.infolist()):
+            return
+        if entries:
+            new_path = path.with_name(f'{path.name}.tmp')
+            with zipfile.ZipFile(new_path, 'w', compression=zipfile.ZIP_DEFLATED) as new_pack:
+                for info in entries:
+                    entry = zipfile.ZipInfo(info.filename, info.date_time)
+                    entry.compress_type = zipfile.ZIP_DEFLATED
+                    with pack.open(info) as src, new_pack.open(entry, 'w', force_zip64=True) as dst:
+                        shutil.copyfileobj(src, dst, settings.IMAGE_STORAGE_CHUNK_SIZE)
+    if entries:
+        os.replace(new_path, path)
+    else:
+        path.unlink()
+
+
+def delete_board_archive(board):
+    """
+    Remove the archive pack of a deleted board, if any.
+
+    Params:
+        board -> `Board`: the deleted board.
+    """
+    archive_path(pack_name(board.uuid)).unlink(missing_ok=True)
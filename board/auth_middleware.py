@@ -0,0 +1,28 @@
+"""
+Session, authentication and message middleware skipping the public board API.
+
+The public API is anonymous, so creating a session store, a lazy user and a message storage
+for each of its requests, and checking them all again on the way out, is wasted work. These
+only differ from Django's by passing the requests marked by `board.middleware.PublicAPIMiddleware`
+straight through, so the admin site and the board page keep working as before.
+
+They are kept apart from `board.middleware` so that workers using the lean settings profile,
+which leave sessions and messages out, never import them.
+"""
+from django.contrib.auth.middleware import AuthenticationMiddleware as BaseAuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware as BaseMessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware as BaseSessionMiddleware
+
+from board.middleware import PublicAPIExemptMixin
+
+
+class SessionMiddleware(PublicAPIExemptMixin, BaseSessionMiddleware):
+    """`SessionMiddleware` skipping the public board API."""
+
+
+class AuthenticationMiddleware(PublicAPIExemptMixin, BaseAuthenticationMiddleware):
+    """`AuthenticationMiddleware` skipping the public board API."""
+
+
+class MessageMiddleware(PublicAPIExemptMixin, BaseMessageMiddleware):
+    """`MessageMiddleware` skipping the public board API."""
@@ -0,0 +1,197 @@
+"""
+Group commit of new posts.
+
+When a board link is shared at an event, hundreds of posts may be submitted within seconds, and
+creating each of them in its own transaction makes them queue up for the database's writer
+lock (SQLite only has one). With `POST_BATCH_WINDOW_MS` set, `CreatePost` hands new posts over
+to the `PostBatcher` of its process instead, and waits for them to be committed. The batcher
+creates every post submitted within the window in a single transaction (see
+`PostManager.bulk_create_with_photos`), so a burst of posts costs a few transactions instead
+of one per post.
+
+A post is only acknowledged once its transaction has committed. If a batch fails, its posts are
+retried one at a time, so an invalid post never fails the others. A post which is not committed
+in time is cancelled, unless its transaction has already started, so a client told to retry
+never creates it twice. A post whose transaction has started is waited for once more, as long,
+so a stuck transaction never holds the request forever, though the post may still be created.
+
+Only the posts of concurrent requests to the same process are grouped, so batching needs workers
+serving several requests at once, i.e. threaded (e.g. `gunicorn --threads 8`) or ASGI workers.
+Under single threaded sync workers every batch holds a single post, which only waits for the
+window in vain, so `POST_BATCH_WINDOW_MS` should be left at 0.
+"""
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent import futures
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.dispatch import receiver
+
+from board.models import Image, Post
+from board.routers import using_shard
+
+PendingPost = namedtuple('PendingPost', ['fields', 'uploads', 'future'])
+PendingPost.__doc__ = """
+A post waiting to be created by a `PostBatcher`.
+
+Fields:
+    fields -> `dict`: the fields of the post.
+    uploads -> `list` of uploaded files: the photos of the post, in order.
+    future -> `Future`: resolved with the created `Post` once committed.
+"""
+
+
+class PostBatcher:
+    """
+    Creates the posts submitted from any thread in grouped transactions, from a writer thread.
+
+    The writer thread is started with the first post. It waits for a post, collects the posts
+    submitted in the following `window` seconds (at most `max_size` of them), and creates them
+    all in one transaction.
+    """
+
+    def __init__(self, window, max_size):
+        """
+        Params:
+            window -> `float`: the number of seconds to collect posts for before creating them.
+            max_size -> `int`: the maximum number of posts created in one transaction.
+        """
+        self.window = window
+        self.max_size = max_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, uploads=(), **fields):
+        """
+        Queue a post to be created, and return a `Future` resolved with the post once committed.
+
+        The photos are read into memory right away, since Django closes the uploaded files once
+        the request is answered, which may be before the writer thread gets to them.
+
+        Params:
+            uploads -> iterable of uploaded files: the photos of the post, in order.
+            fields: the fields of the new post.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='post-batcher', daemon=True)
+                self._thread.start()
+
+        future = Future()
+        self._queue.put(PendingPost(fields, [read_upload(f) for f in uploads], future))
+        return future
+
+    def create(self, uploads=(), timeout=None, **fields):
+        """
+        Create a post through the writer thread, and return it once committed.
+
+        Raises:
+            `ValueError` if a photo is not a supported image.
+            `concurrent.futures.TimeoutError` if the post was not committed within `timeout`
+                seconds, in which case it was cancelled and is never created. Posts whose
+                transaction has already started are waited for up to `timeout` seconds more
+                instead, after which this is raised even though they may still be created.
+        """
+        future = self.submit(uploads, **fields)
+        try:
+            return future.result(timeout)
+        except futures.TimeoutError:
+            if future.cancel():
+                raise
+            return future.result(timeout)
+
+    def _run(self):
+        """Create the queued posts in batches, forever."""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            # Posts which timed out are cancelled, the others can no longer be.
+            batch = [pending for pending in batch if pending.future.set_running_or_notify_cancel()]
+            if batch:
+                self.flush(batch)
+
+    def flush(self, batch):
+        """
+        Create a batch of `PendingPost`s in one transaction, and resolve their futures.
+
+        If the transaction fails, the posts are created one at a time, so only the futures of the
+        posts which cannot be created are failed. Posts on boards of different shards (see
+        `board.sharding`) are created in one transaction per shard.
+        """
+        shards = {}
+        for pending in batch:
+            shards.setdefault(pending.fields['associated_board']._state.db, []).append(pending)
+        if len(shards) > 1:
+            for shard_batch in shards.values():
+                self.flush(shard_batch)
+            return
+        alias = next(iter(shards))
+
+        close_old_connections()
+        try:
+            with using_shard(alias), transaction.atomic(using=alias):
+                posts = Post.objects.bulk_create_with_photos([
+                    (pending.fields, [Image.from_upload(f, pending.fields['associated_board']) for f in pending.uploads])
+                    for pending in batch
+                ])
+        except Exception as e:
+            if len(batch) > 1:
+                for pending in batch:
+                    self.flush([pending])
+            else:
+                batch[0].future.set_exception(e)
+            return
+        finally:
+            close_old_connections()
+
+        for pending, post in zip(batch, posts):
+            pending.future.set_result(post)
+
+
+def read_upload(f):
+    """Return an in-memory copy of an uploaded file, with the annotations of its form field."""
+    f.seek(0)
+    copy = SimpleUploadedFile(f.name, f.read(), getattr(f, 'content_type', None))
+    for annotation in ('image_info', 'processed_photo'):
+        if hasattr(f, annotation):
+            setattr(copy, annotation, getattr(f, annotation))
+    return copy
+
+
+_post_batcher = None
+_post_batcher_lock = threading.Lock()
+
+
+def get_post_batcher():
+    """
+    Return the post batcher of this process, configured by the `POST_BATCH_*` settings, or
+    `None` if `POST_BATCH_WINDOW_MS` is 0.
+    """
+    global _post_batcher
+    if not settings.POST_BATCH_WINDOW_MS:
+        return None
+    with _post_batcher_lock:
+        if _post_batcher is None:
+            _post_batcher = PostBatcher(settings.POST_BATCH_WINDOW_MS / 1000, settings.POST_BATCH_MAX_SIZE)
+        return _post_batcher
+
+
+@receiver(setting_changed)
+def reset_post_batcher(setting, **kwargs):
+    """Start over with a new post batcher when its settings change (in tests)."""
+    global _post_batcher
+    if setting.startswith('POST_BATCH_'):
+        with _post_batcher_lock:
+            _post_batcher = None
@@ -0,0 +1,329 @@
+"""
+Caches of the bytes of hot images.
+
+At a live event the same few photos are requested by hundreds of viewers, so `GetImage` keeps
+recently served images in memory, keyed by the image uuid and variant, and serves them from
+there without touching the database. The cache is bounded by the total size of the images it
+holds (`IMAGE_CACHE_MAX_MB`), evicting the least recently used images first.
+
+Images may be deleted (e.g. by a board admin), and other worker processes cannot be told to
+forget them, so entries also expire after `IMAGE_CACHE_TTL` seconds.
+
+With several worker processes, each of them would hold its own copy of the same hot images, so
+images may also be cached on disk under `IMAGE_DISK_CACHE_ROOT`, shared by every process on the
+host (see `DiskImageCache`). Cached files are sent with `FileResponse`, which servers can pass to
+`sendfile`, and read through memory maps for byte ranges, so the kernel page cache holds the
+single copy of a hot image in memory.
+"""
+import mmap
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from board.images import sniff_image
+
+# The variants of an image: the image as uploaded, and a thumbnail for feed grids (see
+# `board.images.make_thumbnail`).
+VARIANT_ORIGINAL = 'original'
+VARIANT_THUMBNAIL = 'thumbnail'
+IMAGE_VARIANTS = (VARIANT_ORIGINAL, VARIANT_THUMBNAIL)
+
+CachedImage = namedtuple('CachedImage', ['content_type', 'data'])
+CachedImage.__doc__ = """
+An image held in the cache.
+
+Fields:
+    content_type -> `string`: the MIME type of the image.
+    data -> `bytes`: the image.
+"""
+
+
+class ImageCache:
+    """
+    A thread safe, size bounded LRU cache of `CachedImage`s.
+
+    Images larger than `max_item_bytes` are never cached, so a single large image cannot evict
+    every other image. Hits, misses and evictions are counted, see `stats`.
+    """
+
+    def __init__(self, max_bytes, max_item_bytes=None, ttl=None):
+        """
+        Params:
+            max_bytes -> `int`: the maximum total size of the cached images, in bytes.
+            max_item_bytes -> `int`: the maximum size of a single cached image, in bytes.
+                Defaults to an eighth of `max_bytes`.
+            ttl -> `float`: the number of seconds images are kept for, or `None` for ever.
+        """
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_bytes // 8 if max_item_bytes is None else max_item_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def accepts(self, size):
+        """Return whether an image of the given size in bytes would be cached."""
+        return size is not None and size <= self.max_item_bytes
+
+    def get(self, key):
+        """Return the `CachedImage` with the given key, or `None` if it is not cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and entry[1] + self.ttl < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, image):
+        """Cache a `CachedImage` under the given key, evicting old images to make room."""
+        size = len(image.data)
+        if not self.accepts(size):
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (image, time.monotonic())
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key):
+        """Forget the image with the given key, if it is cached."""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        """Forget every image and reset the statistics."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Return the number of cached images, their size in bytes, and the hits, misses and evictions."""
+        with self._lock:
+            return {
+                'items': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _remove(self, key):
+        """Remove an entry. The lock must be held."""
+        image, _ = self._entries.pop(key)
+        self._bytes -= len(image.data)
+
+
+class DiskImageCache:
+    """
+    A cache of images as files in a directory, shared by every process using the directory.
+
+    Images are stored as `<root>/<variant>/<uuid[:2]>/<uuid>`. Files are written to a temporary
+    file first and moved into place, so a reader never sees a partial image. Their content type
+    is read back from their headers (see `board.images.sniff_image`).
+
+    Files written more than `max_age` seconds ago are ignored and deleted when read, and `prune`
+    deletes the least recently served files until the cache holds at most `max_bytes`. Serving a
+    file sets its access time, which is not kept up to date by every file system. Pruning walks the whole cache,
+    so processes writing to the cache prune it in a background thread, at most once every
+    `prune_interval` seconds, and requests never wait for it.
+    """
+    prune_interval = 60
+
+    def __init__(self, root, max_bytes, max_age=None):
+        """
+        Params:
+            root -> `Path`: the directory holding the cache.
+            max_bytes -> `int`: the maximum total size of the cached images, in bytes.
+            max_age -> `float`: the number of seconds images are kept for, or `None` for ever.
+        """
+        self.root = root.resolve()
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._pruned_at = time.monotonic()
+        self._pruning = threading.Lock()
+
+    def path(self, key):
+        """Return the path of the file caching the image with the given `(uuid, variant)` key."""
+        uuid, variant = key
+        name = str(uuid)
+        return self.root / variant / name[:2] / name
+
+    def open(self, key):
+        """
+        Return the file caching the image with the given key, opened for binary reading, along
+        with its content type. Returns `(None, None)` if the image is not cached.
+        """
+        path = self.path(key)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None, None
+
+        mtime = os.fstat(f.fileno()).st_mtime
+        if self.max_age is not None and mtime + self.max_age < time.time():
+            f.close()
+            self._unlink(path)
+            return None, None
+        # The access time orders the files for pruning, while the write time expires them.
+        os.utime(f.fileno(), (time.time(), mtime))
+
+        try:
+            content_type = sniff_image(f).content_type
+        except ValueError:
+            content_type = 'application/octet-stream'
+        return f, content_type
+
+    def write(self, key, chunks):
+        """Write an image into the cache from an iterable of byte chunks."""
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix='.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            self._unlink(temp_path)
+            raise
+
+        if self._pruned_at + self.prune_interval < time.monotonic():
+            self.prune_in_background()
+
+    def delete(self, key):
+        """Forget the image with the given key, if it is cached."""
+        self._unlink(self.path(key))
+
+    def prune_in_background(self):
+        """Start pruning the cache in a background thread, unless it is already being pruned."""
+        if not self._pruning.acquire(blocking=False):
+            return
+        self._pruned_at = time.monotonic()
+
+        def run():
+            try:
+                self.prune()
+            finally:
+                self._pruning.release()
+
+        threading.Thread(target=run, name='disk-cache-prune', daemon=True).start()
+
+    def prune(self):
+        """
+        Delete the cached images written more than `max_age` ago, then the least recently served
+        ones until the cache holds at most `max_bytes`.
+
+        Returns:
+            The number of images deleted.
+        """
+        self._pruned_at = time.monotonic()
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_atime, stat.st_mtime, stat.st_size, path))
+
+        files.sort()
+        total = sum(size for _, _, size, _ in files)
+        cutoff = time.time() - self.max_age if self.max_age is not None else None
+        deleted = 0
+        for _, mtime, size, path in files:
+            if total <= self.max_bytes and (cutoff is None or mtime >= cutoff):
+                break
+            self._unlink(path)
+            total -= size
+            deleted += 1
+        return deleted
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def read_mapped(f, start, end):
+    """Return the bytes of a file from `start` up to `end` (exclusive) through a memory map, and close it."""
+    with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return mapped[start:end]
+
+
+_image_cache = None
+_disk_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache():
+    """Return the image cache of this process, configured by the `IMAGE_CACHE_*` settings."""
+    global _image_cache
+    with _image_cache_lock:
+        if _image_cache is None:
+            _image_cache = ImageCache(
+                settings.IMAGE_CACHE_MAX_MB * 1024 * 1024, ttl=settings.IMAGE_CACHE_TTL,
+            )
+        return _image_cache
+
+
+def get_disk_image_cache():
+    """
+    Return the image cache shared by the processes of this host, configured by the
+    `IMAGE_DISK_CACHE_*` settings, or `None` if `IMAGE_DISK_CACHE_ROOT` is not set.
+    """
+    global _disk_image_cache
+    if not settings.IMAGE_DISK_CACHE_ROOT:
+        return None
+    with _image_cache_lock:
+        if _disk_image_cache is None:
+            _disk_image_cache = DiskImageCache(
+                settings.IMAGE_DISK_CACHE_ROOT,
+                settings.IMAGE_DISK_CACHE_MAX_MB * 1024 * 1024,
+                max_age=settings.IMAGE_DISK_CACHE_MAX_AGE,
+            )
+        return _disk_image_cache
+
+
+def cache_image(key, image):
+    """
+    Cache a `CachedImage` with the given `(uuid, variant)` key on disk, shared by the processes
+    of this host, or in the memory of this process if there is no disk cache.
+    """
+    disk_cache = get_disk_image_cache()
+    if disk_cache is not None:
+        disk_cache.write(key, [image.data])
+    elif get_image_cache().accepts(len(image.data)):
+        get_image_cache().set(key, image)
+
+
+@receiver(setting_changed)
+def reset_image_cache(setting, **kwargs):
+    """Start over with new image caches when their settings change (in tests)."""
+    global _image_cache, _disk_image_cache
+    if setting.startswith('IMAGE_CACHE_'):
+        with _image_cache_lock:
+            _image_cache = None
+    elif setting.startswith('IMAGE_DISK_CACHE_'):
+        with _image_cache_lock:
+            _disk_image_cache = None
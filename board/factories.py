@@ -0,0 +1,114 @@
+"""
+Fast factories of boards, posts and photos, for tests and local data sets.
+
+Everything is inserted with `bulk_create`, a few queries per thousand rows, so a board with tens
+of thousands of posts takes seconds to create. Photos are stored with the `blob` backend,
+whatever `IMAGE_STORAGE` is, so no storage backend is involved. By default every photo is the
+same tiny GIF, but photos of any size can be synthesized with `board.images.synthesize_png`.
+
+Boards are created on their shard (see `board.sharding`), with their posts and photos.
+
+Given a `random.Random`, the factories generate the uuids and contents of everything from it,
+so the same seed always produces the same data.
+"""
+import random
+import uuid
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from board.images import ImageInfo, synthesize_png
+from board.models import Board, Image, Post, PostImage
+from board.sharding import make_image_uuid, shard_for
+from board.storage import BlobStorage
+
+# The smallest valid GIF (a single transparent pixel), used as the photo of generated posts.
+PHOTO = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00'
+    b',\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+)
+PHOTO_INFO = ImageInfo('gif', 'image/gif', 1, 1)
+
+# The number of rows inserted per query.
+BATCH_SIZE = 1000
+
+WORDS = [
+    'happy', 'birthday', 'congratulations', 'thank', 'you', 'miss', 'we', 'love', 'the', 'best',
+    'team', 'ever', 'good', 'luck', 'welcome', 'see', 'soon', 'memories', 'friends', 'always',
+]
+
+
+def make_uuid(rng=None):
+    """Return a random uuid4, drawn from `rng` if given."""
+    if rng is None:
+        return uuid.uuid4()
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def make_image(name='photo', photo=PHOTO, info=PHOTO_INFO, rng=None, board=None):
+    """Return a new, unsaved image of the given photo and `ImageInfo`, for a board if given."""
+    return Image(
+        uuid=make_image_uuid(board.uuid, rng) if board is not None else make_uuid(rng),
+        name=name,
+        photo=photo,
+        content_type=info.content_type,
+        width=info.width,
+        height=info.height,
+        storage=BlobStorage.name,
+        size=len(photo),
+    )
+
+
+def create_board(title='board', description='a generated board', rng=None, **fields):
+    """Create and return a board, on its shard."""
+    board = Board(uuid=make_uuid(rng), title=title, description=description, **fields)
+    board.save(using=shard_for(board.uuid))
+    return board
+
+
+def create_posts(board, count, photos_per_post=1, start=None, interval=timedelta(seconds=1),
+                 photos=None, rng=None):
+    """
+    Create posts on a board with `bulk_create`, and return them, oldest first.
+
+    Params:
+        board -> `Board`: the board to post on.
+        count -> `int`: the number of posts.
+        photos_per_post -> `int`: the number of photos of every post.
+        start -> `datetime`: the creation time of the oldest post. Defaults to the time such
+            that the newest post is created now.
+        interval -> `timedelta`: the time between two consecutive posts.
+        photos -> `list` of `(bytes, ImageInfo)`: the photos to pick from. Defaults to a tiny GIF.
+        rng -> `random.Random`: the source of the uuids, messages and photo picks, if given.
+    """
+    if start is None:
+        start = timezone.now() - interval * (count - 1)
+    if photos is None:
+        photos = [(PHOTO, PHOTO_INFO)]
+    pick = rng or random
+
+    posts = []
+    images = []
+    post_images = []
+    for i in range(count):
+        post = Post(
+            uuid=make_uuid(rng),
+            associated_board=board,
+            name=f'author {i}',
+            message=' '.join(pick.choices(WORDS, k=pick.randint(1, 12))),
+            created_at=start + interval * i,
+        )
+        posts.append(post)
+        for order in range(photos_per_post):
+            photo, info = pick.choice(photos)
+            image = make_image(f'photo {order}', photo, info, rng, board)
+            images.append(image)
+            post_images.append(PostImage(post_id=post.uuid, image_id=image.uuid, order=order))
+
+    using = board._state.db
+    with transaction.atomic(using=using):
+        Post.objects.using(using).bulk_create(posts, batch_size=BATCH_SIZE)
+        Image.objects.using(using).bulk_create(images, batch_size=BATCH_SIZE)
+        PostImage.objects.using(using).bulk_create(post_images, batch_size=BATCH_SIZE)
+    return posts
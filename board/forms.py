@@ -1,24 +1,110 @@
 from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+from board.images import sniff_image
+
+
+class PhotoField(forms.FileField):
+    """
+    A file field only accepting images, validated from their headers.
+
+    Unlike `forms.ImageField`, which opens every upload with Pillow to verify it, this only reads
+    the format and dimensions from the image headers with `board.images.sniff_image`. Images
+    with more than `MAX_IMAGE_PIXELS` pixels are rejected, since decoding them later could
+    exhaust memory.
+
+    Like `forms.ImageField`, the cleaned file is annotated with a `content_type`, and with an
+    `image_info` attribute holding its `board.images.ImageInfo`.
+    """
+    default_error_messages = {
+        'invalid_image': 'Upload a valid image. The file you uploaded was either not an image '
+                         'or a corrupted image.',
+        'too_many_pixels': 'Upload a smaller image. The image you uploaded has more than '
+                           '%(max)d pixels.',
+    }
+
+    def to_python(self, data):
+        """Check that the file-upload field data contains a supported, reasonably sized image."""
+        f = super().to_python(data)
+        if f is None:
+            return None
+
+        try:
+            info = sniff_image(f)
+        except (ValueError, OSError) as e:
+            raise ValidationError(
+                self.error_messages['invalid_image'], code='invalid_image'
+            ) from e
+
+        if info.width * info.height > settings.MAX_IMAGE_PIXELS:
+            raise ValidationError(
+                self.error_messages['too_many_pixels'],
+                code='too_many_pixels',
+                params={'max': settings.MAX_IMAGE_PIXELS},
+            )
+
+        f.image_info = info
+        f.content_type = info.content_type
+        return f
+
+
+class MultiplePhotoInput(forms.ClearableFileInput):
+    """A file input accepting multiple files, all of which are passed on to the field."""
+
+    def __init__(self, attrs=None):
+        super().__init__({'multiple': True, **(attrs or {})})
+
+    def value_from_datadict(self, data, files, name):
+        """Return every file uploaded under this input's name."""
+        return files.getlist(name)
+
+
+class MultiplePhotoField(PhotoField):
+    """
+    A `PhotoField` accepting a list of photos, each of which is validated on its own.
+
+    The cleaned value is a list of files, which is empty if nothing was uploaded.
+    """
+    widget = MultiplePhotoInput
+    default_error_messages = {
+        'too_many_photos': 'Upload at most %(max)d photos.',
+    }
+
+    def clean(self, data, initial=None):
+        """
+        Clean every uploaded photo, making sure there are not too many of them. They are counted
+        first, so a request with too many photos is refused without reading any of them.
+        """
+        data = data or []
+        if len(data) > settings.MAX_PHOTOS_PER_POST:
+            raise ValidationError(
+                self.error_messages['too_many_photos'],
+                code='too_many_photos',
+                params={'max': settings.MAX_PHOTOS_PER_POST},
+            )
+        photos = [super(MultiplePhotoField, self).clean(photo, initial) for photo in data]
+        return [photo for photo in photos if photo]
+
 
 class PostForm(forms.Form):
     """
     A form representing the creation of a new post.
 
-    The post may contain a name, message, or photo(s). None of the fields are required. 
-    However, at least either of the message or photo
+    The post may contain a name, message, or photo(s), and is posted to the board with the given
+    uuid. Only the board is required. However, at least either of the message or photo
     must exist for this to be a valid post.
 
     Class Attributes
+        board -> UUID: the uuid of the board the post is created on
         name -> string: the author's name
         message -> string: the message being written in the post
-        photo -> ImageFiles: the photo(s) attached to the post    
+        photo -> list of ImageFiles: the photo(s) attached to the post
     """
+    board = forms.UUIDField()
     name = forms.CharField(max_length=50, required=False)
     message = forms.CharField(max_length=500, required=False)
-    photo = forms.ImageField(
-        widget=forms.ClearableFileInput(attrs={'multiple': True}), 
-        required=False
-    )
+    photo = MultiplePhotoField(required=False)
 
     def clean(self):
         """
@@ -32,7 +118,7 @@ class PostForm(forms.Form):
         The data is invalid if both `photo` field and `message` field do not exist.
         """
         cleaned_data = super().clean()
-        if (cleaned_data.get('message') is None and self.cleaned_data('photo') is None):
+        if (not cleaned_data.get('message') and not cleaned_data.get('photo')):
             error = 'At least one photo or message must exist.'
             self.add_error('message', error)
             self.add_error('photo', error)
@@ -0,0 +1,434 @@
+"""
+Lightweight helpers for uploaded images.
+
+Django's `ImageField` verifies every upload by opening it with Pillow, which decodes far more
+than needed for large phone photos. The helpers here only ever look at the headers of the
+supported formats (JPEG, PNG, GIF and WebP): `sniff_image` reads the format and dimensions,
+and `iter_stripped` copies an image while dropping its metadata, one segment at a time, so
+neither needs the whole image in memory.
+
+The only helpers decoding images are `make_placeholder` and `make_thumbnail`, which use Pillow.
+Pillow is imported when it is first needed, so serving requests never pays for importing it.
+
+This module does not need Django, so `process_photo` may run in other processes (see
+`board.processing`).
+"""
+import base64
+import io
+import random
+import struct
+import zlib
+from collections import namedtuple
+
+ImageInfo = namedtuple('ImageInfo', ['format', 'content_type', 'width', 'height'])
+Placeholder = namedtuple('Placeholder', ['data_uri', 'color'])
+ProcessedPhoto = namedtuple('ProcessedPhoto', ['data', 'thumbnail'])
+ImageInfo.__doc__ = """
+The format and display dimensions of an image, as read from its headers.
+
+Fields:
+    format -> `string`: the image format, one of 'jpeg', 'png', 'gif' or 'webp'.
+    content_type -> `string`: the MIME type of the image.
+    width -> `int`: the width in pixels, after applying any EXIF orientation.
+    height -> `int`: the height in pixels, after applying any EXIF orientation.
+"""
+
+Placeholder.__doc__ = """
+A low quality preview of an image, small enough to be sent along with JSON.
+
+Fields:
+    data_uri -> `string`: a `data:` URI of a tiny PNG version of the image.
+    color -> `string`: the dominant colour of the image, as a `#rrggbb` hex string.
+"""
+
+ProcessedPhoto.__doc__ = """
+An uploaded photo, processed by `process_photo`.
+
+Fields:
+    data -> `bytes`: the photo without its metadata, as `iter_stripped` yields it.
+    thumbnail -> `(string, bytes)`: the content type and bytes of its thumbnail, as
+        `make_thumbnail` returns it, or `None` if the photo cannot be decoded.
+"""
+
+CHUNK_SIZE = 64 * 1024
+
+# The longest side of placeholder images, in pixels, and their number of colours. Browsers
+# scale the placeholder up with smoothing, so this is enough for a blurred preview.
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_COLORS = 32
+
+# The longest side of thumbnails, in pixels, enough for the cells of a feed grid on high density
+# screens, and the quality of JPEG thumbnails.
+THUMBNAIL_SIZE = 320
+THUMBNAIL_QUALITY = 80
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Ancillary PNG chunks only carrying metadata, which are dropped when stripping.
+PNG_METADATA_CHUNKS = {b'eXIf', b'tEXt', b'zTXt', b'iTXt', b'tIME'}
+
+# JPEG start of frame markers, which carry the image dimensions.
+JPEG_SOF_MARKERS = {
+    0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF,
+}
+# JPEG markers without a length field.
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+JPEG_SOS = 0xDA
+JPEG_APP1 = 0xE1
+# JPEG segments only carrying metadata (EXIF/XMP, Photoshop/IPTC and comments), which are
+# dropped when stripping. Colour related segments such as ICC profiles are kept.
+JPEG_METADATA_MARKERS = {JPEG_APP1, 0xED, 0xFE}
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def _read_exact(f, size):
+    """Read exactly `size` bytes from `f`, raising `ValueError` on a truncated file."""
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError('Truncated image.')
+    return data
+
+
+def _copy(f, size):
+    """Yield the next `size` bytes of `f` in chunks of at most `CHUNK_SIZE` bytes."""
+    while size > 0:
+        data = _read_exact(f, min(size, CHUNK_SIZE))
+        size -= len(data)
+        yield data
+
+
+def _exif_orientation(segment):
+    """
+    Return the EXIF orientation stored in the payload of a JPEG APP1 segment.
+
+    Returns `None` if the segment is not EXIF (e.g. XMP) or carries no orientation.
+    """
+    if not segment.startswith(b'Exif\x00\x00'):
+        return None
+    tiff = segment[6:]
+    if tiff[:2] == b'II':
+        endian = '<'
+    elif tiff[:2] == b'MM':
+        endian = '>'
+    else:
+        return None
+
+    try:
+        ifd_offset, = struct.unpack_from(endian + 'I', tiff, 4)
+        entries, = struct.unpack_from(endian + 'H', tiff, ifd_offset)
+        for i in range(entries):
+            tag, _, _, value = struct.unpack_from(endian + 'HHIH', tiff, ifd_offset + 2 + i * 12)
+            if tag == EXIF_ORIENTATION_TAG:
+                return value if 1 <= value <= 8 else None
+    except struct.error:
+        return None
+    return None
+
+
+def _exif_orientation_segment(orientation):
+    """Return a minimal JPEG APP1 segment holding only the given EXIF orientation."""
+    tiff = b'II*\x00' + struct.pack('<IHHHIHHI', 8, 1, EXIF_ORIENTATION_TAG, 3, 1, orientation, 0, 0)
+    payload = b'Exif\x00\x00' + tiff
+    return struct.pack('>BBH', 0xFF, JPEG_APP1, len(payload) + 2) + payload
+
+
+def _jpeg_segments(f):
+    """
+    Yield the `(marker, payload)` of each JPEG segment up to and including the start of scan.
+
+    The file is left at the beginning of the entropy coded data following the start of scan.
+    """
+    if _read_exact(f, 2) != b'\xff\xd8':
+        raise ValueError('Not a JPEG image.')
+
+    while True:
+        if _read_exact(f, 1) != b'\xff':
+            raise ValueError('Malformed JPEG image.')
+        marker = _read_exact(f, 1)[0]
+        # Markers may be preceded by any number of fill bytes.
+        while marker == 0xFF:
+            marker = _read_exact(f, 1)[0]
+
+        if marker in JPEG_STANDALONE_MARKERS:
+            yield marker, b''
+            continue
+
+        length, = struct.unpack('>H', _read_exact(f, 2))
+        if length < 2:
+            raise ValueError('Malformed JPEG image.')
+        yield marker, _read_exact(f, length - 2)
+        if marker == JPEG_SOS:
+            return
+
+
+def _sniff_jpeg(f):
+    """Return the `ImageInfo` of a JPEG image."""
+    orientation = None
+    for marker, payload in _jpeg_segments(f):
+        if marker == JPEG_APP1 and orientation is None:
+            orientation = _exif_orientation(payload)
+        elif marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack_from('>HH', payload, 1)
+            # Orientations 5 to 8 rotate the image by 90 degrees when displayed.
+            if orientation is not None and orientation >= 5:
+                width, height = height, width
+            return ImageInfo('jpeg', 'image/jpeg', width, height)
+        elif marker == JPEG_SOS:
+            break
+    raise ValueError('JPEG image has no frame header.')
+
+
+def _sniff_png(f):
+    """Return the `ImageInfo` of a PNG image."""
+    header = _read_exact(f, 24)
+    if header[:8] != PNG_SIGNATURE or header[12:16] != b'IHDR':
+        raise ValueError('Not a PNG image.')
+    width, height = struct.unpack_from('>II', header, 16)
+    return ImageInfo('png', 'image/png', width, height)
+
+
+def _sniff_gif(f):
+    """Return the `ImageInfo` of a GIF image."""
+    header = _read_exact(f, 10)
+    if header[:6] not in (b'GIF87a', b'GIF89a'):
+        raise ValueError('Not a GIF image.')
+    width, height = struct.unpack_from('<HH', header, 6)
+    return ImageInfo('gif', 'image/gif', width, height)
+
+
+def _sniff_webp(f):
+    """Return the `ImageInfo` of a WebP image."""
+    header = _read_exact(f, 30)
+    if header[:4] != b'RIFF' or header[8:12] != b'WEBP':
+        raise ValueError('Not a WebP image.')
+
+    chunk = header[12:16]
+    if chunk == b'VP8X':
+        width = int.from_bytes(header[24:27], 'little') + 1
+        height = int.from_bytes(header[27:30], 'little') + 1
+    elif chunk == b'VP8 ':
+        width, height = struct.unpack_from('<HH', header, 26)
+        width, height = width & 0x3FFF, height & 0x3FFF
+    elif chunk == b'VP8L':
+        bits, = struct.unpack_from('<I', header, 21)
+        width = (bits & 0x3FFF) + 1
+        height = ((bits >> 14) & 0x3FFF) + 1
+    else:
+        raise ValueError('Unknown WebP image.')
+    return ImageInfo('webp', 'image/webp', width, height)
+
+
+SNIFFERS = [
+    (b'\xff\xd8', _sniff_jpeg),
+    (PNG_SIGNATURE, _sniff_png),
+    (b'GIF8', _sniff_gif),
+    (b'RIFF', _sniff_webp),
+]
+
+
+def sniff_image(f):
+    """
+    Return the `ImageInfo` of an image file by reading its headers only.
+
+    Params:
+        f -> file-like: a readable and seekable binary file, read from its current position.
+
+    Returns:
+        The `ImageInfo` of the image. The file is rewound to where it started.
+
+    Raises:
+        `ValueError` if the file is not one of the supported formats or is malformed.
+    """
+    start = f.tell()
+    try:
+        magic = f.read(8)
+        for signature, sniffer in SNIFFERS:
+            if magic.startswith(signature):
+                f.seek(start)
+                return sniffer(f)
+        raise ValueError('Unsupported image format.')
+    finally:
+        f.seek(start)
+
+
+def _iter_stripped_jpeg(f):
+    """Yield the bytes of a JPEG image without its metadata segments."""
+    yield b'\xff\xd8'
+    orientation = None
+    for marker, payload in _jpeg_segments(f):
+        if marker == JPEG_APP1 and orientation is None:
+            orientation = _exif_orientation(payload)
+        if marker in JPEG_METADATA_MARKERS:
+            continue
+        if marker in JPEG_SOF_MARKERS and orientation not in (None, 1):
+            # Keep the orientation, or the photo would be displayed sideways.
+            yield _exif_orientation_segment(orientation)
+            orientation = None
+        if marker in JPEG_STANDALONE_MARKERS:
+            yield bytes((0xFF, marker))
+        else:
+            yield struct.pack('>BBH', 0xFF, marker, len(payload) + 2) + payload
+
+    # Everything after the start of scan is image data.
+    while True:
+        data = f.read(CHUNK_SIZE)
+        if not data:
+            return
+        yield data
+
+
+def _iter_stripped_png(f):
+    """Yield the bytes of a PNG image without its metadata chunks."""
+    yield _read_exact(f, 8)
+    while True:
+        header = f.read(8)
+        if not header:
+            return
+        if len(header) != 8:
+            raise ValueError('Truncated image.')
+        length, = struct.unpack_from('>I', header)
+        chunk = header[4:]
+        if chunk in PNG_METADATA_CHUNKS:
+            # Skip the chunk data and its CRC.
+            f.seek(length + 4, 1)
+            continue
+        yield header
+        yield from _copy(f, length + 4)
+        if chunk == b'IEND':
+            return
+
+
+def iter_stripped(f, info):
+    """
+    Yield the bytes of an image with its metadata removed, in chunks.
+
+    JPEG EXIF/XMP, IPTC and comment segments, and PNG text, EXIF and time chunks are dropped
+    without decoding the image. The EXIF orientation of a JPEG is kept in a minimal EXIF segment
+    so photos are still displayed upright. GIF and WebP images are copied unchanged.
+
+    Params:
+        f -> file-like: a readable and seekable binary file positioned at the start of the image.
+        info -> `ImageInfo`: the info returned by `sniff_image` for this file.
+
+    Returns:
+        A generator of `bytes`, none longer than a JPEG/PNG segment or `CHUNK_SIZE` bytes.
+    """
+    if info.format == 'jpeg':
+        yield from _iter_stripped_jpeg(f)
+    elif info.format == 'png':
+        yield from _iter_stripped_png(f)
+    else:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                return
+            yield data
+
+
+def make_placeholder(data):
+    """
+    Return the `Placeholder` of an image, or `None` if it cannot be decoded.
+
+    JPEGs are decoded at the smallest scale their DCT allows (`draft` mode), so even large
+    photos are never decoded at full size. The preview is a `PLACEHOLDER_SIZE` pixel PNG with a
+    palette of `PLACEHOLDER_COLORS`, which is a few hundred bytes once base64 encoded, and the
+    dominant colour is the most common colour of that palette.
+
+    Params:
+        data -> `bytes`: the image.
+    """
+    from PIL import Image as PillowImage, ImageOps, UnidentifiedImageError
+
+    try:
+        with PillowImage.open(io.BytesIO(data)) as image:
+            image.draft('RGB', (PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            image.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+
+    image = image.quantize(colors=PLACEHOLDER_COLORS)
+    _, index = max(image.getcolors())
+    red, green, blue = image.getpalette()[index * 3:index * 3 + 3]
+
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG', optimize=True)
+    data_uri = 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+    return Placeholder(data_uri, f'#{red:02x}{green:02x}{blue:02x}')
+
+
+def make_thumbnail(data, size=THUMBNAIL_SIZE):
+    """
+    Return a thumbnail of an image, as `(content_type, bytes)`, or `None` if it cannot be decoded.
+
+    The thumbnail fits in a `size` pixel square, upright according to any EXIF orientation, and
+    is never larger than the image. JPEGs are decoded at the smallest scale their DCT allows
+    above the thumbnail size (`draft` mode). Images with transparency get a PNG thumbnail, and
+    others a JPEG of `THUMBNAIL_QUALITY`.
+
+    Params:
+        data -> `bytes`: the image.
+        size -> `int`: the longest side of the thumbnail, in pixels.
+    """
+    from PIL import Image as PillowImage, ImageOps, UnidentifiedImageError
+
+    try:
+        with PillowImage.open(io.BytesIO(data)) as image:
+            image.draft('RGB', (size, size))
+            image = ImageOps.exif_transpose(image)
+            transparent = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+            image = image.convert('RGBA' if transparent else 'RGB')
+            image.thumbnail((size, size))
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+
+    buffer = io.BytesIO()
+    if transparent:
+        image.save(buffer, 'PNG', optimize=True)
+        return 'image/png', buffer.getvalue()
+    image.save(buffer, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+    return 'image/jpeg', buffer.getvalue()
+
+
+def process_photo(data, info, thumbnail_size=THUMBNAIL_SIZE):
+    """
+    Strip an uploaded photo of its metadata and make its thumbnail, as a `ProcessedPhoto`.
+
+    This is all the CPU bound work done on an upload, in one call on picklable arguments.
+
+    Params:
+        data -> `bytes`: the photo as uploaded.
+        info -> `ImageInfo`: the info returned by `sniff_image` for the photo.
+        thumbnail_size -> `int`: the longest side of the thumbnail, in pixels.
+
+    Raises:
+        `ValueError` if the photo is malformed past its headers.
+    """
+    stripped = b''.join(iter_stripped(io.BytesIO(data), info))
+    return ProcessedPhoto(stripped, make_thumbnail(stripped, thumbnail_size))
+
+
+def png_chunk(kind, data):
+    """Return a PNG chunk of the given 4 byte type holding `data`, with its length and CRC."""
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def synthesize_png(seed, width, height):
+    """
+    Return a synthetic RGB PNG of the given size and its `ImageInfo`, to seed test data sets.
+
+    The pixels are random noise, so the PNG compresses about as badly as a photo. It only
+    depends on the arguments, and this module does not need Django, so photos may be
+    synthesized in other processes.
+    """
+    rng = random.Random(seed)
+    rows = b''.join(
+        b'\x00' + rng.getrandbits(width * 24).to_bytes(width * 3, 'little') for _ in range(height)
+    )
+    data = b''.join([
+        PNG_SIGNATURE,
+        png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+        png_chunk(b'IDAT', zlib.compress(rows, 1)),
+        png_chunk(b'IEND', b''),
+    ])
+    return data, ImageInfo('png', 'image/png', width, height)
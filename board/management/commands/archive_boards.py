@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from board.archive import archive_board, inactive_boards
+from board.routers import using_shard
+
+
+class Command(BaseCommand):
+    """
+    Move the images of inactive boards into compressed archive packs.
+
+    Meant to be run periodically, e.g. daily with Heroku Scheduler or cron:
+    ```
+    python manage.py archive_boards --days 365
+    ```
+    See `board.archive` for how images are archived and restored. Every shard is archived in
+    turn (see `board.sharding`).
+    """
+    help = 'Move the images of boards without recent activity into compressed archive packs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.BOARD_ARCHIVE_AFTER_DAYS,
+            help='Archive boards without activity for this many days.',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only list the boards which would be archived.',
+        )
+
+    def handle(self, *args, days, dry_run, **options):
+        total = 0
+        for alias in settings.BOARD_SHARDS:
+            with using_shard(alias):
+                for board in inactive_boards(days).iterator():
+                    if dry_run:
+                        self.stdout.write(f'Would archive {board}')
+                        continue
+                    count = archive_board(board)
+                    total += count
+                    if count:
+                        self.stdout.write(f'Archived {count} images of {board}')
+        if not dry_run:
+            self.stdout.write(self.style.SUCCESS(f'Archived {total} images.'))
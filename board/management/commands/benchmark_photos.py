@@ -0,0 +1,86 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+
+from board.images import process_photo, synthesize_png
+from board.processing import PhotoProcessor
+
+
+class Command(BaseCommand):
+    """
+    Measure the throughput of photo processing with pools of growing numbers of processes.
+
+    A batch of multi-photo posts is processed as `CreatePost` would, by one thread per post at
+    once: first in the threads themselves, then with a `PhotoProcessor` of every `--workers`
+    count. Nothing is written to the database.
+    ```
+    python manage.py benchmark_photos --posts 32 --photos 4 --photo-size 2000x1500 --workers 1,2,4,8
+    ```
+    The throughput should grow with the number of processes up to the number of cores.
+    """
+    help = 'Measure the throughput of photo processing with pools of growing numbers of processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=32, help='The number of posts.')
+        parser.add_argument('--photos', type=int, default=4, help='The number of photos per post.')
+        parser.add_argument(
+            '--photo-size', default='1600x1200',
+            help='The size of the synthetic photos, as WIDTHxHEIGHT.',
+        )
+        parser.add_argument(
+            '--workers', default=','.join(str(2 ** i) for i in range((os.cpu_count() or 1).bit_length())),
+            help='The comma separated numbers of processes to measure. Defaults to powers of two '
+                 'up to the number of cores.',
+        )
+
+    def handle(self, *args, posts, photos, photo_size, workers, **options):
+        try:
+            width, height = (int(side) for side in photo_size.split('x'))
+            worker_counts = [int(count) for count in workers.split(',')]
+        except ValueError:
+            raise CommandError('Invalid --photo-size or --workers.')
+
+        # A few distinct photos are enough, every upload is processed anyway.
+        pool = [synthesize_png(seed, width, height) for seed in range(min(posts * photos, 8))]
+        batch = [[pool[(post * photos + i) % len(pool)] for i in range(photos)] for post in range(posts)]
+        total = posts * photos
+        self.stdout.write(f'{posts} posts of {photos} {width}x{height} photos, on {os.cpu_count()} cores')
+
+        baseline = self.measure(batch, None)
+        self.report('in the worker', total, baseline, baseline)
+        for count in worker_counts:
+            processor = PhotoProcessor(count, max_pending=max(total, 1))
+            try:
+                # The processes are started before measuring, as they are in production.
+                processor.submit(*pool[0]).result()
+                self.report(f'{count} processes', total, self.measure(batch, processor), baseline)
+            finally:
+                processor.shutdown()
+
+    def measure(self, batch, processor):
+        """Return the seconds taken to process a batch of posts, each in its own thread."""
+        def create(post):
+            uploads = []
+            for data, info in post:
+                f = SimpleUploadedFile('photo.png', data, info.content_type)
+                f.image_info = info
+                uploads.append(f)
+            if processor is not None:
+                processor.process(uploads)
+            else:
+                for f in uploads:
+                    f.processed_photo = process_photo(f.read(), f.image_info)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(len(batch)) as threads:
+            list(threads.map(create, batch))
+        return time.perf_counter() - start
+
+    def report(self, label, total, seconds, baseline):
+        """Write the throughput of a run, and its speedup over processing in the worker."""
+        self.stdout.write(
+            f'{label:>16}: {total / seconds:8.1f} photos/s  {seconds:7.2f}s  x{baseline / seconds:.2f}'
+        )
@@ -0,0 +1,51 @@
+from uuid import UUID
+
+from django.core.management.base import BaseCommand, CommandError
+
+from board.models import Board
+from board.sharding import board_shard
+from board.snapshots import freeze_board, unfreeze_board
+
+
+class Command(BaseCommand):
+    """
+    Close boards and publish them as static snapshots, or reopen them.
+
+    ```
+    python manage.py freeze_board <board uuid> [<board uuid> ...]
+    python manage.py freeze_board --unfreeze <board uuid>
+    ```
+    Freezing a frozen board publishes its snapshot again, e.g. after moderating its posts. See
+    `board.snapshots` for what a snapshot holds.
+    """
+    help = 'Close boards and publish them as static snapshots, or reopen them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('boards', nargs='+', help='The uuids of the boards.')
+        parser.add_argument(
+            '--unfreeze', action='store_true',
+            help='Delete the snapshots of the boards and open them for posts again.',
+        )
+        parser.add_argument('--page-size', type=int, help='The number of posts per feed page.')
+
+    def handle(self, *args, boards, unfreeze, page_size, **options):
+        for board_uuid in boards:
+            try:
+                key = UUID(board_uuid)
+            except ValueError:
+                raise CommandError(f'Board {board_uuid} does not exist.')
+
+            with board_shard(key):
+                try:
+                    board = Board.objects.get(uuid=key)
+                except Board.DoesNotExist:
+                    raise CommandError(f'Board {board_uuid} does not exist.')
+
+                if unfreeze:
+                    unfreeze_board(board)
+                    self.stdout.write(self.style.SUCCESS(f'Unfroze {board}'))
+                else:
+                    manifest = freeze_board(board, page_size)
+                    self.stdout.write(self.style.SUCCESS(
+                        f'Froze {board}: {manifest["posts"]} posts, {len(manifest["images"])} images.'
+                    ))
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from board.profiling import make_profile_token
+
+
+class Command(BaseCommand):
+    """
+    Print a token asking for requests to be profiled, to send in their `X-Profile` header:
+    ```
+    curl -H "X-Profile: $(python manage.py profile_token)" https://example.com/api/board/posts/get?...
+    ```
+    The token is signed with `SECRET_KEY`, and valid for `PROFILE_TOKEN_MAX_AGE` seconds. See
+    `board.profiling` for how requests are profiled.
+    """
+    help = 'Print a token asking for requests to be profiled, for their X-Profile header.'
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_profile_token())
+        self.stderr.write(f'Valid for {settings.PROFILE_TOKEN_MAX_AGE} seconds.')
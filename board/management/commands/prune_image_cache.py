@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from board.cache import get_disk_image_cache
+
+
+class Command(BaseCommand):
+    """
+    Delete the expired and least recent images from the disk image cache.
+
+    Worker processes already prune the cache in the background as they write to it, but hosts
+    serving only cached images never do, so this may also be run periodically with cron:
+    ```
+    python manage.py prune_image_cache
+    ```
+    See `board.cache` for how images are cached.
+    """
+    help = 'Delete the expired and least recent images from the disk image cache.'
+
+    def handle(self, *args, **options):
+        disk_cache = get_disk_image_cache()
+        if disk_cache is None:
+            raise CommandError('IMAGE_DISK_CACHE_ROOT is not set.')
+        deleted = disk_cache.prune()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} cached images.'))
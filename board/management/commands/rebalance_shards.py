@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from board.models import Board
+from board.sharding import move_board, shard_for
+
+
+class Command(BaseCommand):
+    """
+    Move the boards held by another shard than their own to their shard.
+
+    Run it right after adding a shard to `DATABASE_SHARDS` and migrating it:
+    ```
+    python manage.py migrate --database shard2
+    python manage.py rebalance_shards
+    ```
+    Every board is frozen while it moves, and unavailable until moved. See `board.sharding` for
+    how boards are placed and moved.
+    """
+    help = 'Move the boards held by another shard than their own to their shard.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only list the boards which would be moved.',
+        )
+
+    def handle(self, *args, dry_run, **options):
+        moved = 0
+        for source in settings.BOARD_SHARDS:
+            boards = Board.objects.using(source).values_list('uuid', flat=True)
+            # The boards are listed first, since moving them deletes them from the shard.
+            for board_uuid in list(boards):
+                target = shard_for(board_uuid)
+                if target == source:
+                    continue
+                if dry_run:
+                    self.stdout.write(f'Would move board {board_uuid} from {source} to {target}')
+                    continue
+                posts = move_board(board_uuid, source, target)
+                moved += 1
+                self.stdout.write(f'Moved board {board_uuid} with {posts} posts from {source} to {target}')
+        if not dry_run:
+            self.stdout.write(self.style.SUCCESS(f'Moved {moved} boards.'))
@@ -0,0 +1,90 @@
+import itertools
+import multiprocessing
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from board.factories import create_board, create_posts
+from board.images import synthesize_png
+
+
+class Command(BaseCommand):
+    """
+    Fill the database with generated boards, posts and photos, for performance testing.
+
+    Rows are inserted with `bulk_create` (see `board.factories`), in one transaction per
+    `--chunk` posts, so millions of posts take minutes. The photos are a pool of synthetic PNGs,
+    picked at random for every post, which may be synthesized by several processes:
+    ```
+    python manage.py seed_boards --boards 10 --posts 100000 --photo-size 640x480 --workers 4 --seed 1
+    ```
+    The same `--seed` always generates the same uuids and contents. Posts are spread over the
+    `--days` days before the command is run.
+    """
+    help = 'Fill the database with generated boards, posts and photos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--boards', type=int, default=1, help='The number of boards.')
+        parser.add_argument('--posts', type=int, default=1000, help='The number of posts per board.')
+        parser.add_argument('--photos', type=int, default=1, help='The number of photos per post.')
+        parser.add_argument(
+            '--distinct-photos', type=int, default=20,
+            help='The number of different photos to synthesize and pick from.',
+        )
+        parser.add_argument(
+            '--photo-size', default='64x64',
+            help='The size of the synthesized photos, as WIDTHxHEIGHT pixels.',
+        )
+        parser.add_argument('--days', type=int, default=30, help='Spread the posts over this many days.')
+        parser.add_argument(
+            '--chunk', type=int, default=10_000, help='Insert this many posts per transaction.',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1, help='Synthesize the photos in this many processes.',
+        )
+        parser.add_argument('--seed', type=int, help='Generate the same data for the same seed.')
+
+    def handle(self, *args, boards, posts, photos, distinct_photos, photo_size, days, chunk,
+               workers, seed, **options):
+        try:
+            width, height = (int(side) for side in photo_size.lower().split('x'))
+        except ValueError:
+            raise CommandError(f'Invalid photo size {photo_size!r}, expected WIDTHxHEIGHT.')
+        if min(boards, posts, photos, distinct_photos, chunk, workers) < 0 or chunk == 0:
+            raise CommandError('Counts must not be negative, and --chunk must be positive.')
+
+        started = time.perf_counter()
+        rng = random.Random(seed)
+        pool = self.synthesize_photos(rng, distinct_photos if photos else 0, width, height, workers)
+
+        interval = timedelta(days=days) / max(posts, 1)
+        start = timezone.now() - timedelta(days=days)
+        for number in range(1, boards + 1):
+            board = create_board(title=f'Seeded board {number}', rng=rng)
+            for offset in range(0, posts, chunk):
+                create_posts(
+                    board,
+                    min(chunk, posts - offset),
+                    photos_per_post=photos if pool else 0,
+                    start=start + interval * offset,
+                    interval=interval,
+                    photos=pool,
+                    rng=rng,
+                )
+            self.stdout.write(f'Seeded {board} ({board.uuid}) with {posts} posts')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {boards} boards with {boards * posts} posts and {boards * posts * photos if pool else 0} '
+            f'photos in {time.perf_counter() - started:.1f}s.'
+        ))
+
+    def synthesize_photos(self, rng, count, width, height, workers):
+        """Return `count` synthetic photos, synthesized by `workers` processes."""
+        arguments = [(rng.getrandbits(64), width, height) for _ in range(count)]
+        if workers > 1 and count > 1:
+            with multiprocessing.Pool(workers) as pool:
+                return pool.starmap(synthesize_png, arguments)
+        return list(itertools.starmap(synthesize_png, arguments))
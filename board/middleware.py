@@ -0,0 +1,382 @@
+"""
+Middleware of the board app.
+"""
+import mimetypes
+import os
+import threading
+from contextlib import ExitStack
+from urllib.parse import urlencode
+from uuid import UUID
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, JsonResponse
+from django.middleware.clickjacking import XFrameOptionsMiddleware as BaseXFrameOptionsMiddleware
+from django.middleware.gzip import GZipMiddleware as BaseGZipMiddleware
+from django.urls import Resolver404, resolve
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from board import views
+from board.images import sniff_image
+from board.profiling import get_profile_ring, is_profile_requested, is_sampled, profile_request
+from board.staticfiles import ENCODINGS
+from board.routers import replica_reads
+from board.sharding import board_shard
+from board.snapshots import MANIFEST, image_path, load_manifest, snapshot_dir
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class StaticFilesMiddleware:
+    """
+    Serve the collected static files under `STATIC_URL` from `STATIC_ROOT`, in production.
+
+    Files hashed by `board.staticfiles.CompressedManifestStaticFilesStorage` never change, so
+    they may be cached by browsers and shared caches for a year. Other files must be revalidated
+    with `If-Modified-Since`. The smallest precompressed variant the browser accepts is sent, so
+    nothing is compressed while serving.
+
+    This is not used in development (`DEBUG`), where `runserver` serves the static files, nor
+    if `STATIC_URL` points at another host such as a CDN.
+    """
+
+    def __init__(self, get_response):
+        if settings.DEBUG or not settings.STATIC_ROOT or not settings.STATIC_URL.startswith('/'):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL
+        self.root = str(settings.STATIC_ROOT)
+        self.hashed_names = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+    def __call__(self, req):
+        if req.method not in SAFE_METHODS or not req.path_info.startswith(self.prefix):
+            return self.get_response(req)
+
+        name = req.path_info[len(self.prefix):]
+        try:
+            path = safe_join(self.root, name)
+        except SuspiciousFileOperation:
+            return self.get_response(req)
+        if not name or not os.path.isfile(path):
+            return self.get_response(req)
+
+        hashed = name in self.hashed_names
+        if not hashed:
+            mtime = os.stat(path).st_mtime
+            if not was_modified_since(req.META.get('HTTP_IF_MODIFIED_SINCE'), mtime):
+                return HttpResponseNotModified()
+
+        content_type, _ = mimetypes.guess_type(name)
+        encoding, variant = self.pick_variant(req, path)
+        response = FileResponse(open(variant, 'rb'), content_type=content_type or 'application/octet-stream')
+        del response['Content-Disposition']
+        if encoding:
+            response['Content-Encoding'] = encoding
+        patch_vary_headers(response, ['Accept-Encoding'])
+        if hashed:
+            patch_cache_control(response, public=True, max_age=60 * 60 * 24 * 365, immutable=True)
+        else:
+            patch_cache_control(response, public=True, no_cache=True)
+            response['Last-Modified'] = http_date(mtime)
+        return response
+
+    def pick_variant(self, req, path):
+        """Return the encoding and path of the best variant of a file the browser accepts."""
+        accepted = {
+            encoding.split(';')[0].strip()
+            for encoding in req.META.get('HTTP_ACCEPT_ENCODING', '').split(',')
+        }
+        for encoding, suffix, _ in ENCODINGS:
+            if encoding in accepted and os.path.isfile(path + suffix):
+                return encoding, path + suffix
+        return None, path
+
+
+class ProfilingMiddleware:
+    """
+    Profile the requests asking for it with a signed `X-Profile` header, and a sample of all
+    requests, keeping the profiles in the database (see `board.profiling`).
+
+    Everything after this middleware is profiled, down to the view. Responses to requests with a
+    valid token carry the id of their profile in `X-Profile-Id`, and the time taken by the
+    request and by its SQL queries in `Server-Timing`. Sampled responses are left as they are,
+    as they go to anyone. This is not used if `PROFILE_RING_SIZE` is 0.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILE_RING_SIZE:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, req):
+        requested = is_profile_requested(req)
+        if not requested and not is_sampled():
+            return self.get_response(req)
+
+        response, profile = profile_request(self.get_response, req, get_profile_ring())
+        if not requested:
+            return response
+        sql = sum(query.duration for query in profile.queries)
+        response['X-Profile-Id'] = str(profile.id)
+        response['Server-Timing'] = (
+            f'total;dur={profile.duration * 1000:.1f}, '
+            f'sql;desc="{len(profile.queries)} queries";dur={sql * 1000:.1f}'
+        )
+        return response
+
+
+class GZipMiddleware(BaseGZipMiddleware):
+    """
+    Compress responses for browsers that understand it, except for already compressed images.
+
+    JPEG, PNG, GIF and WebP images do not get any smaller, so compressing them would only cost
+    CPU time, and would turn streamed images into responses of unknown length. The same goes
+    for batches of images (`multipart/mixed`, see `views.GetImages`).
+    """
+
+    def process_response(self, request, response):
+        if response.get('Content-Type', '').startswith(('image/', 'multipart/')):
+            return response
+        return super().process_response(request, response)
+
+
+class PublicAPIMiddleware:
+    """
+    Mark the requests to the public board API, so the middleware it does not need skip them.
+
+    The public API is anonymous: its views (those whose class sets `public_api = True`) never
+    use sessions, users or messages, and answer with JSON or images, which cannot be framed for
+    clickjacking. The request's view is resolved here, before the middleware after this one
+    run, and `req.public_api` is set to whether it is part of the public API. The middleware
+    mixing in `PublicAPIExemptMixin` then pass those requests straight through.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, req):
+        try:
+            match = resolve(req.path_info, getattr(req, 'urlconf', None))
+        except Resolver404:
+            req.public_api = False
+        else:
+            req.public_api = getattr(getattr(match.func, 'view_class', None), 'public_api', False)
+        return self.get_response(req)
+
+
+class PublicAPIExemptMixin:
+    """
+    A middleware mixin skipping the middleware for requests to the public board API.
+
+    Must come after `PublicAPIMiddleware` in `MIDDLEWARE`.
+    """
+
+    def __call__(self, req):
+        if getattr(req, 'public_api', False):
+            return self.get_response(req)
+        return super().__call__(req)
+
+
+class XFrameOptionsMiddleware(PublicAPIExemptMixin, BaseXFrameOptionsMiddleware):
+    """`XFrameOptionsMiddleware` skipping the public board API, whose responses are not pages."""
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Serve the read only board API views from the read replicas.
+
+    Only views whose class sets `read_from_replica = True` are routed, and only for safe
+    methods. Replicas may lag behind the primary, so a client which just wrote something (e.g.
+    created a post) gets a cookie pinning its reads to the primary for `REPLICA_STICKY_SECONDS`,
+    so it always reads its own writes.
+    """
+    cookie_name = 'pin_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, req):
+        with ExitStack() as req.replica_reads:
+            response = self.get_response(req)
+
+        if req.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_cookie(
+                self.cookie_name, '1', max_age=settings.REPLICA_STICKY_SECONDS, samesite='Lax',
+            )
+        return response
+
+    def process_view(self, req, view_func, view_args, view_kwargs):
+        """Start reading from the replicas until the response is ready, if the view allows it."""
+        view_class = getattr(view_func, 'view_class', None)
+        if (getattr(view_class, 'read_from_replica', False)
+                and req.method in SAFE_METHODS
+                and self.cookie_name not in req.COOKIES):
+            req.replica_reads.enter_context(replica_reads())
+        return None
+
+
+class ShardRoutingMiddleware:
+    """
+    Serve the board API views from the shard of the board they are about (see `board.sharding`).
+
+    Views name the URL argument or param holding the uuid of the board, or of an image, in the
+    `shard_by` attribute of their class. Requests without a valid uuid there are left on the
+    default shard, where the view answers them as usual (e.g. with a 400 or 404).
+    """
+
+    def __init__(self, get_response):
+        if len(settings.BOARD_SHARDS) == 1:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, req):
+        with ExitStack() as req.shard_routing:
+            return self.get_response(req)
+
+    def process_view(self, req, view_func, view_args, view_kwargs):
+        """Send the queries of the view to the shard of its board until the response is ready."""
+        view_class = getattr(view_func, 'view_class', None)
+        shard_by = getattr(view_class, 'shard_by', None)
+        if shard_by is None:
+            return None
+        key = view_kwargs.get(shard_by) or req.GET.get(shard_by)
+        if key is None and req.method == 'POST':
+            key = req.POST.get(shard_by)
+        try:
+            key = key if isinstance(key, UUID) else UUID(key)
+        except (TypeError, ValueError):
+            return None
+        req.shard_routing.enter_context(board_shard(key))
+        return None
+
+
+class FrozenBoardMiddleware:
+    """
+    Answer the board API requests of frozen boards from their static snapshots, without any
+    database access (see `board.snapshots`).
+
+    Only requests a snapshot holds the answer to are answered: board details, the latest post
+    marker, feed pages aligned on the snapshot's page size, refreshes with `since` finding no
+    new posts, and whole images or byte ranges of them. Anything else is left to the views. The
+    responses carry the same caching headers as the views, and the SHA-256 digest of their file
+    as ETag, so `ConditionalGetMiddleware` can revalidate them.
+
+    Manifests are read once per snapshot and kept in memory, checking the manifest file for a
+    new snapshot on every request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.servers = {
+            views.GetBoardDetails: self.serve_details,
+            views.GetLatestPost: self.serve_latest,
+            views.GetPosts: self.serve_posts,
+            views.GetImage: self.serve_image,
+        }
+        self._manifests = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, req):
+        return self.get_response(req)
+
+    def process_view(self, req, view_func, view_args, view_kwargs):
+        """Answer the request from a snapshot if it has the answer, else leave it to the view."""
+        serve = self.servers.get(getattr(view_func, 'view_class', None))
+        if serve is None or req.method not in ('GET', 'HEAD'):
+            return None
+        try:
+            return serve(req, **view_kwargs)
+        except (KeyError, ValueError, TypeError, FileNotFoundError):
+            # Invalid query strings are answered by the views, and snapshots may be deleted
+            # while being read.
+            return None
+
+    def manifest(self, req):
+        """Return the summary of the manifest of the requested board, or `None` if it is not frozen."""
+        board_uuid = UUID(req.GET.get('board'), version=4)
+        try:
+            mtime = os.stat(snapshot_dir(board_uuid) / MANIFEST).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            cached = self._manifests.get(board_uuid)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        manifest = load_manifest(board_uuid)
+        summary = {
+            'dir': snapshot_dir(board_uuid),
+            'page_size': manifest['page_size'],
+            'posts': manifest['posts'],
+            # Snapshots taken before posts had cursors only have the time of the latest post.
+            'latest': views.parse_post_cursor(manifest.get('cursor', manifest['latest'])),
+            'etags': {name: '"%s"' % file['sha256'] for name, file in manifest['files'].items()},
+        }
+        with self._lock:
+            self._manifests[board_uuid] = (mtime, summary)
+        return summary
+
+    def file_response(self, manifest, name):
+        """Return a response with a JSON file of a snapshot. They are small, so they are read whole."""
+        response = HttpResponse((manifest['dir'] / name).read_bytes(), content_type='application/json')
+        response['ETag'] = manifest['etags'][name]
+        return response
+
+    def serve_details(self, req):
+        manifest = self.manifest(req)
+        if manifest is None:
+            return None
+        response = self.file_response(manifest, 'details.json')
+        patch_cache_control(response, public=True, max_age=settings.BOARD_DETAILS_MAX_AGE)
+        return response
+
+    def serve_latest(self, req):
+        manifest = self.manifest(req)
+        if manifest is None:
+            return None
+        response = self.file_response(manifest, 'latest.json')
+        patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+    def serve_posts(self, req):
+        # Snapshots only hold the posts with every field.
+        if 'fields' in req.GET or 'embed' in req.GET:
+            return None
+        manifest = self.manifest(req)
+        if manifest is None:
+            return None
+
+        amount = int(req.GET['amount'])
+        since = views.parse_post_cursor(req.GET.get('since'))
+        if since is not None:
+            if manifest['latest'] is not None and views.is_post_after(*manifest['latest'], since):
+                return None
+            response = JsonResponse([], safe=False)
+        else:
+            index = int(req.GET['index'])
+            page_size = manifest['page_size']
+            if amount != page_size or index < 0 or index % page_size:
+                return None
+            if index >= manifest['posts']:
+                response = JsonResponse([], safe=False)
+            else:
+                response = self.file_response(manifest, f'posts/{index}.json')
+                if index + amount <= manifest['posts']:
+                    next_page = {'board': req.GET['board'], 'index': index + amount, 'amount': amount}
+                    response['Link'] = f'<{req.path}?{urlencode(next_page)}>; rel="next"'
+        patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+    def serve_image(self, req, image):
+        image_uuid = UUID(image, version=4)
+        f = open(image_path(image_uuid), 'rb')
+        try:
+            content_type = sniff_image(f).content_type
+        except ValueError:
+            content_type = 'application/octet-stream'
+        return views.cached_file_response(req, f, content_type, image_uuid)
@@ -0,0 +1,17 @@
+# Generated by Django 3.2 on 2026-10-19 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0006_image_created_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['associated_board', '-created_at'], name='post_board_created_idx'),
+        ),
+    ]
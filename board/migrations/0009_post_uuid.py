@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-19 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0008_image_dimensions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='uuid',
+            field=models.UUIDField(null=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2 on 2026-10-19 14:20
+
+import uuid
+
+from django.db import migrations
+
+
+def gen_uuid(apps, schema_editor):
+    """Give every existing post its own uuid."""
+    Post = apps.get_model('board', 'Post')
+    db_alias = schema_editor.connection.alias
+    for post in Post.objects.using(db_alias).only('id'):
+        post.uuid = uuid.uuid4()
+        post.save(using=db_alias, update_fields=['uuid'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0009_post_uuid'),
+    ]
+
+    operations = [
+        migrations.RunPython(gen_uuid, migrations.RunPython.noop),
+    ]
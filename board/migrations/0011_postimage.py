@@ -0,0 +1,36 @@
+# Generated by Django 3.2 on 2026-10-19 14:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0010_populate_post_uuid'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='uuid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.CreateModel(
+            name='PostImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order', models.PositiveSmallIntegerField(default=0)),
+                ('image', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='board.image', to_field='uuid')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='board.post', to_field='uuid')),
+            ],
+            options={
+                'ordering': ['order'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='postimage',
+            constraint=models.UniqueConstraint(fields=('post', 'order'), name='postimage_post_order_unique'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2 on 2026-10-19 14:20
+
+from django.db import migrations
+
+
+def move_photos(apps, schema_editor):
+    """Attach the single photo of every existing post as its first `PostImage`."""
+    Post = apps.get_model('board', 'Post')
+    PostImage = apps.get_model('board', 'PostImage')
+    db_alias = schema_editor.connection.alias
+    posts = Post.objects.using(db_alias).filter(photo__isnull=False).values_list('uuid', 'photo__uuid')
+    PostImage.objects.using(db_alias).bulk_create(
+        [PostImage(post_id=post, image_id=image, order=0) for post, image in posts.iterator()],
+        batch_size=500,
+    )
+
+
+def restore_photos(apps, schema_editor):
+    """Move the first photo of every post back onto the post."""
+    Post = apps.get_model('board', 'Post')
+    PostImage = apps.get_model('board', 'PostImage')
+    db_alias = schema_editor.connection.alias
+    for post_image in PostImage.objects.using(db_alias).filter(order=0).select_related('post', 'image'):
+        post = post_image.post
+        post.photo = post_image.image
+        post.save(using=db_alias, update_fields=['photo'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0011_postimage'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_photos, restore_photos),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2 on 2026-10-19 14:20
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0012_move_post_photos'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='post',
+            name='photo',
+        ),
+    ]
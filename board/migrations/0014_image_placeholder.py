@@ -0,0 +1,23 @@
+# Generated by Django 3.2 on 2026-10-19 14:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0013_remove_post_photo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='color',
+            field=models.CharField(blank=True, max_length=7),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='placeholder',
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-19 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0014_image_placeholder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='archive',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
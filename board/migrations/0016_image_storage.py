@@ -0,0 +1,36 @@
+# Generated by Django 3.2 on 2026-10-19 14:12
+
+from django.db import migrations, models
+from django.db.models.functions import Length
+
+
+def set_sizes(apps, schema_editor):
+    """Record the size of every existing image, all of which are BLOBs."""
+    Image = apps.get_model('board', 'Image')
+    Image.objects.using(schema_editor.connection.alias).update(size=Length('photo'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0015_image_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='oid',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='size',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='storage',
+            field=models.CharField(choices=[('blob', 'blob'), ('largeobject', 'largeobject')], default='blob', max_length=20),
+        ),
+        migrations.RunPython(set_sizes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2 on 2026-10-19 14:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0016_image_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='chunk_size',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='storage',
+            field=models.CharField(choices=[('blob', 'blob'), ('largeobject', 'largeobject'), ('chunked', 'chunked')], default='blob', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='ImageChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='board.image', to_field='uuid')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='imagechunk',
+            constraint=models.UniqueConstraint(fields=('image', 'index'), name='imagechunk_image_index_unique'),
+        ),
+    ]
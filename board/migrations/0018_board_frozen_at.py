@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-19 14:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0017_imagechunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='board',
+            name='frozen_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
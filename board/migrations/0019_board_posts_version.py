@@ -0,0 +1,26 @@
+# Generated by Django 3.2 on 2026-10-19 15:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0018_board_frozen_at'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='post',
+            name='post_board_created_idx',
+        ),
+        migrations.AddField(
+            model_name='board',
+            name='posts_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['associated_board', '-created_at', '-uuid'], name='post_board_created_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2 on 2026-10-19 15:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('board', '0019_board_posts_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.TextField()),
+                ('view', models.CharField(blank=True, max_length=255)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('duration', models.FloatField()),
+                ('queries', models.JSONField(default=list)),
+                ('stats', models.TextField(blank=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 3.2 on 2026-10-19 16:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_admins(apps, schema_editor):
+    """Copy the admins of every board to `BoardAdmin` rows, which point at the board by uuid."""
+    Board = apps.get_model('board', 'Board')
+    BoardAdmin = apps.get_model('board', 'BoardAdmin')
+    db_alias = schema_editor.connection.alias
+    admins = Board.admin_users.through.objects.using(db_alias).values_list('board__uuid', 'user_id')
+    BoardAdmin.objects.using(db_alias).bulk_create(
+        [BoardAdmin(board_id=board, user_id=user) for board, user in admins.iterator()],
+        batch_size=500,
+    )
+
+
+def restore_admins(apps, schema_editor):
+    """Copy the `BoardAdmin` rows of the boards of this database back to the implicit table."""
+    Board = apps.get_model('board', 'Board')
+    BoardAdmin = apps.get_model('board', 'BoardAdmin')
+    db_alias = schema_editor.connection.alias
+    board_ids = dict(Board.objects.using(db_alias).values_list('uuid', 'id'))
+    Through = Board.admin_users.through
+    Through.objects.using(db_alias).bulk_create(
+        [
+            Through(board_id=board_ids[board], user_id=user)
+            for board, user in BoardAdmin.objects.using(db_alias).values_list('board_id', 'user_id').iterator()
+            if board in board_ids
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('board', '0020_storedprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoardAdmin',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='board.board', to_field='uuid')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='boardadmin',
+            constraint=models.UniqueConstraint(fields=('board', 'user'), name='boardadmin_board_user_unique'),
+        ),
+        migrations.RunPython(copy_admins, restore_admins),
+        migrations.RemoveField(
+            model_name='board',
+            name='admin_users',
+        ),
+        migrations.AddField(
+            model_name='board',
+            name='admin_users',
+            field=models.ManyToManyField(through='board.BoardAdmin', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -1,36 +1,163 @@
+import io
 import uuid
 
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import F, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 
+from board.cache import (
+    IMAGE_VARIANTS, VARIANT_THUMBNAIL, CachedImage, cache_image, get_disk_image_cache, get_image_cache,
+)
+from board.images import iter_stripped, make_placeholder, sniff_image
+from board.sharding import make_image_uuid, moving_boards
+from board.storage import STORAGES, default_storage, get_storage
+
 # Create your models here.
 
 
+class ImageQuerySet(models.QuerySet):
+    """The query set of `Image`, finding the images of boards."""
+
+    def for_board(self, board):
+        """Returns the images of a board: its background and the photos of its posts."""
+        return self.filter(Q(board=board) | Q(postimage__post__associated_board=board))
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """Inserts images, then writes the bytes left for after their insertion (see `Image.from_upload`)."""
+        objs = super().bulk_create(objs, *args, **kwargs)
+        for image in objs:
+            image.write_pending_chunks()
+        return objs
+
 class Image(models.Model):
     """
-    A database model representing an image, containing a name and the BLOB of the actual image.
+    A database model representing an image, containing a name and the bytes of the actual image.
 
     This is a separate table to make indexing the other tables more efficient, and make extraction
-    of one image simple and convenient. Each image in a Board or Post has a one-to-one relationship
-    with an image stored in this table.
+    of one image simple and convenient. Each image in a Board, or photo of a Post (through
+    `PostImage`), has a one-to-one relationship with an image stored in this table.
+
+    The bytes of the image are kept by the storage backend named in `storage` (see
+    `board.storage`): either in the `photo` BLOB, or for example in a PostgreSQL large object.
+    They should be read with `iter_chunks`, which works with any backend.
 
     Class Attributes
         name -> `CharField`: A charfield with max length 100 with the name of the image.
-        photo -> `BinaryField`: A field with the stored image BLOB.
+        photo -> `BinaryField`: A field with the stored image BLOB, if stored as a BLOB.
         created_at -> `DateTimeField`: A field storing the creation date of this image.
         uuid -> `UUIDField`: A unique, non-editable uuid4 UUID for each image, used to locate it.
+        content_type -> `CharField`: The MIME type of the image, if known.
+        width -> `PositiveIntegerField`: The display width of the image in pixels, if known.
+        height -> `PositiveIntegerField`: The display height of the image in pixels, if known.
+        placeholder -> `TextField`: A `data:` URI of a tiny preview of the image, if generated.
+        color -> `CharField`: The dominant colour of the image as `#rrggbb`, if generated.
+        archive -> `CharField`: The name of the archive pack holding the image, if it has been
+            archived, in which case `photo` is empty. See `board.archive`.
+        storage -> `CharField`: The name of the storage backend holding the image bytes.
+        size -> `PositiveIntegerField`: The size of the image in bytes, if known.
+        oid -> `PositiveIntegerField`: The PostgreSQL large object holding the image bytes, if
+            stored as a large object.
+        chunk_size -> `PositiveIntegerField`: The size of the `ImageChunk`s holding the image
+            bytes, if stored in chunks.
     """
 
     name = models.CharField(max_length=100)
     photo = models.BinaryField()
     created_at = models.DateTimeField(default=timezone.now)
     uuid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    content_type = models.CharField(max_length=50, blank=True)
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    placeholder = models.TextField(blank=True)
+    color = models.CharField(max_length=7, blank=True)
+    archive = models.CharField(max_length=255, blank=True)
+    storage = models.CharField(
+        max_length=20, default='blob', choices=[(name, name) for name in STORAGES],
+    )
+    size = models.PositiveIntegerField(blank=True, null=True)
+    oid = models.PositiveIntegerField(blank=True, null=True)
+    chunk_size = models.PositiveIntegerField(blank=True, null=True)
+
+    objects = ImageQuerySet.as_manager()
+
+    @classmethod
+    def from_upload(cls, f, board=None):
+        """
+        Returns a new, unsaved image holding an uploaded file without its metadata.
+
+        Images posted to a board get a uuid placing them on the board's shard (see
+        `board.sharding`).
+
+        The file is read from its headers and copied segment by segment (see `board.images`),
+        so it is never decoded, into the default storage backend. Files cleaned by
+        `board.forms.PhotoField` already carry their `image_info`, which is reused instead of
+        reading the headers again. Files processed by `board.processing.PhotoProcessor` are
+        stored as processed, and their thumbnail is cached once the transaction commits.
+
+        Backends such as large objects write the image right away, so the image should be saved
+        within the same transaction. Backends storing rows which reference the image, such as
+        chunks, only write it once the image is saved (see `write_pending_chunks`), so the file
+        is read once to size the image, and once more then.
+
+        Raises:
+            `ValueError` if the file is not a supported image.
+        """
+        # The file may have been read before, e.g. by a batch of posts which failed.
+        f.seek(0)
+        info = getattr(f, 'image_info', None) or sniff_image(f)
+        image = cls(
+            uuid=make_image_uuid(board.uuid) if board is not None else uuid.uuid4(),
+            name=(f.name or '')[:100],
+            content_type=info.content_type,
+            width=info.width,
+            height=info.height,
+        )
+        processed = getattr(f, 'processed_photo', None)
+        if processed is None:
+            def chunks():
+                f.seek(0)
+                yield from iter_stripped(f, info)
+        else:
+            def chunks():
+                yield processed.data
+
+        storage = default_storage()
+        if storage.writes_rows:
+            storage.prepare(image, sum(len(chunk) for chunk in chunks()))
+            image._pending_chunks = chunks()
+        else:
+            storage.write(image, chunks())
+        if processed is not None and processed.thumbnail is not None:
+            thumbnail = CachedImage(*processed.thumbnail)
+            transaction.on_commit(
+                lambda: cache_image((image.uuid, VARIANT_THUMBNAIL), thumbnail),
+                using=router.db_for_write(cls),
+            )
+        return image
+
+    def iter_chunks(self, start=0, end=None):
+        """
+        Returns an iterator of the bytes of this image, in chunks, from its storage backend.
+
+        Params:
+            start -> `int`: the offset of the first byte to return.
+            end -> `int`: the offset after the last byte to return, or `None` for the end.
+        """
+        return get_storage(self.storage).iter_chunks(self, start, end)
 
     def __str__(self):
         """Returns this image's uuid, which represents this image outside of this database."""
         return f'image: {self.uuid}'
 
+    def write_pending_chunks(self):
+        """Writes the bytes of this image left by `from_upload` until the image is saved, if any."""
+        chunks = self.__dict__.pop('_pending_chunks', None)
+        if chunks is not None:
+            get_storage(self.storage).write(self, chunks)
+
     def save(self, *args, **kwargs):
         """Saves this instance to the database and returns it.
 
@@ -41,10 +168,92 @@ class Image(models.Model):
         This way, the image created can be saved to the database without needing extra lines.
         Normally, the save method returns `None`, but by overriding the save method, the instance
         is returned to allow for this inliner to function.
+
+        The size of images stored as BLOBs is kept up to date when their BLOB is loaded.
         """
+        if self.storage == 'blob' and 'photo' in self.__dict__:
+            self.size = len(self.photo)
         super().save(*args, **kwargs)
+        self.write_pending_chunks()
         return self
 
+    def generate_placeholder(self):
+        """
+        Generates the placeholder, colour and dimensions of this image and saves them.
+
+        Images which cannot be decoded are left without a placeholder. See
+        `board.images.make_placeholder`.
+        """
+        photo = b''.join(self.iter_chunks())
+        placeholder = make_placeholder(photo)
+        if placeholder is None:
+            return
+
+        self.placeholder, self.color = placeholder
+        update_fields = ['placeholder', 'color']
+        if self.width is None or self.height is None:
+            try:
+                info = sniff_image(io.BytesIO(photo))
+            except ValueError:
+                pass
+            else:
+                self.width, self.height = info.width, info.height
+                update_fields += ['width', 'height']
+        self.save(update_fields=update_fields)
+
+class ImageChunk(models.Model):
+    """
+    A database model holding a fixed size chunk of the bytes of an image.
+
+    Images stored with the 'chunked' backend (see `board.storage.ChunkedStorage`) are split into
+    chunks of `Image.chunk_size` bytes, only the last of which may be shorter. The chunk holding
+    any byte of an image is then found by its index, using the unique `(image, index)` index.
+    Chunks reference their image by uuid, so they can be written before the image is inserted.
+
+    Class Attributes
+        image -> `ForeignKey`: The image the chunk belongs to.
+        index -> `PositiveIntegerField`: The zero-based position of the chunk in the image.
+        data -> `BinaryField`: The bytes of the chunk.
+    """
+
+    image = models.ForeignKey(Image, to_field='uuid', on_delete=models.CASCADE)
+    index = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['image', 'index'], name='imagechunk_image_index_unique'),
+        ]
+
+    def __str__(self):
+        """Returns the image and the position of the chunk in it."""
+        return f'{self.image_id} -- chunk {self.index}'
+
+@receiver(post_delete, sender=Image)
+def delete_image_storage(sender, instance, **kwargs):
+    """
+    Deletes the bytes of a deleted image from its storage backend, from the image caches of
+    this process and host, and from board snapshots. Other hosts and processes forget it once it
+    expires from their caches (see `board.cache`).
+
+    Archived images are removed from their archive pack (see `board.archive`). Images deleted
+    from a shard their board was moved away from only lose their storage there.
+    """
+    from board.archive import delete_archived_image
+    from board.snapshots import delete_image
+
+    get_storage(instance.storage).delete(instance)
+    if moving_boards():
+        return
+    if instance.archive:
+        delete_archived_image(instance)
+    disk_cache = get_disk_image_cache()
+    for variant in IMAGE_VARIANTS:
+        get_image_cache().delete((instance.uuid, variant))
+        if disk_cache is not None:
+            disk_cache.delete((instance.uuid, variant))
+    delete_image(instance.uuid)
+
 class Board(models.Model):
     """
     A database model representing a board, where posts can be created and viewed.
@@ -60,8 +269,8 @@ class Board(models.Model):
 
     This board stores a many-to-many relationship to `django.contrib.auth.models.User`, the
     default `User` model generated by Django. Since Django offers a `ManyToManyField` as a field,
-    an explicit lookup table is not necessary. Instead, users can be added to a board's
-    `admin_users` field, and Django can use lookups across relationships to find all admin users for
+    the lookup table (`BoardAdmin`) is hardly ever used directly. Instead, users can be added to
+    a board's `admin_users` field, and Django can use lookups across relationships to find all admin users for
     one specific board. Provided is an example:
 
     ```
@@ -88,6 +297,16 @@ class Board(models.Model):
     Further examples can be found at:
     https://docs.djangoproject.com/en/3.2/topics/db/examples/many_to_many/
 
+    Users live on the default database only, so the admins of a board are kept there as well,
+    in `BoardAdmin` rows pointing at the board by uuid, whatever the shard of the board (see
+    `board.sharding`). `b1.admin_users` works on every shard, while lookups from users to
+    boards, such as `u1.board_set`, only find the boards of the default shard.
+
+    When a board is saved with a new background image which has no placeholder yet, the
+    placeholder is generated once (see `Image.generate_placeholder`), so clients can paint a
+    preview of the background before downloading it. Backgrounds which cannot be decoded are
+    not decoded again on every save, only when set again.
+
     Class Attributes
         title -> `CharField`: A charfield with max length 100 containing the title of the board.
         description -> `CharField`: A charfield with max length 500 containing the title of the board.
@@ -96,23 +315,140 @@ class Board(models.Model):
         created_at -> `DateTimeField`: A field storing the creation date of this board.
         admin_users -> `ManyToManyField`: A field storing the many admin users of this board.
         uuid -> `UUIDField`: A unique, non-editable uuid4 UUID for each board.
+        frozen_at -> `DateTimeField`: When the board was closed and published as a static
+            snapshot (see `board.snapshots`), or `None` if it is still open for posts.
+        posts_version -> `PositiveIntegerField`: A counter bumped whenever a post of this board
+            or its photos are changed or deleted, as new posts are told apart by their creation
+            time instead (see `board.views.get_board_feed_state`).
     """
-    # TODO: look into if we need a lookup table.
 
     title = models.CharField(max_length=100)
     description = models.CharField(max_length=200)
     bg = models.OneToOneField(Image, on_delete=models.CASCADE, blank=True, null=True)
     created_at = models.DateTimeField(default=timezone.now)
-    admin_users = models.ManyToManyField(User)
+    admin_users = models.ManyToManyField(User, through='BoardAdmin')
     uuid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    frozen_at = models.DateTimeField(blank=True, null=True)
+    posts_version = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         """Returns the title and the UUID of this board."""
         return f'{self.title} - {self.uuid}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Loads a board, remembering its background to tell whether it changes."""
+        board = super().from_db(db, field_names, values)
+        board._saved_bg_id = board.__dict__.get('bg_id')
+        return board
+
+    def save(self, *args, **kwargs):
+        """Saves this board, generating the placeholder of its background if it changed."""
+        bg_changed = self.bg_id != getattr(self, '_saved_bg_id', None)
+        super().save(*args, **kwargs)
+        self._saved_bg_id = self.bg_id
+        if bg_changed and self.bg is not None and not self.bg.placeholder:
+            self.bg.generate_placeholder()
+
+class BoardAdmin(models.Model):
+    """
+    A database model making a user an admin of a board.
+
+    Rows are always kept on the default database, along with the users (see
+    `board.routers.ShardRouter`), so the board is referenced by uuid without a database
+    constraint: it may live on another shard, and moving it between shards keeps its admins.
+
+    Class Attributes
+        board -> `ForeignKey`: The board, by uuid.
+        user -> `ForeignKey`: The admin user.
+    """
+
+    board = models.ForeignKey(Board, to_field='uuid', on_delete=models.DO_NOTHING, db_constraint=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['board', 'user'], name='boardadmin_board_user_unique'),
+        ]
+
+    def __str__(self):
+        """Returns the admin user and the board."""
+        return f'{self.user} -- admin of {self.board_id}'
+
+@receiver(post_delete, sender=Board)
+def delete_board_admins(sender, instance, **kwargs):
+    """
+    Deletes the admins of a deleted board, which the deletion does not cascade to since they
+    are kept on the default database. Boards deleted from a shard they were moved away from keep
+    their admins.
+    """
+    if moving_boards():
+        return
+    BoardAdmin.objects.filter(board_id=instance.uuid).delete()
+
+@receiver(post_delete, sender=Board)
+def delete_board_pack(sender, instance, **kwargs):
+    """
+    Deletes the archive pack of a deleted board (see `board.archive`), which boards deleted from
+    a shard they were moved away from keep.
+    """
+    from board.archive import delete_board_archive
+
+    if not moving_boards():
+        delete_board_archive(instance)
+
+class PostManager(models.Manager):
+    """The manager of `Post`, creating posts along with their photos."""
+
+    def create_with_photos(self, photos=(), **kwargs):
+        """
+        Creates a post with its photos in a single transaction and returns it.
+
+        The photos are inserted with `bulk_create`, so creating a post takes three inserts (the
+        post, its images and their `PostImage` rows) no matter how many photos it has, on top of
+        whatever the storage backend of the photos writes, once they are inserted for chunks. This relies on
+        `PostImage` referencing posts and images by their uuids, which are generated in Python,
+        as `bulk_create` does not return primary keys on every database.
+
+        Params:
+            photos -> iterable of `Image`: unsaved images to attach to the post, in order.
+            kwargs: the fields of the new post.
+        """
+        post, = self.bulk_create_with_photos([(kwargs, photos)])
+        return post
+
+    def bulk_create_with_photos(self, posts):
+        """
+        Creates many posts with their photos in a single transaction and returns them.
+
+        Like `create_with_photos`, this takes three inserts however many posts and photos there
+        are. The posts may not have a primary key afterwards, but do have their uuid.
+
+        Params:
+            posts -> iterable of `(fields, photos)`: the fields of each new post, and the unsaved
+                images to attach to it, in order.
+        """
+        new_posts = []
+        images = []
+        post_images = []
+        for fields, photos in posts:
+            post = self.model(**fields)
+            new_posts.append(post)
+            for order, image in enumerate(photos):
+                images.append(image)
+                # The post and images are referenced by uuid, as they may not have a primary
+                # key after `bulk_create`.
+                post_images.append(PostImage(post_id=post.uuid, image_id=image.uuid, order=order))
+
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            self.bulk_create(new_posts)
+            Image.objects.bulk_create(images)
+            PostImage.objects.bulk_create(post_images)
+        return new_posts
+
 class Post(models.Model):
     """
-    A database model representing a post, where an image and message can be displayed.
+    A database model representing a post, where images and a message can be displayed.
 
     Each post belongs to a board. This model uses a `BinaryField` instead of an `ImageField` to
     work around Heroku (the planned cloud provider)'s ephemeral file system. Since images will
@@ -120,6 +456,12 @@ class Post(models.Model):
     in the database. This way, the preservation and storage of the images is guaranteed. The
     database may inflate as a result, but that is acceptable for now.
 
+    A post may have any number of photos, which are stored as `Image`s and attached to the post
+    in order through `PostImage`. They can be found with `post.postimage_set.all()`. Photos are
+    optional, but if there are none, the post should contain a message. Validation will be
+    performed at the API level, as the database does not care if a post has no photo and
+    message.
+
     Class Attributes
         associated_board -> `ForeignKey`: The foreign key for the board that this post is on.
         name -> `CharField`: A charfield with max length 50 containing the author's name. Optional.
@@ -127,19 +469,125 @@ class Post(models.Model):
             Optional, but if not included, should contain a photo. Validation will be performed
             at the API level, as the database does not care if a post has no photo and description.
         created_at -> `DateTimeField`: A field storing the creation date of this post.
-        photo -> `OneToOneField`: A one-to-one relationship to the posted image in the `Image`
-            table. Optional, but if not included, should contain a description. Validation will be
-            performed at the API level, as the database does not care if a post has no photo
-            and description.
+        uuid -> `UUIDField`: A unique, non-editable uuid4 UUID for each post.
     """
 
     associated_board = models.ForeignKey(Board, on_delete=models.CASCADE)
     name = models.CharField(max_length=50, blank=True)
     message = models.CharField(max_length=500, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
-    photo = models.OneToOneField(Image, on_delete=models.CASCADE, blank=True, null=True)
+    uuid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+
+    objects = PostManager()
+
+    class Meta:
+        # Feeds are always read newest first for a single board, and the feed ETag probes the
+        # latest post of a board, so both are served by this index. Posts created at the same
+        # time are ordered by uuid, so every post has its own place in the feed.
+        indexes = [
+            models.Index(fields=['associated_board', '-created_at', '-uuid'], name='post_board_created_idx'),
+        ]
 
     def __str__(self):
         """Returns the board name, author name, and message of the post."""
         return f"{self.associated_board}: {self.name} -- {self.message}"
 
+def bump_posts_version(using, **lookups):
+    """
+    Bumps the `posts_version` of the boards matching the lookups, so their cached feed pages
+    and post counts are invalidated.
+
+    Posts and photos deleted from a shard their board was moved away from are left alone.
+    """
+    if moving_boards():
+        return
+    Board.objects.using(using).filter(**lookups).update(posts_version=F('posts_version') + 1)
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, instance, using, created=False, **kwargs):
+    """
+    Bumps the `posts_version` of the board of a changed or deleted post. New posts are newer
+    than every cached page already.
+    """
+    if not created:
+        bump_posts_version(using, pk=instance.associated_board_id)
+
+class PostImage(models.Model):
+    """
+    A database model attaching a photo to a post, in order.
+
+    Both relations point at the uuids of the post and image instead of their primary keys. Since
+    uuids are generated in Python, the rows of a new post can all be built before anything is
+    inserted and then inserted with `bulk_create` (see `PostManager.create_with_photos`).
+
+    Class Attributes
+        post -> `ForeignKey`: The post the photo is attached to.
+        image -> `OneToOneField`: The photo, in the `Image` table.
+        order -> `PositiveSmallIntegerField`: The zero-based position of the photo in the post.
+    """
+
+    post = models.ForeignKey(Post, to_field='uuid', on_delete=models.CASCADE)
+    image = models.OneToOneField(Image, to_field='uuid', on_delete=models.CASCADE)
+    order = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        ordering = ['order']
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'order'], name='postimage_post_order_unique'),
+        ]
+
+    def __str__(self):
+        """Returns the post and the position of the photo in it."""
+        return f'{self.post} -- photo {self.order}'
+
+@receiver(post_save, sender=PostImage)
+@receiver(post_delete, sender=PostImage)
+def post_photos_changed(sender, instance, using, **kwargs):
+    """
+    Bumps the `posts_version` of the board of a post whose photos were added, changed or
+    removed after it was created. The photos of new posts are created in bulk, without signals.
+    """
+    bump_posts_version(using, post__uuid=instance.post_id)
+
+@receiver(post_save, sender=Image)
+def image_changed(sender, instance, using, created, update_fields, **kwargs):
+    """
+    Bumps the `posts_version` of the board of the post showing a changed image, if the details
+    sent with the post (see `board.views.get_post_dict`) may have changed.
+    """
+    if created or (update_fields is not None and not {'name', 'width', 'height'} & set(update_fields)):
+        return
+    bump_posts_version(using, post__postimage__image=instance)
+
+class StoredProfile(models.Model):
+    """
+    A database model holding the profile of a request (see `board.profiling`).
+
+    Profiles are kept in the default database, so the profiles taken by every worker process,
+    including the workers of the public board API, can be browsed from the admin site of any
+    other worker. Only the last `PROFILE_RING_SIZE` of them are kept.
+
+    Class Attributes
+        started_at -> `DateTimeField`: When the request was received.
+        method -> `CharField`: The HTTP method of the request.
+        path -> `TextField`: The path and query string of the request.
+        view -> `CharField`: The dotted path of the view answering the request, if any.
+        status -> `PositiveSmallIntegerField`: The status code of the response.
+        duration -> `FloatField`: The time taken to answer, in seconds.
+        queries -> `JSONField`: The SQL queries run, in order, as `[alias, sql, duration]` lists.
+        stats -> `TextField`: The functions called, by cumulative time, as printed by `pstats`.
+    """
+
+    started_at = models.DateTimeField()
+    method = models.CharField(max_length=10)
+    path = models.TextField()
+    view = models.CharField(max_length=255, blank=True)
+    status = models.PositiveSmallIntegerField()
+    duration = models.FloatField()
+    queries = models.JSONField(default=list)
+    stats = models.TextField(blank=True)
+
+    def __str__(self):
+        """Returns the id and the request of the profile."""
+        return f'profile {self.id}: {self.method} {self.path}'
@@ -0,0 +1,133 @@
+"""
+Processing of uploaded photos on every core.
+
+Stripping the metadata of a photo and making its thumbnail (see `board.images.process_photo`)
+is CPU bound, and would otherwise run under the GIL of the worker which received the post, one
+photo after the other. With `IMAGE_PROCESS_WORKERS` set, `CreatePost` hands the photos of a post
+over to the `PhotoProcessor` of its process instead, which processes them in a pool of that many
+processes, alongside the photos of every other post the worker is creating.
+
+At most `IMAGE_PROCESS_MAX_PENDING` photos are queued or being processed at once. Posts whose
+photos are not processed within `IMAGE_PROCESS_TIMEOUT` seconds, waiting for room included, are
+answered with a `503`, so a burst of uploads is pushed back onto the clients instead of piling
+up in memory.
+
+Each processed upload is annotated with its `ProcessedPhoto`, so `Image.from_upload` stores the
+stripped photo as is, and caches the thumbnail once the post is committed. Photos are sent to
+the pool whole, so they are read into memory, unlike uploads stored without the pool.
+"""
+import multiprocessing
+import threading
+import time
+from concurrent import futures
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from board.images import process_photo
+
+
+class PhotoProcessor:
+    """
+    A pool of processes processing uploaded photos, holding a bounded number of them at once.
+
+    The pool starts its processes with `spawn`, so they never inherit the threads and database
+    connections of the worker, and only import `board.images`.
+    """
+
+    def __init__(self, workers, max_pending):
+        """
+        Params:
+            workers -> `int`: the number of processes.
+            max_pending -> `int`: the maximum number of photos queued or being processed.
+        """
+        self._executor = futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+        )
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, data, info, timeout=None):
+        """
+        Queue a photo for `board.images.process_photo`, waiting for room in the queue.
+
+        Params:
+            data -> `bytes`: the photo as uploaded.
+            info -> `ImageInfo`: the info returned by `sniff_image` for the photo.
+            timeout -> `float`: the number of seconds to wait for room, or `None` to wait forever.
+
+        Returns:
+            A `Future` resolved with the `ProcessedPhoto`.
+
+        Raises:
+            `concurrent.futures.TimeoutError` if the queue stayed full for `timeout` seconds.
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise futures.TimeoutError('The photo processing queue is full.')
+        try:
+            future = self._executor.submit(process_photo, data, info)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda future: self._slots.release())
+        return future
+
+    def process(self, uploads, timeout=None):
+        """
+        Process uploaded photos in parallel, annotating each with its `processed_photo`.
+
+        The files must have been cleaned by `board.forms.PhotoField`, which annotates them with
+        their `image_info`.
+
+        Params:
+            uploads -> `list` of uploaded files: the photos.
+            timeout -> `float`: the number of seconds to wait for all of them, or `None`.
+
+        Raises:
+            `concurrent.futures.TimeoutError` if the photos were not all processed in time.
+            `ValueError` if a photo is malformed past its headers.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        def remaining():
+            return max(deadline - time.monotonic(), 0) if deadline is not None else None
+
+        pending = []
+        for f in uploads:
+            f.seek(0)
+            pending.append(self.submit(f.read(), f.image_info, remaining()))
+        for f, future in zip(uploads, pending):
+            f.processed_photo = future.result(remaining())
+
+    def shutdown(self):
+        """Stop the processes once the queued photos are processed."""
+        self._executor.shutdown(wait=False)
+
+
+_photo_processor = None
+_photo_processor_lock = threading.Lock()
+
+
+def get_photo_processor():
+    """
+    Return the photo processor of this process, configured by the `IMAGE_PROCESS_*` settings,
+    or `None` if `IMAGE_PROCESS_WORKERS` is 0.
+    """
+    global _photo_processor
+    if not settings.IMAGE_PROCESS_WORKERS:
+        return None
+    with _photo_processor_lock:
+        if _photo_processor is None:
+            _photo_processor = PhotoProcessor(settings.IMAGE_PROCESS_WORKERS, settings.IMAGE_PROCESS_MAX_PENDING)
+        return _photo_processor
+
+
+@receiver(setting_changed)
+def reset_photo_processor(setting, **kwargs):
+    """Start over with a new photo processor when its settings change (in tests)."""
+    global _photo_processor
+    if setting.startswith('IMAGE_PROCESS_'):
+        with _photo_processor_lock:
+            if _photo_processor is not None:
+                _photo_processor.shutdown()
+            _photo_processor = None
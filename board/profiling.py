@@ -0,0 +1,244 @@
+"""
+On-demand profiling of production requests.
+
+When a board is slow in production, the request can be profiled where it is slow. A request is
+profiled if it carries an `X-Profile` header with a token from `manage.py profile_token`
+(signed with `SECRET_KEY`, and valid for `PROFILE_TOKEN_MAX_AGE` seconds), or at random, for
+`PROFILE_SAMPLE_PERCENT` percent of all requests. Everything else pays nothing but a random
+draw.
+
+`board.middleware.ProfilingMiddleware` runs profiled requests under `cProfile`, timing every
+SQL query on the way, and keeps the last `PROFILE_RING_SIZE` profiles in the default database
+(see `ProfileRing`), shared by every worker process. Staff users can browse them on the admin
+site, at `/admin/profiles/`.
+Responses to requests profiled with a valid token carry the profile's id in `X-Profile-Id`, and
+their timings in a `Server-Timing` header, which browsers show in their developer tools.
+Sampled responses carry neither, so anonymous clients never see the timings of the server.
+
+Workers using the lean settings profile have no admin site, but their profiles are browsed
+from the admin site of the workers using the full settings, like any other.
+"""
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+from collections import namedtuple
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core import signing
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.dispatch import receiver
+from django.utils import timezone
+
+from board.models import StoredProfile
+
+TOKEN_SALT = 'board.profiling'
+TOKEN_VALUE = 'profile'
+
+# The number of functions listed in a profile, by cumulative time.
+STATS_LINES = 60
+
+QueryTiming = namedtuple('QueryTiming', ['alias', 'sql', 'duration'])
+QueryTiming.__doc__ = """
+A SQL query run by a profiled request.
+
+Fields:
+    alias -> `string`: the database the query ran on.
+    sql -> `string`: the query, without its parameters.
+    duration -> `float`: the time the query took, in seconds.
+"""
+
+RequestProfile = namedtuple('RequestProfile', [
+    'id', 'started_at', 'method', 'path', 'view', 'status', 'duration', 'queries', 'stats',
+])
+RequestProfile.__doc__ = """
+The profile of a request.
+
+Fields:
+    id -> `int`: the id of the profile.
+    started_at -> `datetime`: when the request was received.
+    method -> `string`: the HTTP method of the request.
+    path -> `string`: the path and query string of the request.
+    view -> `string`: the dotted path of the view answering the request, if any.
+    status -> `int`: the status code of the response.
+    duration -> `float`: the time taken to answer, in seconds. The content of streaming
+        responses is produced later, and is not part of the profile.
+    queries -> `list` of `QueryTiming`: the SQL queries run, in order.
+    stats -> `string`: the functions called, by cumulative time, as printed by `pstats`, or
+        `None` if not loaded.
+"""
+
+
+def make_profile_token():
+    """Return a token for the `X-Profile` header, valid for `PROFILE_TOKEN_MAX_AGE` seconds."""
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(TOKEN_VALUE)
+
+
+def is_profile_token(token):
+    """Return whether a token from an `X-Profile` header is valid."""
+    try:
+        value = signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return value == TOKEN_VALUE
+
+
+def is_profile_requested(req):
+    """Return whether a request asks to be profiled with a valid token in its `X-Profile` header."""
+    token = req.META.get('HTTP_X_PROFILE')
+    return token is not None and is_profile_token(token)
+
+
+def is_sampled():
+    """Return whether a request is drawn to be profiled, for `PROFILE_SAMPLE_PERCENT` percent of them."""
+    return random.random() * 100 < settings.PROFILE_SAMPLE_PERCENT
+
+
+@contextmanager
+def time_queries():
+    """Time every SQL query run on any database within, into the yielded list of `QueryTiming`s."""
+    queries = []
+
+    def timed(execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            alias = context['connection'].alias
+            queries.append(QueryTiming(alias, sql, time.perf_counter() - start))
+
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timed))
+        yield queries
+
+
+def format_stats(profiler):
+    """Return the functions called by a profiler, by cumulative time, as printed by `pstats`."""
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(STATS_LINES)
+    return out.getvalue()
+
+
+class ProfileRing:
+    """
+    The last profiles of every worker process, kept in the default database as `StoredProfile`s.
+
+    Only the `size` newest profiles are kept, the oldest are deleted as new ones are added.
+    """
+
+    def __init__(self, size):
+        """
+        Params:
+            size -> `int`: the number of profiles kept.
+        """
+        self.size = size
+
+    @property
+    def profiles(self):
+        """The stored profiles, on the default database whatever the shard or replica in use."""
+        return StoredProfile.objects.using(DEFAULT_DB_ALIAS)
+
+    def add(self, profile):
+        """Keep a `RequestProfile`, deleting the oldest ones if full, and return it with its id."""
+        stored = self.profiles.create(
+            started_at=profile.started_at,
+            method=profile.method,
+            path=profile.path,
+            view=profile.view or '',
+            status=profile.status,
+            duration=profile.duration,
+            queries=[list(query) for query in profile.queries],
+            stats=profile.stats,
+        )
+        self.profiles.filter(pk__lte=stored.pk - self.size).delete()
+        return profile._replace(id=stored.pk)
+
+    def get(self, profile_id):
+        """Return the `RequestProfile` with the given id, or `None` if it was deleted."""
+        stored = self.profiles.filter(pk=profile_id).first()
+        return to_request_profile(stored) if stored is not None else None
+
+    def list(self):
+        """Return the kept profiles, newest first, without their stats."""
+        return [to_request_profile(stored) for stored in self.profiles.defer('stats').order_by('-pk')]
+
+    def clear(self):
+        """Delete every profile."""
+        self.profiles.all().delete()
+
+
+def to_request_profile(stored):
+    """Return the `RequestProfile` of a `StoredProfile`, without its stats if they are deferred."""
+    return RequestProfile(
+        id=stored.pk,
+        started_at=stored.started_at,
+        method=stored.method,
+        path=stored.path,
+        view=stored.view or None,
+        status=stored.status,
+        duration=stored.duration,
+        queries=[QueryTiming(*query) for query in stored.queries],
+        stats=stored.stats if 'stats' in stored.__dict__ else None,
+    )
+
+
+def profile_request(get_response, req, ring):
+    """
+    Answer a request under `cProfile`, timing its SQL queries, and keep its profile in a ring.
+    The queries keeping the profile are not part of it.
+
+    Returns:
+        The response, and its `RequestProfile`.
+    """
+    started_at = timezone.now()
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    with time_queries() as queries:
+        profiler.enable()
+        try:
+            response = get_response(req)
+        finally:
+            profiler.disable()
+    duration = time.perf_counter() - start
+
+    match = getattr(req, 'resolver_match', None)
+    profile = RequestProfile(
+        id=None,
+        started_at=started_at,
+        method=req.method,
+        path=req.get_full_path(),
+        view=match._func_path if match is not None else None,
+        status=response.status_code,
+        duration=duration,
+        queries=queries,
+        stats=format_stats(profiler),
+    )
+    return response, ring.add(profile)
+
+
+_profile_ring = None
+_profile_ring_lock = threading.Lock()
+
+
+def get_profile_ring():
+    """Return the profile ring holding the last `PROFILE_RING_SIZE` profiles."""
+    global _profile_ring
+    with _profile_ring_lock:
+        if _profile_ring is None:
+            _profile_ring = ProfileRing(settings.PROFILE_RING_SIZE)
+        return _profile_ring
+
+
+@receiver(setting_changed)
+def reset_profile_ring(setting, **kwargs):
+    """Start over with a new profile ring when its size changes (in tests)."""
+    global _profile_ring
+    if setting == 'PROFILE_RING_SIZE':
+        with _profile_ring_lock:
+            _profile_ring = None
@@ -0,0 +1,111 @@
+"""
+Database routers of the board app.
+
+`ShardRouter` sends the queries on the board app's models to the shard of a board (see
+`board.sharding`), but only while `using_shard` is active, which
+`board.middleware.ShardRoutingMiddleware` does for the board API views. Users and board admins
+(`DEFAULT_DATABASE_MODELS`) always stay on the default database.
+
+`ReplicaRouter` sends reads to the read replicas listed in `DATABASE_REPLICAS`, but only while
+`replica_reads` is active, which `board.middleware.ReplicaRoutingMiddleware` does for the read
+only board API views. Everything else, and every write, uses the primary (`default`) database.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+_replica_reads = ContextVar('replica_reads', default=False)
+_shard = ContextVar('shard', default=None)
+
+# The models kept on the default database only, whatever the shard of the board they relate to.
+DEFAULT_DATABASE_MODELS = {'auth.user', 'board.boardadmin'}
+
+
+@contextmanager
+def replica_reads():
+    """Send the reads made in this context (thread or task) to the read replicas."""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@contextmanager
+def using_shard(alias):
+    """Send the queries on the board app's models made in this context (thread or task) to a shard."""
+    token = _shard.set(alias)
+    try:
+        yield alias
+    finally:
+        _shard.reset(token)
+
+
+class ShardRouter:
+    """
+    A router sending the queries on the board app's models to the shard of `using_shard`, if any.
+
+    Queries on instances read from a shard (e.g. saving them, or reading their related
+    objects) go to that shard, whatever their app, such as the permissions `migrate` creates on
+    a new shard. The default shard is left to the routers after this one, so its reads may still
+    go to the read replicas.
+
+    The models of `DEFAULT_DATABASE_MODELS` are never sent to a shard, so the admins of a board
+    on a shard (`Board.admin_users`) are read from and written to the default database.
+    """
+
+    def _db_for_board_app(self, model, **hints):
+        instance = hints.get('instance')
+        if model._meta.label_lower in DEFAULT_DATABASE_MODELS:
+            # Django would otherwise follow an instance from a shard to its shard.
+            if instance is not None and instance._state.db in settings.BOARD_SHARDS:
+                return DEFAULT_DB_ALIAS
+            return None
+        if instance is not None and instance._state.db:
+            shard = instance._state.db
+        elif model._meta.app_label == 'board':
+            shard = _shard.get()
+        else:
+            return None
+        if shard == DEFAULT_DB_ALIAS or shard not in settings.BOARD_SHARDS:
+            return None
+        return shard
+
+    db_for_read = _db_for_board_app
+    db_for_write = _db_for_board_app
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Allow relations between boards on any shard and the users of the default database."""
+        if {obj1._meta.label_lower, obj2._meta.label_lower} & DEFAULT_DATABASE_MODELS:
+            return True
+        return None
+
+
+class ReplicaRouter:
+    """
+    A router sending reads to a random read replica within `replica_reads`, and everything else
+    to the primary database.
+
+    Writes always go to the primary, even for instances read from a replica. All databases
+    hold the same data, so relations between them are allowed.
+    """
+
+    def db_for_read(self, model, **hints):
+        """Return a random replica within `replica_reads`, or leave the choice to Django."""
+        if _replica_reads.get() and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return None
+
+    def db_for_write(self, model, **hints):
+        """Always write to the primary."""
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Allow relations between objects from the primary and its replicas."""
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,223 @@
+"""
+Horizontal sharding of boards across databases.
+
+Boards are fully independent: posts and images never cross boards. So every board, with its
+posts, photos and background, can live on its own database, one of the shards listed in
+`BOARD_SHARDS`. The shard of a board is picked from its uuid (see `shard_for`), so finding it
+needs no lookup. With a single shard, the default database, nothing changes.
+
+Images are requested by their own uuid, without their board, so the uuid of an image starts
+with the same `SHARD_KEY_BYTES` bytes as its board's (see `make_image_uuid`). Both are placed by
+these bytes alone, so an image is always on the shard of its board, whatever the shards are.
+
+Within `board_shard`, every query on the board app's models goes to the board's shard
+(see `board.routers.ShardRouter`). `board.middleware.ShardRoutingMiddleware` does this for the board API views,
+which set `shard_by` to the param or URL argument holding the uuid, e.g. `board` for
+`GetPosts`. Everything else, such as users and sessions, stays on the default database.
+Read replicas (`DATABASE_REPLICAS`) are only replicas of the default shard.
+
+Shards are placed with rendezvous hashing, so adding a shard only moves the boards it takes,
+about `1 / len(BOARD_SHARDS)` of them. Once a shard is added to `DATABASES` and `BOARD_SHARDS`,
+and migrated, `manage.py rebalance_shards` moves the boards which now belong to another shard
+(see `move_board`). Boards are unavailable on their new shard until moved, so it should be run
+right after deploying the new shard list.
+
+Board admins (`Board.admin_users`) are users, which live on the default database only, so they
+are kept there for boards on every shard (see `board.models.BoardAdmin`).
+"""
+import copy
+import hashlib
+import uuid
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from board.routers import using_shard
+
+# The number of leading bytes of a uuid placing it on a shard.
+SHARD_KEY_BYTES = 4
+
+_moving_boards = ContextVar('moving_boards', default=False)
+
+
+def shard_for(key, shards=None):
+    """
+    Return the shard holding the board or image with the given uuid.
+
+    Every shard is scored with a hash of its alias and the uuid's shard key, and the highest
+    score wins, so removing a shard only moves the boards it held, and adding one only moves
+    the boards it now wins.
+
+    Params:
+        key -> `UUID`: the uuid of a board, or of one of its images.
+        shards -> `list` of `string`: the database aliases of the shards. Defaults to
+            `BOARD_SHARDS`.
+    """
+    shards = shards or settings.BOARD_SHARDS
+    if len(shards) == 1:
+        return shards[0]
+    shard_key = key.bytes[:SHARD_KEY_BYTES]
+    return max(shards, key=lambda alias: hashlib.md5(alias.encode('utf-8') + shard_key).digest())
+
+
+def make_image_uuid(board_uuid, rng=None):
+    """
+    Return a new uuid4 for an image of the board with the given uuid, sharing its shard key.
+
+    Params:
+        board_uuid -> `UUID`: the uuid of the board.
+        rng -> `random.Random`: the source of the random bits, if given.
+    """
+    random_uuid = uuid.uuid4() if rng is None else uuid.UUID(int=rng.getrandbits(128), version=4)
+    return uuid.UUID(bytes=board_uuid.bytes[:SHARD_KEY_BYTES] + random_uuid.bytes[SHARD_KEY_BYTES:])
+
+
+def board_shard(key):
+    """Send the queries on the board app's models made in this context to the shard of a board."""
+    return using_shard(shard_for(key))
+
+
+def moving_boards():
+    """
+    Return whether boards are being moved between shards in this context, in which case the
+    images deleted from their former shard still exist.
+    """
+    return _moving_boards.get()
+
+
+def move_board(board_uuid, source, target):
+    """
+    Move a board, with its posts and images, from one shard to another.
+
+    The board is frozen on its former shard while it is copied, so no post created meanwhile
+    is lost (see `board.snapshots`), and copied within a single transaction on its new shard.
+    Only then is it deleted from its former shard, with the board locked: posts from requests
+    which found the board open before it was frozen are either committed by then, and copied
+    too, or fail once it is deleted. Primary keys differ between shards, so the copies get new
+    ones, and are related by uuid. Images are copied a chunk at a time, whatever storage backend
+    holds them, and keep their uuids, so caches and snapshots stay valid. Admins are kept on the
+    default database by board uuid (see `board.models.BoardAdmin`), so they stay with the board.
+
+    Params:
+        board_uuid -> `UUID`: the uuid of the board.
+        source -> `string`: the alias of the shard holding the board.
+        target -> `string`: the alias of the shard to move it to.
+
+    Returns:
+        The number of posts moved.
+    """
+    from board.models import Board, Image, Post, PostImage
+
+    board = Board.objects.using(source).get(uuid=board_uuid)
+    frozen_at = board.frozen_at
+    if frozen_at is None:
+        Board.objects.using(source).filter(pk=board.pk).update(frozen_at=timezone.now())
+
+    # Posts are listed before images, so the photos of every listed post are listed too.
+    board_posts = Post.objects.using(source).filter(associated_board=board)
+    posts = list(board_posts)
+    post_images = list(PostImage.objects.using(source).filter(post__associated_board=board))
+    images = Image.objects.using(source).for_board(board)
+    image_ids = {}
+    post_ids = set()
+
+    try:
+        with using_shard(target), transaction.atomic(using=target):
+            _copy_images(images, target, image_ids)
+            target_board = copy.copy(board)
+            target_board.pk = None
+            target_board.bg_id = image_ids.get(board.bg_id)
+            target_board.frozen_at = frozen_at
+            target_board.save(using=target, force_insert=True)
+            _copy_posts(posts, post_images, target_board, post_ids)
+    except BaseException:
+        # The board stays on its former shard, open again.
+        Board.objects.using(source).filter(uuid=board_uuid).update(frozen_at=frozen_at)
+        raise
+
+    token = _moving_boards.set(True)
+    try:
+        with transaction.atomic(using=source):
+            Board.objects.using(source).select_for_update().get(pk=board.pk)
+            # SQLite ignores row locks, but locks the whole database from the first write on.
+            Board.objects.using(source).filter(pk=board.pk).update(frozen_at=F('frozen_at'))
+            late_posts = set(board_posts.values_list('pk', flat=True)) - post_ids
+            late_images = set(images.values_list('pk', flat=True)) - image_ids.keys()
+            if late_posts or late_images:
+                with using_shard(target), transaction.atomic(using=target):
+                    _copy_images(images.filter(pk__in=late_images), target, image_ids)
+                    _copy_posts(
+                        list(Post.objects.using(source).filter(pk__in=late_posts)),
+                        list(PostImage.objects.using(source).filter(post__pk__in=late_posts)),
+                        target_board, post_ids,
+                    )
+            # Deleting the background deletes the board too, and deleting the board its posts.
+            Image.objects.using(source).filter(pk__in=list(image_ids)).delete()
+            Board.objects.using(source).filter(uuid=board_uuid).delete()
+    except BaseException:
+        # The board stays on its former shard, open again, and its copy is deleted.
+        Image.objects.using(target).filter(pk__in=list(image_ids.values())).delete()
+        Board.objects.using(target).filter(pk=target_board.pk).delete()
+        Board.objects.using(source).filter(uuid=board_uuid).update(frozen_at=frozen_at)
+        raise
+    finally:
+        _moving_boards.reset(token)
+    return len(post_ids)
+
+
+def _copy_images(images, target, image_ids):
+    """
+    Copy images to another shard, a chunk at a time whatever storage backend holds them.
+
+    Params:
+        images -> `QuerySet` of `Image`: the images to copy, on their shard.
+        target -> `string`: the alias of the shard to copy them to.
+        image_ids -> `dict`: updated with the primary key of every copy, by the primary key of
+            its image.
+    """
+    from board.storage import BlobStorage, get_storage
+
+    for image in images.defer('photo').iterator():
+        source_image = copy.copy(image)
+        image.pk = None
+        storage = get_storage(image.storage)
+        if image.storage == BlobStorage.name:
+            image.photo = images.model.objects.using(images.db).values_list('photo', flat=True).get(pk=source_image.pk)
+            image.save(using=target, force_insert=True)
+        elif storage.writes_rows:
+            # The rows reference the image, so they are written once it is inserted.
+            storage.prepare(image, image.size)
+            image.save(using=target, force_insert=True)
+            storage.write(image, storage.iter_chunks(source_image))
+        else:
+            storage.write(image, storage.iter_chunks(source_image))
+            image.save(using=target, force_insert=True)
+        image_ids[source_image.pk] = image.pk
+
+
+def _copy_posts(posts, post_images, board, post_ids):
+    """
+    Copy posts, with their photos, to the shard of a copied board.
+
+    Params:
+        posts -> `list` of `Post`: the posts to copy.
+        post_images -> `list` of `PostImage`: the photos of the posts, possibly along with
+            photos of other posts, which are left out.
+        board -> `Board`: the copy of the board of the posts.
+        post_ids -> `set`: updated with the primary keys of the posts copied.
+    """
+    from board.models import Post, PostImage
+
+    uuids = {post.uuid for post in posts}
+    for post in posts:
+        post_ids.add(post.pk)
+        post.pk = None
+        post.associated_board_id = board.pk
+    Post.objects.using(board._state.db).bulk_create(posts)
+    post_images = [post_image for post_image in post_images if post_image.post_id in uuids]
+    for post_image in post_images:
+        post_image.pk = None
+    PostImage.objects.using(board._state.db).bulk_create(post_images)
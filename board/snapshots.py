@@ -0,0 +1,186 @@
+"""
+Static snapshots of frozen boards.
+
+Once a board is closed (e.g. after the birthday), its content never changes. Freezing it
+(`freeze_board`) renders everything the board API would return for it into files under
+`SNAPSHOT_ROOT`, and stops it from accepting posts:
+```
+<SNAPSHOT_ROOT>/<board uuid>/manifest.json     the snapshot's contents, written last
+<SNAPSHOT_ROOT>/<board uuid>/details.json      the `board-details-get` response
+<SNAPSHOT_ROOT>/<board uuid>/latest.json       the `posts-latest` response
+<SNAPSHOT_ROOT>/<board uuid>/posts/<index>.json  the `posts-get` page from `index`, of
+                                               `SNAPSHOT_PAGE_SIZE` posts
+<SNAPSHOT_ROOT>/images/original/<uuid[:2]>/<uuid>  the images of the board
+```
+`board.middleware.FrozenBoardMiddleware` answers requests for frozen boards from these files
+without any database access, and a web server may serve the directory directly as well. The
+manifest lists every file with its content type, size and SHA-256 digest.
+
+A snapshot is rendered into a temporary directory and moved into place, so a snapshot is only
+ever seen complete. Unfreezing a board (`unfreeze_board`) deletes its snapshot and reopens it.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from board.archive import iter_archived_chunks
+from board.models import Image, Post
+from board.views import (
+    format_post_cursor, format_post_marker, get_board_dict, get_board_feed_state, get_post_dict,
+    prefetch_post_photos,
+)
+
+MANIFEST = 'manifest.json'
+
+# The only variant of an image so far is the image as uploaded.
+IMAGE_VARIANT = 'original'
+
+
+def snapshot_dir(board_uuid):
+    """Return the directory holding the snapshot of a board."""
+    return settings.SNAPSHOT_ROOT / str(board_uuid)
+
+
+def image_path(image_uuid):
+    """Return the path of the file holding an image in snapshots."""
+    name = str(image_uuid)
+    return settings.SNAPSHOT_ROOT / 'images' / IMAGE_VARIANT / name[:2] / name
+
+
+def load_manifest(board_uuid):
+    """Return the manifest of a board's snapshot as a dictionary, or `None` if it is not frozen."""
+    try:
+        with open(snapshot_dir(board_uuid) / MANIFEST, 'rb') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_file(root, name, data, content_type, files):
+    """Write a file of a snapshot, recording it in the `files` of the manifest."""
+    path = root / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    files[name] = {
+        'content_type': content_type,
+        'size': len(data),
+        'sha256': hashlib.sha256(data).hexdigest(),
+    }
+
+
+def write_json(root, name, value, files):
+    """Write a JSON file of a snapshot, encoded as `JsonResponse` would."""
+    write_file(root, name, json.dumps(value).encode('utf-8'), 'application/json', files)
+
+
+def write_image(image):
+    """Write an image into the snapshot images, unless already there, and return its manifest entry."""
+    path = image_path(image.uuid)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        chunks = iter_archived_chunks(image) if image.archive else image.iter_chunks()
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix='.')
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(temp_path, path)
+    return {
+        'content_type': image.content_type or 'application/octet-stream',
+        'size': path.stat().st_size,
+    }
+
+
+def freeze_board(board, page_size=None):
+    """
+    Close a board, and publish a static snapshot of it.
+
+    Freezing a frozen board publishes its snapshot again, e.g. after posts were deleted.
+
+    Params:
+        board -> `Board`: the board to freeze.
+        page_size -> `int`: the number of posts per feed page. Defaults to `SNAPSHOT_PAGE_SIZE`.
+
+    Returns:
+        The manifest of the snapshot.
+    """
+    page_size = page_size or settings.SNAPSHOT_PAGE_SIZE
+    # The board is closed first, so it stops accepting posts before it is rendered.
+    if board.frozen_at is None:
+        board.frozen_at = timezone.now()
+        board.save(update_fields=['frozen_at'])
+
+    settings.SNAPSHOT_ROOT.mkdir(parents=True, exist_ok=True)
+    root = Path(tempfile.mkdtemp(dir=settings.SNAPSHOT_ROOT, prefix=f'.{board.uuid}-'))
+    try:
+        files = {}
+        board = type(board).objects.select_related('bg').defer('bg__photo').get(pk=board.pk)
+        write_json(root, 'details.json', get_board_dict(board), files)
+
+        state = get_board_feed_state(board.uuid)
+        posts = Post.objects.filter(associated_board=board).order_by('-created_at', '-uuid')
+        count = posts.count()
+        latest = cursor = None
+        if state['latest'] is not None:
+            latest = format_post_marker(state['latest'])
+            cursor = format_post_cursor(state['latest'], state['latest_uuid'])
+        write_json(root, 'latest.json', {'latest': latest, 'cursor': cursor, 'count': count}, files)
+
+        for index in range(0, count, page_size):
+            page = prefetch_post_photos(posts[index:index + page_size])
+            write_json(root, f'posts/{index}.json', [get_post_dict(post) for post in page], files)
+
+        images = {}
+        for image in Image.objects.for_board(board).defer('photo').iterator():
+            images[str(image.uuid)] = write_image(image)
+
+        manifest = {
+            'board': str(board.uuid),
+            'frozen_at': format_post_marker(board.frozen_at),
+            'page_size': page_size,
+            'posts': count,
+            'latest': latest,
+            'cursor': cursor,
+            'files': files,
+            'images': images,
+        }
+        (root / MANIFEST).write_text(json.dumps(manifest, indent=2))
+
+        # Swap the new snapshot in, then delete the previous one, if any.
+        target = snapshot_dir(board.uuid)
+        previous = None
+        if target.exists():
+            previous = Path(tempfile.mkdtemp(dir=settings.SNAPSHOT_ROOT, prefix=f'.{board.uuid}-old-'))
+            os.replace(target, previous / 'snapshot')
+        os.replace(root, target)
+        if previous is not None:
+            shutil.rmtree(previous)
+    except BaseException:
+        shutil.rmtree(root, ignore_errors=True)
+        raise
+    return manifest
+
+
+def unfreeze_board(board):
+    """Delete the snapshot of a board, with its images, and open it for posts again."""
+    manifest = load_manifest(board.uuid)
+    if manifest is not None:
+        shutil.rmtree(snapshot_dir(board.uuid))
+        for image_uuid in manifest['images']:
+            delete_image(image_uuid)
+
+    board.frozen_at = None
+    board.save(update_fields=['frozen_at'])
+
+
+def delete_image(image_uuid):
+    """Delete an image from the snapshot images, if there."""
+    try:
+        os.unlink(image_path(image_uuid))
+    except FileNotFoundError:
+        pass
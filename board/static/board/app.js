@@ -0,0 +1,14 @@
+// Entry point of the board single page app.
+//
+// The React app is not written yet (see the TODOs of `GetMainBoard`), so this only reads the
+// board the page was opened for, which the app will load with the board API.
+(function () {
+  'use strict';
+
+  var root = document.getElementById('root');
+  if (!root) {
+    return;
+  }
+  root.dataset.ready = 'true';
+  window.shiftboard = { board: root.dataset.board || null };
+})();
@@ -0,0 +1,81 @@
+"""
+Fingerprinted, precompressed static files for the board single page app.
+
+`manage.py collectstatic` copies the app's index assets and bundles into `STATIC_ROOT` with
+`CompressedManifestStaticFilesStorage`, which names every file after a hash of its content
+(e.g. `board/app.3f2a9c1b7e4d.js`) and writes a gzip variant of every compressible file next to
+it (`.gz`), plus a Brotli variant (`.br`) if the optional `brotli` package is installed.
+
+`board.middleware.StaticFilesMiddleware` then serves `STATIC_ROOT` from the workers, picking the
+smallest variant the browser accepts. Hashed files never change, so they may be cached forever.
+"""
+import gzip
+import mimetypes
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+# Content types worth compressing. Images and fonts are already compressed.
+COMPRESSIBLE_TYPES = (
+    'text/', 'application/javascript', 'application/json', 'application/xml', 'image/svg+xml',
+)
+
+# Files smaller than this many bytes are not worth a compressed variant.
+MIN_COMPRESS_SIZE = 256
+
+
+def compress_gzip(data):
+    """Return data compressed with gzip. The header carries no timestamp, so builds are repeatable."""
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def compress_brotli(data):
+    """Return data compressed with Brotli, or `None` if the `brotli` package is not installed."""
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(data, quality=11)
+
+
+# The encodings of the compressed variants, in order of preference, with the suffix of their files.
+ENCODINGS = [
+    ('br', '.br', compress_brotli),
+    ('gzip', '.gz', compress_gzip),
+]
+
+
+def is_compressible(name):
+    """Return whether the static file with the given name is worth compressing."""
+    content_type, encoding = mimetypes.guess_type(name)
+    return encoding is None and content_type is not None and content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    A `ManifestStaticFilesStorage` also writing compressed variants of the hashed files.
+
+    A variant is only kept if it is smaller than the file itself.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        # Files referencing others are hashed several times, only the final names are kept.
+        for hashed_name in sorted(set(self.hashed_files.values())):
+            if is_compressible(hashed_name):
+                self.compress(hashed_name)
+
+    def compress(self, name):
+        """Write the compressed variants of the file with the given name."""
+        with self.open(name) as f:
+            data = f.read()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+
+        for _, suffix, compress in ENCODINGS:
+            compressed = compress(data)
+            if compressed is None or len(compressed) >= len(data):
+                continue
+            with open(self.path(name + suffix), 'wb') as f:
+                f.write(compressed)
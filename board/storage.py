@@ -0,0 +1,194 @@
+"""
+Storage backends for the bytes of images.
+
+Every `Image` records the backend its bytes were written with in `Image.storage`, so images
+written with different backends can live side by side. New images are written with the backend
+chosen by the `IMAGE_STORAGE` setting (see `default_storage`).
+
+A backend writes an image from an iterable of byte chunks and reads it back as an iterator of
+chunks, so backends which support it never need a whole image in memory:
+    blob -> the `Image.photo` BLOB. Always available, but whole images are read into memory.
+    largeobject -> a PostgreSQL large object referenced by `Image.oid`, read and written in
+        chunks of `IMAGE_STORAGE_CHUNK_SIZE` bytes with `lo_get`/`lo_put`.
+    chunked -> `ImageChunk` rows of `IMAGE_STORAGE_CHUNK_SIZE` bytes each, on any database.
+
+Every backend can read a range of an image. Backends storing images in chunks only read the
+chunks overlapping the range.
+
+Backends with `writes_rows` set store rows referencing the image, so they write the bytes of an
+image once it has been inserted (see `Image.from_upload`).
+"""
+from django.conf import settings
+from django.db import connections, router
+
+
+class BlobStorage:
+    """Stores images in the `Image.photo` BLOB."""
+    name = 'blob'
+    writes_rows = False
+
+    def write(self, image, chunks):
+        """Write the chunks into the image's BLOB. The image still needs to be saved."""
+        image.photo = b''.join(chunks)
+        image.size = len(image.photo)
+        image.storage = self.name
+
+    def iter_chunks(self, image, start=0, end=None):
+        """Return an iterator of the image's bytes from `start` up to `end` (exclusive)."""
+        photo = memoryview(image.photo)[start:end]
+        chunk_size = settings.IMAGE_STORAGE_CHUNK_SIZE
+        return (bytes(photo[i:i + chunk_size]) for i in range(0, len(photo), chunk_size))
+
+    def delete(self, image):
+        """Nothing to do, the BLOB is deleted along with the image."""
+
+
+class LargeObjectStorage:
+    """
+    Stores images as PostgreSQL large objects, only ever holding one chunk in memory.
+
+    Large objects are written and read with the server side `lo_from_bytea`, `lo_put` and
+    `lo_get` functions (PostgreSQL 9.4+), which unlike client side large object descriptors do
+    not need to run within a transaction. This lets a response stream an image while other
+    queries run on the same connection.
+    """
+    name = 'largeobject'
+    writes_rows = False
+
+    def write(self, image, chunks):
+        """
+        Write the chunks into a new large object, one at a time. The image still needs to be saved.
+
+        The large object is created on the database the image will be written to, and should be
+        written within the same transaction as the image, so it is not left behind if saving the
+        image fails.
+        """
+        size = 0
+        with connections[router.db_for_write(type(image))].cursor() as cursor:
+            cursor.execute('SELECT lo_from_bytea(0, %s)', [b''])
+            oid, = cursor.fetchone()
+            for chunk in chunks:
+                cursor.execute('SELECT lo_put(%s, %s, %s)', [oid, size, chunk])
+                size += len(chunk)
+
+        image.oid = oid
+        image.photo = b''
+        image.size = size
+        image.storage = self.name
+
+    def iter_chunks(self, image, start=0, end=None):
+        """Yield the image's bytes from `start` up to `end` (exclusive), one query per chunk."""
+        chunk_size = settings.IMAGE_STORAGE_CHUNK_SIZE
+        end = image.size if end is None else min(end, image.size)
+        connection = connections[image._state.db or router.db_for_read(type(image))]
+        offset = start
+        while offset < end:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT lo_get(%s, %s, %s)', [image.oid, offset, min(chunk_size, end - offset)])
+                chunk, = cursor.fetchone()
+            if not chunk:
+                return
+            yield bytes(chunk)
+            offset += len(chunk)
+
+    def delete(self, image):
+        """Unlink the image's large object."""
+        if image.oid is None:
+            return
+        with connections[image._state.db or router.db_for_write(type(image))].cursor() as cursor:
+            cursor.execute('SELECT lo_unlink(%s)', [image.oid])
+        image.oid = None
+
+
+class ChunkedStorage:
+    """
+    Stores images as `ImageChunk` rows of `IMAGE_STORAGE_CHUNK_SIZE` bytes, on any database.
+
+    Chunks are inserted as soon as they are filled while writing, and read back one row per
+    query, so at most one chunk is held in memory. Every chunk but the last is full, so the chunk
+    holding any byte is found with a lookup on `(image, index)`.
+    """
+    name = 'chunked'
+    writes_rows = True
+
+    def prepare(self, image, size):
+        """Set the fields of an image about to be written with the given number of bytes."""
+        image.photo = b''
+        image.size = size
+        image.storage = self.name
+        image.chunk_size = settings.IMAGE_STORAGE_CHUNK_SIZE
+
+    def write(self, image, chunks):
+        """
+        Write the chunks into `ImageChunk` rows, one row at a time. The rows reference the
+        image, so it must have been inserted already, and its fields set here still need to be
+        saved if they changed.
+        """
+        from board.models import ImageChunk
+
+        chunk_size = settings.IMAGE_STORAGE_CHUNK_SIZE
+        using = image._state.db or router.db_for_write(ImageChunk)
+        buffer = bytearray()
+        index = 0
+        size = 0
+
+        def flush(data):
+            ImageChunk.objects.using(using).create(image_id=image.uuid, index=index, data=data)
+
+        for chunk in chunks:
+            buffer += chunk
+            size += len(chunk)
+            while len(buffer) >= chunk_size:
+                flush(bytes(buffer[:chunk_size]))
+                del buffer[:chunk_size]
+                index += 1
+        if buffer or index == 0:
+            flush(bytes(buffer))
+        self.prepare(image, size)
+
+    def iter_chunks(self, image, start=0, end=None):
+        """Yield the image's bytes from `start` up to `end` (exclusive), one query per chunk."""
+        from board.models import ImageChunk
+
+        end = image.size if end is None else min(end, image.size)
+        chunks = ImageChunk.objects \
+            .using(image._state.db or router.db_for_read(ImageChunk)) \
+            .filter(image_id=image.uuid)
+        for index in range(start // image.chunk_size, -(-end // image.chunk_size)):
+            data = chunks.filter(index=index).values_list('data', flat=True).first()
+            if data is None:
+                return
+            offset = index * image.chunk_size
+            yield bytes(data[max(start - offset, 0):end - offset])
+
+    def delete(self, image):
+        """Delete the image's chunks."""
+        from board.models import ImageChunk
+
+        ImageChunk.objects.using(image._state.db or router.db_for_write(ImageChunk)).filter(image_id=image.uuid).delete()
+
+
+STORAGES = {
+    storage.name: storage for storage in [BlobStorage(), LargeObjectStorage(), ChunkedStorage()]
+}
+
+
+def get_storage(name):
+    """Return the storage backend with the given name."""
+    return STORAGES[name]
+
+
+def default_storage():
+    """
+    Return the storage backend new images are written with.
+
+    This is the backend named by the `IMAGE_STORAGE` setting. If it is 'auto', large objects are
+    used on PostgreSQL, and BLOBs anywhere else. Chunks are only used when asked for, since they
+    take one query per chunk to read.
+    """
+    name = settings.IMAGE_STORAGE
+    if name == 'auto':
+        from board.models import Image
+        vendor = connections[router.db_for_write(Image)].vendor
+        name = LargeObjectStorage.name if vendor == 'postgresql' else BlobStorage.name
+    return get_storage(name)
@@ -0,0 +1,132 @@
+"""
+Test utilities asserting the cost of views, so regressions such as N+1 queries, or queries
+scanning whole tables, fail the tests.
+
+`BudgetTestMixin` seeds one board per size in `BUDGET_POST_COUNTS` (see `board.factories`), and
+`assertBudget` fails if the code within it runs more queries, or takes longer, than allowed:
+```
+class GetPostsBudgetTests(BudgetTestMixin, TestCase):
+    def test_get_posts(self):
+        for count, board in self.each_board():
+            with self.assertBudget(queries=4, seconds=0.05):
+                self.client.get(...)
+```
+Time budgets are multiplied by the `TEST_TIME_BUDGET_SCALE` environment variable, for slower
+machines, and the sizes may be narrowed down for quick runs with `TEST_BUDGET_POST_COUNTS`,
+e.g. `TEST_BUDGET_POST_COUNTS=10,1000`.
+
+`TempDirSettingsMixin` gives every test of a `TestCase` its own temporary directory for the
+setting of a directory written to, such as `SNAPSHOT_ROOT`.
+"""
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+from board.factories import create_board, create_posts
+
+BUDGET_POST_COUNTS = tuple(
+    int(count) for count in os.getenv('TEST_BUDGET_POST_COUNTS', '10,1000,50000').split(',')
+)
+TIME_BUDGET_SCALE = float(os.getenv('TEST_TIME_BUDGET_SCALE', 1))
+
+
+def find_full_scans(connection, queries):
+    """
+    Return the captured `SELECT` queries which scan a whole table, with their query plan.
+
+    Only SQLite query plans are understood, no queries are returned on other databases.
+    """
+    if connection.vendor != 'sqlite':
+        return []
+
+    scans = []
+    with connection.cursor() as cursor:
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = [row[-1] for row in cursor.fetchall()]
+            # Tables are either searched with an index, or scanned, possibly through an index.
+            if any(step.startswith('SCAN') and 'INDEX' not in step for step in plan):
+                scans.append((sql, plan))
+    return scans
+
+
+class BudgetTestMixin:
+    """
+    A `TestCase` mixin seeding boards of several sizes, and asserting query and time budgets.
+
+    Class Attributes
+        post_counts -> `tuple` of `int`: the number of posts of the seeded boards.
+        photos_per_post -> `int`: the number of photos of every seeded post.
+    """
+    post_counts = BUDGET_POST_COUNTS
+    photos_per_post = 1
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.boards = {}
+        for count in cls.post_counts:
+            board = create_board(title=f'{count} posts')
+            create_posts(board, count, photos_per_post=cls.photos_per_post)
+            cls.boards[count] = board
+
+    def each_board(self):
+        """Yield the number of posts and the seeded board of every size, each in a subtest."""
+        for count, board in self.boards.items():
+            with self.subTest(posts=count):
+                yield count, board
+
+    @contextmanager
+    def assertBudget(self, queries=None, seconds=None, full_scans=False, using=DEFAULT_DB_ALIAS):
+        """
+        Fail if the code within runs more than `queries` queries, takes more than `seconds`
+        seconds (scaled by `TEST_TIME_BUDGET_SCALE`), or, unless `full_scans` is true, runs a
+        query scanning a whole table.
+
+        The captured queries are given to the code within, as a `CaptureQueriesContext`.
+        """
+        connection = connections[using]
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            yield captured
+            elapsed = time.perf_counter() - start
+
+        sql = '\n'.join(query['sql'] for query in captured)
+        if queries is not None and len(captured) > queries:
+            self.fail(f'{len(captured)} queries run, over the budget of {queries}:\n{sql}')
+        if seconds is not None and elapsed > seconds * TIME_BUDGET_SCALE:
+            self.fail(f'Took {elapsed:.3f}s, over the budget of {seconds * TIME_BUDGET_SCALE:.3f}s:\n{sql}')
+        if not full_scans:
+            for scan, plan in find_full_scans(connection, captured):
+                self.fail(f'Query scanning a whole table:\n{scan}\n' + '\n'.join(plan))
+
+
+class TempDirSettingsMixin:
+    """
+    A `TestCase` mixin pointing a directory setting at a new temporary directory for every test,
+    which is deleted afterwards.
+
+    Class Attributes
+        temp_dir_setting -> `string`: the name of the setting holding the directory.
+        temp_dir_extra_settings -> `dict`: other settings to override for every test.
+    """
+    temp_dir_setting = None
+    temp_dir_extra_settings = {}
+
+    def setUp(self):
+        """Create the temporary directory as `self.temp_dir`, and override the settings."""
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = Path(temp_dir.name)
+        overridden = self.settings(**{self.temp_dir_setting: self.temp_dir}, **self.temp_dir_extra_settings)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
@@ -1,12 +1,48 @@
+import gzip
+import io
+import os
+import re
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import uuid
+import zipfile
+import zlib
+from concurrent import futures
+from unittest import mock, skipUnless
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import TestCase, tag
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, router, transaction
+from django.db.models import Q
+from django.http import HttpResponse
+from django.test import (
+    Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, tag,
+)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
-from board.models import Board, Image, Post
-from board.views import get_post_dict
+from board import sharding
+from board.archive import archive_path, pack_name, restore_image
+from board.batching import PostBatcher
+from board.cache import CachedImage, DiskImageCache, ImageCache, get_disk_image_cache, get_image_cache
+from board.factories import create_posts
+from board.forms import MultiplePhotoField, PhotoField
+from board.images import PNG_SIGNATURE, ImageInfo, iter_stripped, png_chunk, process_photo, sniff_image
+from board.models import Board, BoardAdmin, Image, ImageChunk, Post, PostImage
+from board.middleware import ReplicaRoutingMiddleware
+from board.processing import PhotoProcessor, get_photo_processor
+from board.profiling import ProfileRing, get_profile_ring, make_profile_token
+from board.sharding import SHARD_KEY_BYTES, move_board, shard_for
+from board.testing import BudgetTestMixin, TempDirSettingsMixin
+from board.views import CreatePost, GetPosts, get_post_dict
 
 
 
@@ -44,15 +80,18 @@ class BoardModelTests(TestCase):
         self.assertIs(i2.board, b2)
 
         p1 = Post(associated_board=b2, name="p1", message="m1")
-        p2 = Post(associated_board=b2, name="p1", message="m1", photo=Image(name="spam", photo=bytearray("eggs", "utf-8")).save())
-        p3 = Post(associated_board=b2, name="p1", message="m1", photo=i3)
+        p2 = Post(associated_board=b2, name="p1", message="m1")
+        p3 = Post(associated_board=b2, name="p1", message="m1")
         p1.save()
         p2.save()
         p3.save()
+        PostImage(post=p2, image=Image(name="spam", photo=bytearray("eggs", "utf-8")).save()).save()
+        pi3 = PostImage(post=p3, image=i3)
+        pi3.save()
 
-        self.assertIs(p3.photo, i3)
-        self.assertIs(i3.post, p3)
-        self.assertIs(p2.photo.name, "spam")
+        self.assertEqual(p3.postimage_set.get().image, i3)
+        self.assertIs(i3.postimage, pi3)
+        self.assertEqual(p2.postimage_set.get().image.name, "spam")
 
     @tag('core')
     def test_board_post_connections(self):
@@ -70,13 +109,14 @@ class BoardModelTests(TestCase):
         b2.save()
 
         p1 = Post(associated_board=b1, name="a", message="b")
-        p2 = Post(associated_board=b1, name="a", photo=i3)
+        p2 = Post(associated_board=b1, name="a")
         p3 = Post(associated_board=b2, name="a", message="b")
         p4 = Post(associated_board=b1, name="a", message="b")
         p1.save()
         p2.save()
         p3.save()
         p4.save()
+        PostImage(post=p2, image=i3).save()
 
         self.assertQuerysetEqual(b1.post_set.all(), [p1, p2, p4], ordered=False)
         self.assertQuerysetEqual(b2.post_set.all(), [p3], ordered=False)
@@ -142,16 +182,20 @@ class BoardModelTests(TestCase):
 
         # just make sure that none of these throw an exception when creating
         p1 = Post(associated_board=b1, message="post1")
-        p2 = Post(associated_board=b1, name="author2", photo=i2)
-        p3 = Post(associated_board=b1, photo=i3)
-        p4 = Post(associated_board=b1, name="author4", message="post4", photo=i4)
-        p5 = Post(associated_board=b1, message="post5", photo=i5)
+        p2 = Post(associated_board=b1, name="author2")
+        p3 = Post(associated_board=b1)
+        p4 = Post(associated_board=b1, name="author4", message="post4")
+        p5 = Post(associated_board=b1, message="post5")
 
         p1.save()
         p2.save()
         p3.save()
         p4.save()
         p5.save()
+        PostImage(post=p2, image=i2).save()
+        PostImage(post=p3, image=i3).save()
+        PostImage(post=p4, image=i4).save()
+        PostImage(post=p5, image=i5).save()
 
 
 class GetPostsTests(TestCase):
@@ -165,10 +209,10 @@ class GetPostsTests(TestCase):
                 associated_board=board, 
                 message='hi', 
                 name=str(i), 
-                photo=Image(name=f'photo{i}', photo=bytearray('hi', 'utf-8')).save(),
                 created_at=timezone.now()+timezone.timedelta(seconds=i)
             )
             p.save()
+            PostImage(post=p, image=Image(name=f'photo{i}', photo=bytearray('hi', 'utf-8')).save()).save()
             posts.append(p)
         return posts
 
@@ -231,14 +275,15 @@ class GetPostsTests(TestCase):
             Post(
                 associated_board=b, 
                 name='joseph', 
-                photo=Image(name='i', photo=bytearray('b', 'utf-8')).save(),
                 created_at=timezone.now()-timezone.timedelta(2),
             ),
         ]
         exp = []
         for p in posts:
-            exp.append(get_post_dict(p))
             p.save()
+        PostImage(post=posts[2], image=Image(name='i', photo=bytearray('b', 'utf-8')).save()).save()
+        for p in posts:
+            exp.append(get_post_dict(p))
         
         res = self.client.get(
             reverse('board:posts-get'),
@@ -297,6 +342,96 @@ class GetPostsTests(TestCase):
         self.assertEqual(res2.json(), exp2)
 
 
+    @tag('core')
+    def test_get_posts_since(self):
+        """With `since`, only newer posts are returned, oldest pages first, with a link to the next."""
+        b = Board(title='hi', description='hello')
+        b.save()
+        posts = self.add_posts(b, 5)
+        since = get_post_dict(posts[1])['created_at']
+
+        res = self.client.get(reverse('board:posts-get'), {'board': str(b.uuid), 'since': since, 'amount': '2'})
+        self.assertEqual(res.json(), [get_post_dict(posts[3]), get_post_dict(posts[2])])
+        next_page = re.match(r'<(.*)>; rel="next"', res['Link']).group(1)
+
+        res = self.client.get(next_page)
+        self.assertEqual(res.json(), [get_post_dict(posts[4])])
+        self.assertFalse(res.has_header('Link'))
+
+        res = self.client.get(reverse('board:posts-get'), {'board': str(b.uuid), 'since': 'yesterday', 'amount': '2'})
+        self.assertEqual(res.status_code, 400)
+
+    @tag('core')
+    def test_get_posts_fieldset(self):
+        """Only the requested fields and related data are sent, also on the next pages."""
+        b = Board(title='hi', description='hello')
+        b.save()
+        posts = self.add_posts(b, 3)
+        url = reverse('board:posts-get')
+
+        res = self.client.get(url, {'board': str(b.uuid), 'index': 0, 'amount': 2, 'fields': 'name', 'embed': ''})
+        self.assertEqual(res.json(), [{'name': '2'}, {'name': '1'}])
+        next_page = re.match(r'<(.*)>; rel="next"', res['Link']).group(1)
+        self.assertEqual(self.client.get(next_page).json(), [{'name': '0'}])
+
+        res = self.client.get(url, {'board': str(b.uuid), 'index': 0, 'amount': 1, 'fields': '', 'embed': 'photos'})
+        self.assertEqual(res.json(), [{'photos': get_post_dict(posts[2])['photos']}])
+
+        res = self.client.get(url, {'board': str(b.uuid), 'index': 0, 'amount': 1})
+        self.assertEqual(res.json(), [get_post_dict(posts[2])])
+
+        res = self.client.get(url, {'board': str(b.uuid), 'index': 0, 'amount': 1, 'fields': 'name,secret'})
+        self.assertEqual(res.status_code, 400)
+
+    @tag('core')
+    def test_get_posts_since_ties(self):
+        """Posts created at the same time are never skipped by `since`."""
+        b = Board(title='hi', description='hello')
+        b.save()
+        created_at = timezone.now()
+        posts = sorted(
+            (Post(associated_board=b, name=str(i), created_at=created_at) for i in range(4)),
+            key=lambda post: post.uuid,
+        )
+        for p in posts:
+            p.save()
+        url = reverse('board:posts-get')
+
+        res = self.client.get(url, {'board': str(b.uuid), 'index': 0, 'amount': 4, 'embed': ''})
+        self.assertEqual([post['name'] for post in res.json()], [p.name for p in reversed(posts)])
+
+        since = get_post_dict(posts[0])['cursor']
+        res = self.client.get(url, {'board': str(b.uuid), 'since': since, 'amount': 1, 'embed': ''})
+        names = [post['name'] for post in res.json()]
+        while res.has_header('Link'):
+            res = self.client.get(re.match(r'<(.*)>; rel="next"', res['Link']).group(1))
+            names += [post['name'] for post in res.json()]
+        self.assertEqual(names, [p.name for p in posts[1:]])
+
+    @tag('core')
+    def test_get_latest_post(self):
+        """The latest post marker of a board takes a single query, once its post count is cached."""
+        b = Board(title='hi', description='hello')
+        b.save()
+        url = reverse('board:posts-latest')
+        self.assertEqual(
+            self.client.get(url, {'board': str(b.uuid)}).json(),
+            {'latest': None, 'cursor': None, 'count': 0},
+        )
+
+        posts = self.add_posts(b, 3)
+        self.client.get(url, {'board': str(b.uuid)})
+        with self.assertNumQueries(1):
+            res = self.client.get(url, {'board': str(b.uuid)})
+        latest = get_post_dict(posts[-1])
+        self.assertEqual(res.json(), {'latest': latest['created_at'], 'cursor': latest['cursor'], 'count': 3})
+
+        posts[0].delete()
+        self.assertEqual(self.client.get(url, {'board': str(b.uuid)}).json()['count'], 2)
+
+        self.assertEqual(self.client.get(url, {'board': str(uuid.uuid4())}).status_code, 404)
+        self.assertEqual(self.client.get(url, {'board': 'nope'}).status_code, 400)
+
     def test_get_posts_invalid_query(self):
         """ Test for missing or invalid query string.
 
@@ -381,6 +516,12 @@ class GetBoardDetailsTest(TestCase):
             'title': 'hello',
             'description': 'hi',
             'bg': str(img.uuid),
+            'bg_preview': {
+                'width': None,
+                'height': None,
+                'color': '',
+                'placeholder': '',
+            },
         }
         
         res = self.client.get(
@@ -424,3 +565,1499 @@ class GetBoardDetailsTest(TestCase):
         self.assertEqual(res.status_code, 405)
         self.assertEqual(res2.status_code, 405)
 
+
+
+@override_settings(IMAGE_CACHE_MAX_MB=0)
+class ViewBudgetTests(BudgetTestMixin, TestCase):
+    """Tests the board API endpoints stay within their query and time budgets on boards of any size."""
+
+    def test_get_posts_budget(self):
+        """Feed pages take four queries, wherever they are in the feed."""
+        for count, board in self.each_board():
+            for index in [0, count - 10]:
+                with self.assertBudget(queries=4, seconds=0.1):
+                    res = self.client.get(reverse('board:posts-get'), {'board': str(board.uuid), 'index': index, 'amount': 10})
+                self.assertEqual(len(res.json()), 10)
+
+    def test_get_posts_fieldset_budget(self):
+        """Feed pages without photos take one query less, and only read the requested columns."""
+        for count, board in self.each_board():
+            with self.assertBudget(queries=3, seconds=0.1) as captured:
+                res = self.client.get(
+                    reverse('board:posts-get'),
+                    {'board': str(board.uuid), 'index': 0, 'amount': 10, 'fields': 'name', 'embed': ''},
+                )
+            self.assertEqual(len(res.json()), 10)
+            self.assertNotIn('"message"', captured[-1]['sql'])
+
+    def test_get_posts_since_budget(self):
+        """Refreshing a feed with `since` takes as many queries as a page."""
+        for count, board in self.each_board():
+            latest = self.client.get(reverse('board:posts-latest'), {'board': str(board.uuid)}).json()['cursor']
+            with self.assertBudget(queries=4, seconds=0.1):
+                res = self.client.get(reverse('board:posts-get'), {'board': str(board.uuid), 'since': latest, 'amount': 10})
+            self.assertEqual(res.json(), [])
+
+    def test_get_latest_post_budget(self):
+        """The latest post marker takes a single query, once the post count is cached."""
+        for count, board in self.each_board():
+            self.client.get(reverse('board:posts-latest'), {'board': str(board.uuid)})
+            with self.assertBudget(queries=1, seconds=0.1):
+                res = self.client.get(reverse('board:posts-latest'), {'board': str(board.uuid)})
+            self.assertEqual(res.json()['count'], count)
+
+    def test_get_board_details_budget(self):
+        """Board details take a single query."""
+        for count, board in self.each_board():
+            with self.assertBudget(queries=1, seconds=0.05):
+                self.client.get(reverse('board:board-details-get'), {'board': str(board.uuid)})
+
+    def test_budget_catches_regressions(self):
+        """Going over the query budget, or scanning a whole table, fails."""
+        with self.assertRaisesRegex(AssertionError, 'over the budget of 1'):
+            with self.assertBudget(queries=1):
+                for post in Post.objects.all()[:2]:
+                    post.associated_board.title
+        if connection.vendor == 'sqlite':
+            with self.assertRaisesRegex(AssertionError, 'scanning a whole table'):
+                with self.assertBudget():
+                    Post.objects.filter(message='post 1').exists()
+
+    def test_get_image_budget(self):
+        """Images take a single query."""
+        for count, board in self.each_board():
+            image = PostImage.objects.filter(post__associated_board=board).values_list('image', flat=True).first()
+            with self.assertBudget(queries=1, seconds=0.05):
+                res = self.client.get(reverse('board:image-get', args=[image]))
+            self.assertEqual(res.status_code, 200)
+
+
+class HttpCachingTests(TestCase):
+    """Tests the caching and compression headers of the board API endpoints."""
+
+    def get_page(self, board, **extra):
+        """Request the first page of posts for a board."""
+        return self.client.get(
+            reverse('board:posts-get'),
+            {'board': str(board.uuid), 'index': '0', 'amount': '10'},
+            HTTP_ACCEPT='application/json',
+            **extra,
+        )
+
+    @tag('core')
+    def test_get_posts_revalidation(self):
+        """Unchanged feed pages are answered with a 304, and new posts invalidate the ETag."""
+        b = Board(title='hi', description='hello')
+        b.save()
+        Post(associated_board=b, message='first').save()
+
+        res1 = self.get_page(b)
+        self.assertEqual(res1.status_code, 200)
+        self.assertIn('no-cache', res1['Cache-Control'])
+        etag = res1['ETag']
+
+        res2 = self.get_page(b, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res2.status_code, 304)
+
+        Post(associated_board=b, message='second').save()
+        res3 = self.get_page(b, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res3.status_code, 200)
+        self.assertNotEqual(res3['ETag'], etag)
+
+    def test_get_posts_etag_changed_posts(self):
+        """Changing or deleting an older post invalidates the ETag as well."""
+        b = Board(title='hi', description='hello')
+        b.save()
+        first = Post(associated_board=b, message='first', created_at=timezone.now() - timezone.timedelta(seconds=1))
+        first.save()
+        Post(associated_board=b, message='second').save()
+
+        etag = self.get_page(b)['ETag']
+        first.message = 'edited'
+        first.save()
+        res = self.get_page(b, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()[1]['message'], 'edited')
+
+        etag = res['ETag']
+        first.delete()
+        res = self.get_page(b, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.json()), 1)
+
+    def test_get_posts_etag_changed_photos(self):
+        """Adding, changing or removing a photo of an older post invalidates the ETag."""
+        b = Board(title='hi', description='hello')
+        b.save()
+        first = Post(associated_board=b, message='first', created_at=timezone.now() - timezone.timedelta(seconds=1))
+        first.save()
+        Post(associated_board=b, message='second').save()
+
+        etag = self.get_page(b)['ETag']
+        photo = Image(name='photo', photo=make_png(2, 2)).save()
+        PostImage(post=first, image=photo).save()
+        res = self.get_page(b, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()[1]['photos'][0]['name'], 'photo')
+
+        etag = res['ETag']
+        photo.name = 'renamed'
+        photo.save(update_fields=['name'])
+        res = self.get_page(b, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()[1]['photos'][0]['name'], 'renamed')
+
+        etag = res['ETag']
+        photo.placeholder = 'data:'
+        photo.save(update_fields=['placeholder'])
+        self.assertEqual(self.get_page(b, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        photo.delete()
+        res = self.get_page(b, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()[1]['photos'], [])
+
+    def test_get_posts_etag_per_page(self):
+        """Different pages of the same board do not share an ETag."""
+        b = Board(title='hi', description='hello')
+        b.save()
+        Post(associated_board=b, message='first').save()
+
+        res1 = self.get_page(b)
+        res2 = self.client.get(
+            reverse('board:posts-get'),
+            {'board': str(b.uuid), 'index': '10', 'amount': '10'},
+            HTTP_IF_NONE_MATCH=res1['ETag'],
+        )
+        self.assertEqual(res2.status_code, 200)
+
+    def test_board_details_cache_control(self):
+        """Board details are publicly cacheable for a short time."""
+        b = Board(title='hi', description='hello', bg=Image(name='i', photo=bytearray('hi', 'utf-8')).save())
+        b.save()
+
+        res = self.client.get(reverse('board:board-details-get'), {'board': str(b.uuid)})
+        self.assertIn('public', res['Cache-Control'])
+        self.assertIn('max-age=60', res['Cache-Control'])
+        self.assertTrue(res.has_header('ETag'))
+
+    def test_large_pages_compressed(self):
+        """Large feed pages are gzipped for clients that accept it."""
+        b = Board(title='hi', description='hello')
+        b.save()
+        for i in range(10):
+            Post(associated_board=b, message='m' * 500).save()
+
+        res = self.get_page(b, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+
+
+def make_png(width, height, text=b''):
+    """Return the bytes of a blank greyscale PNG, optionally carrying a tEXt chunk."""
+    rows = b''.join(b'\x00' + b'\x00' * width for _ in range(height))
+    return b''.join([
+        PNG_SIGNATURE,
+        png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)),
+        png_chunk(b'tEXt', b'Comment\x00' + text) if text else b'',
+        png_chunk(b'IDAT', zlib.compress(rows)),
+        png_chunk(b'IEND', b''),
+    ])
+
+
+def make_jpeg(width, height, orientation=None, comment=b''):
+    """Return the bytes of a JPEG with the given headers, followed by some fake scan data."""
+    def segment(marker, data):
+        return struct.pack('>BBH', 0xFF, marker, len(data) + 2) + data
+
+    exif = b''
+    if orientation is not None:
+        tiff = b'MM\x00*' + struct.pack('>IHHHIHHI', 8, 1, 0x0112, 3, 1, orientation, 0, 0)
+        exif = segment(0xE1, b'Exif\x00\x00' + tiff + b'camera serial number')
+    return b''.join([
+        b'\xff\xd8',
+        segment(0xE0, b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'),
+        exif,
+        segment(0xFE, comment) if comment else b'',
+        segment(0xC0, struct.pack('>BHHB', 8, height, width, 1) + b'\x01\x11\x00'),
+        segment(0xDA, b'\x01\x01\x00\x00\x3f\x00'),
+        b'\x12\x34' * 100,
+        b'\xff\xd9',
+    ])
+
+
+class ImageValidationTests(TestCase):
+    """Tests the header-only validation and metadata stripping of uploaded images."""
+
+    def test_sniff_dimensions(self):
+        """The format and dimensions are read from the headers of each supported format."""
+        gif = b'GIF89a' + struct.pack('<HH', 30, 40) + b'\x00' * 20
+        webp = b'RIFF\x00\x00\x00\x00WEBPVP8X\x0a\x00\x00\x00\x00\x00\x00\x00' \
+            + (49).to_bytes(3, 'little') + (59).to_bytes(3, 'little')
+
+        self.assertEqual(sniff_image(io.BytesIO(make_png(10, 20))), ImageInfo('png', 'image/png', 10, 20))
+        self.assertEqual(sniff_image(io.BytesIO(make_jpeg(640, 480))), ImageInfo('jpeg', 'image/jpeg', 640, 480))
+        self.assertEqual(sniff_image(io.BytesIO(gif)), ImageInfo('gif', 'image/gif', 30, 40))
+        self.assertEqual(sniff_image(io.BytesIO(webp)), ImageInfo('webp', 'image/webp', 50, 60))
+
+        # A photo taken in portrait orientation is displayed with its dimensions swapped.
+        self.assertEqual(sniff_image(io.BytesIO(make_jpeg(640, 480, orientation=6))).width, 480)
+
+        with self.assertRaises(ValueError):
+            sniff_image(io.BytesIO(b'not an image at all'))
+
+    @tag('core')
+    def test_photo_field_validation(self):
+        """Photos are rejected if they are not images, or have too many pixels."""
+        field = PhotoField(required=False)
+
+        f = field.clean(SimpleUploadedFile('a.png', make_png(10, 20)))
+        self.assertEqual(f.image_info.width, 10)
+        self.assertEqual(f.content_type, 'image/png')
+
+        with self.assertRaises(ValidationError):
+            field.clean(SimpleUploadedFile('a.png', b'definitely not a png'))
+        with self.settings(MAX_IMAGE_PIXELS=100):
+            with self.assertRaises(ValidationError):
+                field.clean(SimpleUploadedFile('a.png', make_png(10, 20)))
+
+    @tag('core')
+    def test_strip_metadata(self):
+        """Metadata is dropped from uploads, except for the JPEG orientation."""
+        jpeg = Image.from_upload(SimpleUploadedFile('a.jpg', make_jpeg(64, 32, orientation=6, comment=b'secret'))).save()
+        photo = b''.join(jpeg.iter_chunks())
+        self.assertNotIn(b'camera serial number', photo)
+        self.assertNotIn(b'secret', photo)
+        self.assertTrue(photo.endswith(b'\x12\x34' * 100 + b'\xff\xd9'))
+        self.assertEqual((jpeg.width, jpeg.height, jpeg.content_type), (32, 64, 'image/jpeg'))
+        self.assertEqual(sniff_image(io.BytesIO(photo)), ImageInfo('jpeg', 'image/jpeg', 32, 64))
+
+        png = Image.from_upload(SimpleUploadedFile('a.png', make_png(10, 20, text=b'secret'))).save()
+        self.assertEqual(b''.join(png.iter_chunks()), make_png(10, 20))
+
+
+class MultiPhotoPostTests(TestCase):
+    """Tests creating and reading posts with multiple photos."""
+
+    def create_post(self, board, photos, message=''):
+        """Post the given photos to the `posts-create` API endpoint."""
+        return self.client.post(reverse('board:posts-create'), {
+            'board': str(board.uuid),
+            'name': 'shari',
+            'message': message,
+            'photo': [SimpleUploadedFile(f'{i}.png', photo) for i, photo in enumerate(photos)],
+        })
+
+    @tag('core')
+    def test_create_post_with_photos(self):
+        """All photos of a post are stored, in order, with their dimensions."""
+        b = Board(title='hi', description='hello')
+        b.save()
+
+        res = self.create_post(b, [make_png(1, 2), make_png(3, 4), make_png(5, 6)])
+        self.assertEqual(res.status_code, 204)
+
+        post = Post.objects.get(associated_board=b)
+        photos = [(pi.order, pi.image.name, pi.image.width, pi.image.height) for pi in post.postimage_set.all()]
+        self.assertEqual(photos, [(0, '0.png', 1, 2), (1, '1.png', 3, 4), (2, '2.png', 5, 6)])
+
+    @override_settings(IMAGE_STORAGE='blob')
+    def test_create_post_batched_inserts(self):
+        """Creating a post takes the same number of queries no matter how many photos it has."""
+        b = Board(title='hi', description='hello')
+        b.save()
+
+        with CaptureQueriesContext(connection) as one:
+            self.create_post(b, [make_png(1, 1)])
+        with CaptureQueriesContext(connection) as many:
+            self.create_post(b, [make_png(1, 1)] * 5)
+        self.assertEqual(len(one), len(many))
+        self.assertEqual(PostImage.objects.count(), 6)
+
+    def test_create_post_invalid(self):
+        """Posts need a message or photo, valid photos and an existing board."""
+        b = Board(title='hi', description='hello')
+        b.save()
+
+        self.assertEqual(self.create_post(b, []).status_code, 422)
+        self.assertEqual(self.create_post(b, [b'not a photo'], message='hi').status_code, 422)
+        self.assertEqual(self.create_post(Board(), [], message='hi').status_code, 404)
+        with self.settings(MAX_PHOTOS_PER_POST=2):
+            self.assertEqual(self.create_post(b, [make_png(1, 1)] * 3).status_code, 422)
+        self.assertEqual(self.create_post(b, [], message='hi').status_code, 204)
+        self.assertFalse(PostImage.objects.exists())
+
+    def test_too_many_photos_not_read(self):
+        """Photos are counted before any of them is read."""
+        field = MultiplePhotoField()
+        with self.settings(MAX_PHOTOS_PER_POST=2), self.assertRaises(ValidationError) as raised:
+            field.clean([SimpleUploadedFile('a.png', b'not a photo')] * 3)
+        self.assertEqual(raised.exception.code, 'too_many_photos')
+
+    @tag('core')
+    def test_get_posts_prefetches_photos(self):
+        """A feed page takes the same number of queries no matter how many photos it has."""
+        b = Board(title='hi', description='hello')
+        b.save()
+        for i in range(5):
+            self.create_post(b, [make_png(1, 1)] * i, message='hi')
+
+        # The ETag probe, the board, the posts and their photos.
+        with self.assertNumQueries(4):
+            res = self.client.get(reverse('board:posts-get'), {'board': str(b.uuid), 'index': '0', 'amount': '10'})
+        self.assertEqual([len(p['photos']) for p in res.json()], [4, 3, 2, 1, 0])
+
+
+def make_shard_uuid(shard):
+    """Return a random uuid4 placing a board on the given shard."""
+    while True:
+        key = uuid.uuid4()
+        if shard_for(key) == shard:
+            return key
+
+
+@override_settings(BOARD_SHARDS=['default', 'shard1'])
+class ShardingTests(TestCase):
+    """Tests spreading boards over a second database, created for these tests only."""
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.shard_dir = tempfile.TemporaryDirectory()
+        connections.databases['shard1'] = {
+            **connections.databases['default'], 'NAME': os.path.join(cls.shard_dir.name, 'shard1.sqlite3'),
+        }
+        with override_settings(BOARD_SHARDS=['default', 'shard1']):
+            call_command('migrate', database='shard1', verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['shard1'].close()
+        del connections['shard1']
+        del connections.databases['shard1']
+        cls.shard_dir.cleanup()
+
+    def test_shard_for(self):
+        """Adding a shard only moves boards to the new shard."""
+        keys = [uuid.uuid4() for _ in range(1000)]
+        before = [shard_for(key) for key in keys]
+        after = [shard_for(key, ['default', 'shard1', 'shard2']) for key in keys]
+        moved = [(a, b) for a, b in zip(before, after) if a != b]
+        self.assertTrue(200 < len(moved) < 470)
+        self.assertTrue(all(b == 'shard2' for _, b in moved))
+        self.assertEqual(shard_for(keys[0], ['default']), 'default')
+
+    @tag('core')
+    def test_board_on_shard(self):
+        """Posts and photos of a board on a shard are created and served from that shard."""
+        board = Board(uuid=make_shard_uuid('shard1'), title='hi', description='hello')
+        board.save(using='shard1')
+
+        res = self.client.post(reverse('board:posts-create'), {
+            'board': str(board.uuid),
+            'message': 'hi',
+            'photo': [SimpleUploadedFile('a.png', make_png(2, 3))],
+        })
+        self.assertEqual(res.status_code, 204)
+        self.assertFalse(Post.objects.exists())
+        image = Image.objects.using('shard1').get()
+        self.assertEqual(image.uuid.bytes[:SHARD_KEY_BYTES], board.uuid.bytes[:SHARD_KEY_BYTES])
+
+        res = self.client.get(reverse('board:posts-get'), {'board': board.uuid, 'index': 0, 'amount': 10})
+        self.assertEqual([post['message'] for post in res.json()], ['hi'])
+        self.assertEqual(res.json()[0]['photos'][0]['uuid'], str(image.uuid))
+
+        get_image_cache().clear()
+        res = self.client.get(reverse('board:image-get', args=[image.uuid]))
+        self.assertEqual(b''.join(res.streaming_content) if res.streaming else res.content, make_png(2, 3))
+        # Images whose uuid does not place them on their shard are still found.
+        other = Image(name='bg', photo=b'background').save()
+        parts = parse_multipart(self.client.get(reverse('board:images-get'), {'ids': f'{image.uuid},{other.uuid}'}))
+        self.assertEqual({key: data for key, (_, data) in parts.items()}, {
+            str(image.uuid): make_png(2, 3), str(other.uuid): b'background',
+        })
+
+    @tag('core')
+    def test_rebalance_shards(self):
+        """Boards held by another shard than their own are moved there, with their posts, photos and admins."""
+        keys = [make_shard_uuid('shard1'), make_shard_uuid('shard1'), make_shard_uuid('default')]
+        with self.settings(BOARD_SHARDS=['default']):
+            board = Board(uuid=keys[0], title='hi', description='hello',
+                          bg=Image(name='bg', photo=b'background').save())
+            board.save()
+            posts = create_posts(board, 3)
+            admin = User.objects.create_user('admin')
+            admin_board = Board.objects.create(uuid=keys[1], title='admin', description='hello')
+            admin_board.admin_users.add(admin)
+            local_board = Board.objects.create(uuid=keys[2], title='local', description='hello')
+
+        out = io.StringIO()
+        call_command('rebalance_shards', stdout=out)
+        self.assertIn('Moved 2 boards.', out.getvalue())
+
+        self.assertEqual(set(Board.objects.values_list('uuid', flat=True)), {local_board.uuid})
+        moved = Board.objects.using('shard1').get(uuid=board.uuid)
+        self.assertIsNone(moved.frozen_at)
+        self.assertEqual(moved.bg.photo, b'background')
+        self.assertEqual(
+            set(Post.objects.using('shard1').values_list('uuid', flat=True)), {post.uuid for post in posts},
+        )
+        self.assertEqual(PostImage.objects.using('shard1').count(), 3)
+        self.assertEqual(Image.objects.count(), 0)
+        self.assertQuerysetEqual(Board.objects.using('shard1').get(uuid=admin_board.uuid).admin_users.all(), [admin])
+
+        res = self.client.get(reverse('board:posts-get'), {'board': board.uuid, 'index': 0, 'amount': 10})
+        self.assertEqual(len(res.json()), 3)
+        res = self.client.get(reverse('board:image-get', args=[res.json()[0]['photos'][0]['uuid']]))
+        self.assertEqual(res.status_code, 200)
+
+    def test_move_board_copies_late_posts(self):
+        """Posts committed on the former shard while a board is copied are moved too."""
+        key = make_shard_uuid('shard1')
+        with self.settings(BOARD_SHARDS=['default']):
+            board = Board.objects.create(uuid=key, title='hi', description='hello')
+            create_posts(board, 2)
+
+        copy_posts = sharding._copy_posts
+        calls = []
+
+        def copy_posts_then_post(*args):
+            copy_posts(*args)
+            if not calls:
+                Post.objects.using('default').create(associated_board=board, name='late', message='late')
+            calls.append(args)
+
+        with mock.patch('board.sharding._copy_posts', copy_posts_then_post):
+            self.assertEqual(move_board(board.uuid, 'default', 'shard1'), 3)
+        self.assertFalse(Post.objects.exists())
+        self.assertEqual(Post.objects.using('shard1').filter(message='late').count(), 1)
+        self.assertEqual(len(calls), 2)
+
+    def test_board_admins_on_shard(self):
+        """Admins of boards on a shard are kept on the default database, with the users."""
+        board = Board(uuid=make_shard_uuid('shard1'), title='hi', description='hello')
+        board.save(using='shard1')
+        admin = User.objects.create_user('admin')
+        board.admin_users.add(admin)
+
+        self.assertQuerysetEqual(board.admin_users.all(), [admin])
+        self.assertEqual(BoardAdmin.objects.get().board_id, board.uuid)
+        board.delete()
+        self.assertFalse(BoardAdmin.objects.exists())
+
+
+@override_settings(IMAGE_STORAGE='chunked')
+class PostBatchingTests(TransactionTestCase):
+    """
+    Tests creating posts in grouped transactions.
+
+    The posts are created by a writer thread with its own database connection, so these tests
+    need the data to be committed.
+    """
+
+    def setUp(self):
+        self.board = Board(title='hi', description='hello')
+        self.board.save()
+
+    @tag('core')
+    def test_batch_posts(self):
+        """Posts submitted together are created in one transaction, failing only the invalid ones."""
+        batcher = PostBatcher(window=0.5, max_size=3)
+        futures = [
+            batcher.submit([SimpleUploadedFile('a.png', make_png(1, 2))], associated_board=self.board, message='a'),
+            batcher.submit([SimpleUploadedFile('b.png', b'not an image')], associated_board=self.board, message='b'),
+            batcher.submit(associated_board=self.board, message='c'),
+        ]
+
+        self.assertEqual(futures[0].result(5).message, 'a')
+        with self.assertRaises(ValueError):
+            futures[1].result(5)
+        self.assertEqual(futures[2].result(5).message, 'c')
+
+        self.assertEqual(set(Post.objects.values_list('message', flat=True)), {'a', 'c'})
+        image = PostImage.objects.get(post__message='a').image
+        self.assertEqual(b''.join(image.iter_chunks()), make_png(1, 2))
+
+    @override_settings(POST_BATCH_WINDOW_MS=10)
+    def test_create_post_batched(self):
+        """With post batching on, `CreatePost` answers once the post has been committed."""
+        res = self.client.post(reverse('board:posts-create'), {
+            'board': str(self.board.uuid),
+            'message': 'hi',
+            'photo': [SimpleUploadedFile('a.png', make_png(1, 1))],
+        })
+        self.assertEqual(res.status_code, 204)
+        self.assertEqual(PostImage.objects.get(post__message='hi').image.width, 1)
+
+    def test_closed_uploads(self):
+        """Photos are read when submitted, so their files may be closed before they are created."""
+        batcher = PostBatcher(window=0.2, max_size=10)
+        f = SimpleUploadedFile('a.png', make_png(1, 2))
+        future = batcher.submit([f], associated_board=self.board, message='a')
+        f.close()
+
+        self.assertEqual(future.result(5).message, 'a')
+        image = PostImage.objects.get(post__message='a').image
+        self.assertEqual(b''.join(image.iter_chunks()), make_png(1, 2))
+
+    def test_timed_out_posts_cancelled(self):
+        """Posts which are not committed in time are never created, so they may be retried."""
+        batcher = PostBatcher(window=0.5, max_size=10)
+        with self.assertRaises(futures.TimeoutError):
+            batcher.create(associated_board=self.board, message='late', timeout=0.01)
+        # The next batch is only created once the cancelled post is done with.
+        self.assertEqual(batcher.create(associated_board=self.board, message='next', timeout=5).message, 'next')
+        self.assertEqual(list(Post.objects.values_list('message', flat=True)), ['next'])
+
+    def test_stuck_transaction_timeout(self):
+        """Posts whose transaction has started but does not commit are only waited for a while longer."""
+        release = threading.Event()
+
+        class StuckBatcher(PostBatcher):
+            def flush(self, batch):
+                release.wait(5)
+                super().flush(batch)
+
+        batcher = StuckBatcher(window=0, max_size=10)
+        started = time.monotonic()
+        with self.assertRaises(futures.TimeoutError):
+            batcher.create(associated_board=self.board, message='stuck', timeout=0.1)
+        self.assertLess(time.monotonic() - started, 1)
+        release.set()
+        # The post is still created once its transaction is done.
+        for _ in range(50):
+            if Post.objects.filter(message='stuck').exists():
+                break
+            time.sleep(0.1)
+        self.assertTrue(Post.objects.filter(message='stuck').exists())
+
+
+class PhotoProcessingTests(TestCase):
+    """Tests processing the photos of new posts in a pool of processes."""
+
+    def setUp(self):
+        get_image_cache().clear()
+        self.photo = make_png(400, 300, text=b'secret')
+        self.info = sniff_image(io.BytesIO(self.photo))
+
+    def test_process_photo(self):
+        """Photos are stripped of their metadata, and get a thumbnail."""
+        processor = PhotoProcessor(1, max_pending=1)
+        self.addCleanup(processor.shutdown)
+        processed = processor.submit(self.photo, self.info).result(30)
+        self.assertEqual(processed.data, b''.join(iter_stripped(io.BytesIO(self.photo), self.info)))
+        self.assertNotIn(b'secret', processed.data)
+        self.assertEqual(processed, process_photo(self.photo, self.info))
+        self.assertEqual(sniff_image(io.BytesIO(processed.thumbnail[1])).width, 320)
+
+    @tag('core')
+    @override_settings(IMAGE_PROCESS_WORKERS=2, IMAGE_STORAGE='blob')
+    def test_create_post_processed(self):
+        """Processed photos are stored stripped, and their thumbnails cached once committed."""
+        board = Board(title='hi', description='hello')
+        board.save()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(reverse('board:posts-create'), {
+                'board': str(board.uuid),
+                'photo': [SimpleUploadedFile('a.png', self.photo), SimpleUploadedFile('b.png', make_png(1, 1))],
+            })
+        self.assertEqual(res.status_code, 204)
+
+        image = PostImage.objects.get(order=0).image
+        self.assertEqual(image.photo, process_photo(self.photo, self.info).data)
+        self.assertEqual(get_image_cache().get((image.uuid, 'thumbnail')).content_type, 'image/jpeg')
+
+    @override_settings(IMAGE_PROCESS_WORKERS=1, IMAGE_PROCESS_MAX_PENDING=1, IMAGE_PROCESS_TIMEOUT=0)
+    def test_backpressure(self):
+        """Posts whose photos find no room in the queue are a 503."""
+        board = Board(title='hi', description='hello')
+        board.save()
+        # The process is still starting, so the only slot stays taken.
+        get_photo_processor().submit(self.photo, self.info)
+
+        with self.assertRaises(futures.TimeoutError):
+            get_photo_processor().submit(self.photo, self.info, timeout=0)
+        res = self.client.post(reverse('board:posts-create'), {
+            'board': str(board.uuid),
+            'photo': [SimpleUploadedFile('a.png', self.photo)],
+        })
+        self.assertEqual(res.status_code, 503)
+        self.assertFalse(Post.objects.exists())
+
+
+class BoardPlaceholderTests(TestCase):
+    """Tests the low quality placeholders of board backgrounds."""
+
+    @tag('core')
+    def test_placeholder_generated_once(self):
+        """Saving a board generates its background's placeholder, which is kept afterwards."""
+        img = Image(name='bg', photo=make_png(64, 48)).save()
+        board = Board(title='hello', description='hi', bg=img)
+        board.save()
+
+        img.refresh_from_db()
+        self.assertTrue(img.placeholder.startswith('data:image/png;base64,'))
+        self.assertLess(len(img.placeholder), 1000)
+        self.assertEqual(img.color, '#000000')
+        self.assertEqual((img.width, img.height), (64, 48))
+
+        with self.assertNumQueries(1):
+            board.save()
+
+    def test_undecodable_placeholder_attempted_once(self):
+        """Backgrounds which cannot be decoded are only tried again once set again."""
+        img = Image(name='bg', photo=bytearray('not an image', 'utf-8')).save()
+        board = Board(title='hello', description='hi', bg=img)
+        board.save()
+        self.assertEqual(Image.objects.get(pk=img.pk).placeholder, '')
+
+        with self.assertNumQueries(1):
+            board.save()
+        with self.assertNumQueries(2):
+            Board.objects.get(pk=board.pk).save()
+
+    @tag('core')
+    def test_board_details_preview(self):
+        """Board details include the background preview, without loading the background."""
+        img = Image(name='bg', photo=make_png(64, 48)).save()
+        board = Board(title='hello', description='hi', bg=img)
+        board.save()
+        img.refresh_from_db()
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(reverse('board:board-details-get'), {'board': str(board.uuid)})
+        self.assertEqual(res.json()['bg_preview'], {
+            'width': 64,
+            'height': 48,
+            'color': img.color,
+            'placeholder': img.placeholder,
+        })
+        self.assertNotIn('"photo"', queries[0]['sql'])
+
+    def test_board_details_without_background(self):
+        """Boards without a background have no preview."""
+        board = Board(title='hello', description='hi')
+        board.save()
+
+        res = self.client.get(reverse('board:board-details-get'), {'board': str(board.uuid)})
+        self.assertIsNone(res.json()['bg'])
+        self.assertIsNone(res.json()['bg_preview'])
+
+
+class GetImageTests(TestCase):
+    """Tests the `image-get` API endpoint."""
+
+    @tag('core')
+    def test_get_image(self):
+        """Images are returned with their content type, and may be cached forever."""
+        img = Image(name='i', photo=make_png(2, 2), content_type='image/png').save()
+
+        res = self.client.get(reverse('board:image-get', args=[img.uuid]))
+        self.assertEqual(res.content, make_png(2, 2))
+        self.assertEqual(res['Content-Type'], 'image/png')
+        self.assertIn('immutable', res['Cache-Control'])
+
+    def test_get_image_invalid(self):
+        """Malformed image uuids are a 400, and unknown ones a 404, neither of which is cached."""
+        for image, status in [('nope', 400), (uuid.uuid4(), 404)]:
+            res = self.client.get(reverse('board:image-get', args=[image]))
+            self.assertEqual(res.status_code, status)
+            self.assertEqual(res['Cache-Control'], 'no-store')
+            self.assertFalse(res.has_header('ETag'))
+
+    def test_revalidate_image(self):
+        """Images are revalidated from their uuid, without any database access."""
+        img = Image(name='i', photo=make_png(2, 2), content_type='image/png').save()
+        url = reverse('board:image-get', args=[img.uuid])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(etag, f'"{img.uuid}"')
+
+        with self.assertNumQueries(0):
+            res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 304)
+        self.assertIn('immutable', res['Cache-Control'])
+
+
+def parse_multipart(res):
+    """Return the parts of a `multipart/mixed` response, as a dictionary of Content-ID to `(content type, bytes)`."""
+    boundary = res['Content-Type'].split('boundary=')[1].encode('ascii')
+    body = b''.join(res.streaming_content)
+    parts = {}
+    for part in body.split(b'--' + boundary)[1:-1]:
+        head, data = part[2:].split(b'\r\n\r\n', 1)
+        headers = dict(line.split(': ', 1) for line in head.decode('ascii').split('\r\n'))
+        data = data[:-2]
+        assert len(data) == int(headers['Content-Length'])
+        parts[headers['Content-ID'].strip('<>')] = (headers['Content-Type'], data)
+    return parts
+
+
+class GetImagesTests(TestCase):
+    """Tests the `images-get` API endpoint."""
+
+    def setUp(self):
+        get_image_cache().clear()
+        self.images = [
+            Image(name=f'i{i}', photo=make_png(400, 200 + i), content_type='image/png').save() for i in range(3)
+        ]
+
+    def get_images(self, images, variant=None, **extra):
+        params = {'ids': ','.join(str(img.uuid) for img in images)}
+        if variant is not None:
+            params['variant'] = variant
+        return self.client.get(reverse('board:images-get'), params, **extra)
+
+    @tag('core')
+    def test_get_images(self):
+        """The images are sent in one multipart response, located then fetched with a query each."""
+        with self.assertNumQueries(2):
+            res = self.get_images(self.images)
+            parts = parse_multipart(res)
+        self.assertEqual(parts, {str(img.uuid): ('image/png', img.photo) for img in self.images})
+        self.assertIn('immutable', res['Cache-Control'])
+
+        # Images are now cached, and revalidated without any database access.
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_images(self.images).status_code, 200)
+            res = self.get_images(self.images, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, 304)
+
+    def test_get_images_missing(self):
+        """Unknown images are left out of a response which is never cached, and a 404 if all are."""
+        with self.assertNumQueries(2):
+            res = self.get_images(self.images[:2] + [Image(uuid=uuid.uuid4())])
+            parts = parse_multipart(res)
+        self.assertEqual(set(parts), {str(img.uuid) for img in self.images[:2]})
+        self.assertEqual(res['Cache-Control'], 'no-store')
+        self.assertFalse(res.has_header('ETag'))
+
+        res = self.get_images([Image(uuid=uuid.uuid4())])
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res['Cache-Control'], 'no-store')
+
+    def test_get_thumbnails(self):
+        """Thumbnails fit in the thumbnail size, and keep the image's aspect ratio."""
+        parts = parse_multipart(self.get_images(self.images, variant='thumbnail'))
+        content_type, data = parts[str(self.images[0].uuid)]
+        self.assertEqual(content_type, 'image/jpeg')
+        info = sniff_image(io.BytesIO(data))
+        self.assertEqual((info.width, info.height), (320, 160))
+
+        # Thumbnails are cached apart from the originals.
+        self.assertEqual(parse_multipart(self.get_images(self.images[:1]))[str(self.images[0].uuid)][1], self.images[0].photo)
+
+    def test_get_images_invalid(self):
+        """Malformed uuids, unknown variants and too many images are a 400."""
+        url = reverse('board:images-get')
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.get(url, {'ids': 'nope'}).status_code, 400)
+        self.assertEqual(self.get_images(self.images, variant='huge').status_code, 400)
+        with self.settings(IMAGE_BATCH_MAX=2):
+            self.assertEqual(self.get_images(self.images).status_code, 400)
+        with self.settings(IMAGE_BATCH_THUMBNAIL_MAX=2):
+            self.assertEqual(self.get_images(self.images, variant='thumbnail').status_code, 400)
+            self.assertEqual(self.get_images(self.images).status_code, 200)
+
+
+class ImageCacheTests(TestCase):
+    """Tests the in-process cache of hot images."""
+
+    def test_evicts_least_recently_used(self):
+        """The cache holds at most its budget in bytes, evicting the least recently used images."""
+        cache = ImageCache(max_bytes=10, max_item_bytes=10)
+        cache.set('a', CachedImage('image/png', b'aaaa'))
+        cache.set('b', CachedImage('image/png', b'bbbb'))
+        self.assertEqual(cache.get('a').data, b'aaaa')
+        cache.set('c', CachedImage('image/png', b'cccc'))
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c').data, b'cccc')
+        self.assertEqual(cache.stats(), {'items': 2, 'bytes': 8, 'hits': 2, 'misses': 1, 'evictions': 1})
+
+        # Images larger than `max_item_bytes` are never cached.
+        cache.set('d', CachedImage('image/png', b'd' * 11))
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(cache.stats()['bytes'], 8)
+
+    def test_expires_images(self):
+        """Images are forgotten once older than the time to live."""
+        cache = ImageCache(max_bytes=10, ttl=-1)
+        cache.set('a', CachedImage('image/png', b'a'))
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['items'], 0)
+
+    @tag('core')
+    @override_settings(IMAGE_STORAGE='chunked', IMAGE_CACHE_MAX_MB=1)
+    def test_get_image_from_cache(self):
+        """Cached images are served, including byte ranges, without any database access."""
+        photo = make_png(4, 4)
+        with transaction.atomic():
+            img = Image.from_upload(SimpleUploadedFile('a.png', photo)).save()
+        url = reverse('board:image-get', args=[img.uuid])
+
+        self.assertEqual(self.client.get(url).content, photo)
+        with self.assertNumQueries(0):
+            res = self.client.get(url)
+            self.assertEqual((res.content, res['Content-Type']), (photo, 'image/png'))
+            res = self.client.get(url, HTTP_RANGE='bytes=0-3')
+            self.assertEqual((res.status_code, res.content), (206, photo[:4]))
+        self.assertEqual(get_image_cache().stats()['hits'], 2)
+
+        img.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class DiskImageCacheTests(TempDirSettingsMixin, TestCase):
+    """Tests the image cache shared by the processes of a host."""
+    temp_dir_setting = 'IMAGE_DISK_CACHE_ROOT'
+    temp_dir_extra_settings = {'IMAGE_STORAGE': 'chunked'}
+
+    @tag('core')
+    def test_get_image_from_disk(self):
+        """Images are cached on disk when first read, then sent from there without any database access."""
+        photo = make_png(4, 4)
+        with transaction.atomic():
+            img = Image.from_upload(SimpleUploadedFile('a.png', photo)).save()
+        url = reverse('board:image-get', args=[img.uuid])
+
+        self.assertEqual(b''.join(self.client.get(url)), photo)
+        self.assertEqual(get_disk_image_cache().path((img.uuid, 'original')).read_bytes(), photo)
+        self.assertEqual(get_image_cache().stats()['items'], 0)
+        with self.assertNumQueries(0):
+            res = self.client.get(url)
+            self.assertEqual((b''.join(res), res['Content-Type']), (photo, 'image/png'))
+            self.assertEqual(int(res['Content-Length']), len(photo))
+            self.assertNotIn('Content-Disposition', res)
+            res = self.client.get(url, HTTP_RANGE='bytes=4-7')
+            self.assertEqual((res.status_code, res.content), (206, photo[4:8]))
+
+        img.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_prune(self):
+        """Pruning deletes expired images, then the least recently served ones until the cache fits its budget."""
+        cache = DiskImageCache(self.temp_dir, max_bytes=8, max_age=60)
+        keys = [(uuid.uuid4(), 'original') for _ in range(4)]
+        for age, key in zip([120, 30, 20, 10], keys):
+            cache.write(key, [b'1234'])
+            mtime = timezone.now().timestamp() - age
+            os.utime(cache.path(key), (mtime, mtime))
+
+        self.assertEqual(cache.open(keys[0]), (None, None))
+        f, _ = cache.open(keys[1])
+        f.close()
+        self.assertEqual(cache.prune(), 1)
+        self.assertEqual([cache.path(key).exists() for key in keys], [False, True, False, True])
+        f, content_type = cache.open(keys[3])
+        with f:
+            self.assertEqual((f.read(), content_type), (b'1234', 'application/octet-stream'))
+
+    def test_prune_in_background(self):
+        """Writes never wait for the cache to be pruned, which runs in one background thread at a time."""
+        cache = DiskImageCache(self.temp_dir, max_bytes=4)
+        cache.prune_interval = 0
+        release = threading.Event()
+        pruned = []
+        cache.prune = lambda: (release.wait(5), pruned.append(True))
+
+        for _ in range(3):
+            cache.write((uuid.uuid4(), 'original'), [b'1234'])
+        self.assertEqual(pruned, [])
+        release.set()
+        for _ in range(50):
+            if not cache._pruning.locked():
+                break
+            time.sleep(0.1)
+        self.assertEqual(pruned, [True])
+
+
+class ArchiveTests(TempDirSettingsMixin, TestCase):
+    """Tests archiving the images of inactive boards."""
+    temp_dir_setting = 'IMAGE_ARCHIVE_ROOT'
+
+    def make_board(self, age):
+        """Return a board with a background and one photo post, all created `age` days ago."""
+        created_at = timezone.now() - timezone.timedelta(days=age)
+        board = Board(title='hi', description='hello', created_at=created_at,
+                      bg=Image(name='bg', photo=b'background').save())
+        board.save()
+        post = Post.objects.create(associated_board=board, message='hi', created_at=created_at)
+        PostImage(post=post, image=Image(name='photo', photo=b'photo' * 100).save()).save()
+        return board
+
+    @tag('core')
+    def test_archive_inactive_boards(self):
+        """Only boards without recent posts are archived, and their images restored on access."""
+        old = self.make_board(age=400)
+        recent = self.make_board(age=1)
+        revived = self.make_board(age=400)
+        Post.objects.create(associated_board=revived, message='still here')
+
+        call_command('archive_boards', days=365, stdout=io.StringIO())
+
+        old_images = Image.objects.filter(Q(board=old) | Q(postimage__post__associated_board=old))
+        self.assertEqual({bytes(i.photo) for i in old_images}, {b''})
+        self.assertTrue(all(i.archive for i in old_images))
+        self.assertFalse(Image.objects.exclude(id__in=old_images).exclude(archive='').exists())
+
+        res = self.client.get(reverse('board:image-get', args=[old.bg.uuid]))
+        self.assertEqual(b''.join(res), b'background')
+        old.bg.refresh_from_db()
+        self.assertEqual((b''.join(old.bg.iter_chunks()), old.bg.archive), (b'background', ''))
+
+    def test_rearchive_restored_image(self):
+        """Images restored and archived again are still served."""
+        old = self.make_board(age=400)
+        call_command('archive_boards', days=365, stdout=io.StringIO())
+        self.client.get(reverse('board:image-get', args=[old.bg.uuid]))
+        call_command('archive_boards', days=365, stdout=io.StringIO())
+
+        res = self.client.get(reverse('board:image-get', args=[old.bg.uuid]))
+        self.assertEqual(b''.join(res), b'background')
+
+    def test_concurrent_restores(self):
+        """An image restored meanwhile by another request is reloaded instead of restored again."""
+        old = self.make_board(age=400)
+        call_command('archive_boards', days=365, stdout=io.StringIO())
+        first, second = Image.objects.get(pk=old.bg_id), Image.objects.get(pk=old.bg_id)
+
+        with self.settings(IMAGE_STORAGE='chunked'):
+            restore_image(first)
+            restore_image(second)
+        self.assertEqual(ImageChunk.objects.filter(image=old.bg.uuid).count(), 1)
+        self.assertEqual((second.archive, b''.join(second.iter_chunks())), ('', b'background'))
+
+    def test_delete_archived_images(self):
+        """Deleting an archived image removes it from its pack, and deleting a board removes the pack."""
+        old = self.make_board(age=400)
+        call_command('archive_boards', days=365, stdout=io.StringIO())
+        path = archive_path(pack_name(old.uuid))
+        photo = Image.objects.get(postimage__post__associated_board=old)
+
+        photo.delete()
+        with zipfile.ZipFile(path) as pack:
+            self.assertEqual(pack.namelist(), [str(old.bg.uuid)])
+        res = self.client.get(reverse('board:image-get', args=[old.bg.uuid]))
+        self.assertEqual(b''.join(res), b'background')
+
+        old.delete()
+        self.assertFalse(path.exists())
+
+    def test_dry_run(self):
+        """A dry run lists the boards without archiving them."""
+        old = self.make_board(age=400)
+        out = io.StringIO()
+        call_command('archive_boards', days=365, dry_run=True, stdout=out)
+
+        self.assertIn(str(old.uuid), out.getvalue())
+        self.assertFalse(Image.objects.exclude(archive='').exists())
+
+
+class FrozenBoardTests(TempDirSettingsMixin, TestCase):
+    """Tests freezing boards into static snapshots."""
+    temp_dir_setting = 'SNAPSHOT_ROOT'
+    temp_dir_extra_settings = {'IMAGE_CACHE_MAX_MB': 0}
+
+    def setUp(self):
+        super().setUp()
+        self.board = Board(title='hi', description='hello', bg=Image(name='bg', photo=make_png(2, 2), content_type='image/png').save())
+        self.board.save()
+        create_posts(self.board, 5)
+        self.requests = [
+            (reverse('board:board-details-get'), {'board': str(self.board.uuid)}),
+            (reverse('board:posts-latest'), {'board': str(self.board.uuid)}),
+        ] + [
+            (reverse('board:posts-get'), {'board': str(self.board.uuid), 'index': index, 'amount': 2})
+            for index in [0, 2, 4, 6]
+        ]
+
+    @tag('core')
+    def test_freeze_board(self):
+        """Frozen boards are answered from their snapshot as before, without any database access."""
+        before = [self.client.get(url, query) for url, query in self.requests]
+        call_command('freeze_board', str(self.board.uuid), page_size=2, stdout=io.StringIO())
+
+        with self.assertNumQueries(0):
+            after = [self.client.get(url, query) for url, query in self.requests]
+            latest = after[1].json()['latest']
+            since = self.client.get(reverse('board:posts-get'), {'board': str(self.board.uuid), 'since': latest, 'amount': 2})
+            image = self.client.get(reverse('board:image-get', args=[self.board.bg.uuid]))
+            revalidated = self.client.get(*self.requests[2], HTTP_IF_NONE_MATCH=after[2]['ETag'])
+
+        self.assertEqual([res.json() for res in after], [res.json() for res in before])
+        self.assertEqual([res.get('Link') for res in after], [res.get('Link') for res in before])
+        self.assertEqual(since.json(), [])
+        self.assertEqual((b''.join(image), image['Content-Type']), (make_png(2, 2), 'image/png'))
+        self.assertEqual(revalidated.status_code, 304)
+
+        res = self.client.post(reverse('board:posts-create'), {'board': str(self.board.uuid), 'message': 'late'})
+        self.assertEqual(res.status_code, 403)
+
+    def test_unfreeze_board(self):
+        """Unfrozen boards are answered by the views again, and accept posts."""
+        call_command('freeze_board', str(self.board.uuid), stdout=io.StringIO())
+        call_command('freeze_board', str(self.board.uuid), unfreeze=True, stdout=io.StringIO())
+
+        self.assertFalse(any(settings.SNAPSHOT_ROOT.glob(f'**/{self.board.bg.uuid}')))
+        res = self.client.post(reverse('board:posts-create'), {'board': str(self.board.uuid), 'message': 'again'})
+        self.assertEqual(res.status_code, 204)
+        self.assertEqual(self.client.get(*self.requests[1]).json()['count'], 6)
+
+
+class SeedBoardsTests(TestCase):
+    """Tests the `seed_boards` management command."""
+
+    def seed(self, **options):
+        """Seed the database, and return the seeded posts' uuids, messages and photo bytes."""
+        call_command('seed_boards', stdout=io.StringIO(), **options)
+        return [
+            (post_image.post.uuid, post_image.post.message, bytes(post_image.image.photo))
+            for post_image in PostImage.objects.select_related('post', 'image').order_by('post__created_at', 'order')
+        ]
+
+    @tag('core')
+    def test_seed_boards(self):
+        """Boards are seeded with the requested posts and valid photos, the same for the same seed."""
+        options = {'boards': 2, 'posts': 25, 'photos': 2, 'distinct_photos': 3, 'chunk': 10, 'seed': 1}
+        seeded = self.seed(workers=2, **options)
+
+        self.assertEqual((Board.objects.count(), Post.objects.count(), Image.objects.count()), (2, 50, 100))
+        self.assertEqual(len({photo for _, _, photo in seeded}), 3)
+        self.assertEqual(sniff_image(io.BytesIO(seeded[0][2])), ImageInfo('png', 'image/png', 64, 64))
+
+        Board.objects.all().delete()
+        Image.objects.all().delete()
+        self.assertEqual(self.seed(**options), seeded)
+
+    def test_seed_boards_invalid(self):
+        """Invalid photo sizes are refused."""
+        with self.assertRaises(CommandError):
+            call_command('seed_boards', photo_size='big', stdout=io.StringIO())
+
+
+class StaticFilesTests(TempDirSettingsMixin, TestCase):
+    """Tests serving the hashed, precompressed static files of the board app."""
+    temp_dir_setting = 'STATIC_ROOT'
+
+    def setUp(self):
+        super().setUp()
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    @tag('core')
+    def test_hashed_precompressed_bundles(self):
+        """The board page links hashed bundles, which are sent precompressed and cached forever."""
+        res = self.client.get(reverse('board:board', args=['abc']))
+        self.assertIn('no-cache', res['Cache-Control'])
+        script = re.search(r'<script src="([^"]+)"', res.content.decode()).group(1)
+        self.assertRegex(script, r'^/static/board/app\.[0-9a-f]{12}\.js$')
+        original = (settings.BASE_DIR / 'board' / 'static' / 'board' / 'app.js').read_bytes()
+
+        res = self.client.get(script, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(res)), original)
+        self.assertIn(res['Content-Type'], ['text/javascript', 'application/javascript'])
+        self.assertIn('immutable', res['Cache-Control'])
+        self.assertIn('Accept-Encoding', res['Vary'])
+
+        res = self.client.get(script)
+        self.assertFalse(res.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(res), original)
+
+    def test_unhashed_files(self):
+        """Files requested by their original name are revalidated."""
+        res = self.client.get('/static/board/app.css')
+        self.assertIn('no-cache', res['Cache-Control'])
+        res = self.client.get('/static/board/app.css', HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(self.client.get('/static/../manage.py').status_code, 404)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReplicaRoutingTests(TestCase):
+    """Tests routing the read only board API views to the read replicas."""
+
+    def route(self, req, view_class):
+        """Return the database `Post`s are read from by a request to a view of the given class."""
+        reads = []
+
+        def view(req):
+            reads.append(router.db_for_read(Post))
+            return HttpResponse(status=204 if req.method == 'POST' else 200)
+        view.view_class = view_class
+
+        middleware = ReplicaRoutingMiddleware(lambda req: middleware.process_view(req, view, (), {}) or view(req))
+        response = middleware(req)
+        return reads[0], response
+
+    @tag('core')
+    def test_read_views_use_replicas(self):
+        """Reads of the read only views go to a replica, and everything else to the primary."""
+        factory = RequestFactory()
+
+        db, _ = self.route(factory.get('/'), GetPosts)
+        self.assertIn(db, ['replica1', 'replica2'])
+        db, _ = self.route(factory.get('/'), CreatePost)
+        self.assertEqual(db, 'default')
+        db, _ = self.route(factory.post('/'), GetPosts)
+        self.assertEqual(db, 'default')
+
+        # The replicas are only used during the request.
+        self.assertEqual(router.db_for_read(Post), 'default')
+        self.assertEqual(router.db_for_write(Post), 'default')
+
+    @tag('core')
+    def test_read_your_writes(self):
+        """Clients which just wrote something read from the primary for a while."""
+        factory = RequestFactory()
+
+        _, response = self.route(factory.post('/'), CreatePost)
+        cookie = response.cookies[ReplicaRoutingMiddleware.cookie_name]
+        self.assertEqual(cookie['max-age'], settings.REPLICA_STICKY_SECONDS)
+
+        req = factory.get('/')
+        req.COOKIES[cookie.key] = cookie.value
+        db, _ = self.route(req, GetPosts)
+        self.assertEqual(db, 'default')
+
+
+class PublicAPIMiddlewareTests(TestCase):
+    """Tests skipping the session, auth, message and clickjacking middleware for the public API."""
+
+    def setUp(self):
+        self.board = Board.objects.create(title='hi', description='hello')
+
+    @tag('core')
+    def test_public_api_skips_middleware(self):
+        """Public API requests get no session, user, messages or `X-Frame-Options`."""
+        res = self.client.get(reverse('board:posts-latest'), {'board': str(self.board.uuid)})
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.wsgi_request.public_api)
+        for attr in ('session', 'user', '_messages'):
+            self.assertFalse(hasattr(res.wsgi_request, attr), attr)
+        self.assertNotIn('X-Frame-Options', res)
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_other_pages_keep_middleware(self):
+        """The admin site and the board page still go through every middleware."""
+        for url in (reverse('admin:login'), reverse('board:main-board')):
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, 200)
+            self.assertFalse(res.wsgi_request.public_api)
+            self.assertTrue(hasattr(res.wsgi_request, 'session'))
+            self.assertTrue(hasattr(res.wsgi_request, 'user'))
+            self.assertEqual(res['X-Frame-Options'], 'DENY')
+
+    def test_create_post_without_csrf_token(self):
+        """Anonymous posts are accepted without a CSRF token."""
+        client = Client(enforce_csrf_checks=True)
+        res = client.post(reverse('board:posts-create'), {'board': str(self.board.uuid), 'message': 'hi'})
+        self.assertEqual(res.status_code, 204)
+        self.assertEqual(Post.objects.count(), 1)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ProfilingTests(TestCase):
+    """Tests profiling requests on demand, and browsing the profiles on the admin site."""
+
+    def setUp(self):
+        self.board = Board.objects.create(title='hi', description='hello')
+        get_profile_ring().clear()
+
+    def get_posts(self, **headers):
+        return self.client.get(
+            reverse('board:posts-get'), {'board': str(self.board.uuid), 'index': 0, 'amount': 10}, **headers,
+        )
+
+    @tag('core')
+    def test_signed_header(self):
+        """Requests with a valid token are profiled, with their SQL queries, and others are not."""
+        res = self.get_posts(HTTP_X_PROFILE=make_profile_token())
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('sql;desc="', res['Server-Timing'])
+
+        profile = get_profile_ring().get(int(res['X-Profile-Id']))
+        self.assertEqual(profile.view, 'board.views.GetPosts')
+        self.assertEqual(profile.status, 200)
+        self.assertTrue(any('board_post' in query.sql for query in profile.queries))
+        self.assertIn('function calls', profile.stats)
+
+        res = self.get_posts(HTTP_X_PROFILE=make_profile_token() + 'x')
+        self.assertFalse(res.has_header('X-Profile-Id'))
+        res = self.get_posts()
+        self.assertFalse(res.has_header('X-Profile-Id'))
+        self.assertEqual(len(get_profile_ring().list()), 1)
+
+    @override_settings(PROFILE_SAMPLE_PERCENT=100, PROFILE_RING_SIZE=3)
+    def test_sampling_keeps_last_profiles(self):
+        """Sampled requests are profiled without telling the client, keeping the last `PROFILE_RING_SIZE` profiles."""
+        responses = [self.get_posts() for _ in range(4)]
+        self.assertFalse(any(res.has_header('X-Profile-Id') or res.has_header('Server-Timing') for res in responses))
+        self.assertEqual([profile.path.split('?')[0] for profile in get_profile_ring().list()], [reverse('board:posts-get')] * 3)
+
+        res = self.get_posts(HTTP_X_PROFILE=make_profile_token())
+        self.assertEqual(get_profile_ring().list()[0].id, int(res['X-Profile-Id']))
+
+    def test_profiles_shared(self):
+        """Profiles are stored in the database, so the ring of any other process finds them."""
+        res = self.get_posts(HTTP_X_PROFILE=make_profile_token())
+        other_process_ring = ProfileRing(settings.PROFILE_RING_SIZE)
+        profile = other_process_ring.get(int(res['X-Profile-Id']))
+        self.assertEqual(profile.view, 'board.views.GetPosts')
+        self.assertTrue(any('board_post' in query.sql for query in profile.queries))
+
+    def test_admin_pages(self):
+        """Only staff users can browse the profiles."""
+        res = self.get_posts(HTTP_X_PROFILE=make_profile_token())
+        profile_id = int(res['X-Profile-Id'])
+
+        res = self.client.get(reverse('admin-profiles'))
+        self.assertEqual(res.status_code, 302)
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        res = self.client.get(reverse('admin-profiles'))
+        self.assertContains(res, 'board.views.GetPosts')
+        res = self.client.get(reverse('admin-profile', args=[profile_id]))
+        self.assertContains(res, 'board_post')
+        self.assertEqual(self.client.get(reverse('admin-profile', args=[profile_id + 100])).status_code, 404)
+
+
+class ImageStorageTests(TestCase):
+    """Tests reading and serving images through their storage backends."""
+
+    @tag('core')
+    def test_blob_chunks(self):
+        """BLOBs are read back in chunks, and ranges of them can be read."""
+        img = Image(name='i', photo=bytes(range(256)) * 10).save()
+        self.assertEqual(img.size, 2560)
+
+        with self.settings(IMAGE_STORAGE_CHUNK_SIZE=1000):
+            self.assertEqual([len(c) for c in img.iter_chunks()], [1000, 1000, 560])
+            self.assertEqual(b''.join(img.iter_chunks(10, 1010)), (bytes(range(256)) * 10)[10:1010])
+
+    @override_settings(IMAGE_STORAGE='auto')
+    def test_default_storage(self):
+        """Images are stored as large objects on PostgreSQL, and as BLOBs anywhere else."""
+        img = Image.from_upload(SimpleUploadedFile('a.png', make_png(1, 1))).save()
+        self.assertEqual(img.storage, 'largeobject' if connection.vendor == 'postgresql' else 'blob')
+
+    def test_get_image_revalidation(self):
+        """Cached images are revalidated without touching the database, and not gzipped."""
+        img = Image(name='i', photo=b'x' * 1000, content_type='image/png').save()
+        url = reverse('board:image-get', args=[img.uuid])
+
+        res = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(res.has_header('Content-Encoding'))
+        with self.assertNumQueries(0):
+            res = self.client.get(url, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, 304)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Large objects are only available on PostgreSQL.')
+@override_settings(IMAGE_STORAGE='largeobject', IMAGE_STORAGE_CHUNK_SIZE=1000, IMAGE_CACHE_MAX_MB=0)
+class LargeObjectStorageTests(TestCase):
+    """Tests storing images as PostgreSQL large objects."""
+
+    @tag('core')
+    def test_stream_large_object(self):
+        """Uploads are written to large objects and streamed back in chunks."""
+        photo = make_png(100, 100)
+        img = Image.from_upload(SimpleUploadedFile('a.png', photo)).save()
+        self.assertEqual((img.storage, img.size, bytes(img.photo)), ('largeobject', len(photo), b''))
+
+        res = self.client.get(reverse('board:image-get', args=[img.uuid]))
+        self.assertTrue(res.streaming)
+        self.assertEqual(int(res['Content-Length']), len(photo))
+        self.assertEqual(b''.join(res.streaming_content), photo)
+        self.assertEqual(b''.join(img.iter_chunks(10, 20)), photo[10:20])
+
+    def test_delete_large_object(self):
+        """Deleting an image unlinks its large object."""
+        img = Image.from_upload(SimpleUploadedFile('a.png', make_png(1, 1))).save()
+        oid = img.oid
+        img.delete()
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM pg_largeobject_metadata WHERE oid = %s', [oid])
+            self.assertEqual(cursor.fetchone(), (0,))
+
+
+@override_settings(IMAGE_STORAGE='chunked', IMAGE_STORAGE_CHUNK_SIZE=100, IMAGE_CACHE_MAX_MB=0)
+class ChunkedStorageTests(TestCase):
+    """Tests storing images as `ImageChunk` rows."""
+
+    # GIFs are stored unchanged, so this is what gets stored.
+    photo = b'GIF89a' + struct.pack('<HH', 16, 16) + bytes(range(256)) * 2
+
+    def upload(self, photo):
+        """Return a saved image holding the given upload."""
+        with transaction.atomic():
+            return Image.from_upload(SimpleUploadedFile('a.gif', photo)).save()
+
+    @tag('core')
+    def test_write_chunks(self):
+        """Uploads are split into full chunks, except for the last one."""
+        photo = self.photo
+        img = self.upload(photo)
+
+        chunks = list(img.imagechunk_set.order_by('index').values_list('index', 'data'))
+        self.assertEqual([index for index, _ in chunks], list(range(len(chunks))))
+        self.assertTrue(all(len(data) == 100 for _, data in chunks[:-1]))
+        self.assertEqual(b''.join(bytes(data) for _, data in chunks), photo)
+        self.assertEqual((img.storage, img.size, img.chunk_size), ('chunked', len(photo), 100))
+
+    @tag('core')
+    def test_stream_image(self):
+        """Chunked images are streamed one chunk per query."""
+        photo = self.photo
+        img = self.upload(photo)
+
+        res = self.client.get(reverse('board:image-get', args=[img.uuid]))
+        self.assertTrue(res.streaming)
+        self.assertEqual(int(res['Content-Length']), len(photo))
+        with self.assertNumQueries(-(-len(photo) // 100)):
+            self.assertEqual(b''.join(res.streaming_content), photo)
+
+    @tag('core')
+    def test_range_requests(self):
+        """Byte ranges only read the chunks overlapping them."""
+        photo = self.photo
+        img = self.upload(photo)
+        url = reverse('board:image-get', args=[img.uuid])
+
+        res = self.client.get(url, HTTP_RANGE='bytes=150-249')
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(res['Content-Range'], f'bytes 150-249/{len(photo)}')
+        with self.assertNumQueries(2):
+            self.assertEqual(b''.join(res.streaming_content), photo[150:250])
+
+        res = self.client.get(url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(res.streaming_content), photo[-10:])
+        res = self.client.get(url, HTTP_RANGE=f'bytes={len(photo)}-')
+        self.assertEqual(res.status_code, 416)
+        res = self.client.get(url, HTTP_RANGE='bytes=0-1,5-6')
+        self.assertEqual(res.status_code, 200)
+
+    def test_image_inserted_before_chunks(self):
+        """The chunks of a new image are only inserted once the image is, alone or with a post."""
+        board = Board.objects.create(title='hi', description='hello')
+        with CaptureQueriesContext(connection) as queries, transaction.atomic():
+            Image.from_upload(SimpleUploadedFile('a.gif', self.photo)).save()
+            Post.objects.create_with_photos([Image.from_upload(SimpleUploadedFile('b.gif', self.photo))],
+                                            associated_board=board)
+        tables = [
+            re.match(r'INSERT INTO "(\w+)"', query['sql']).group(1)
+            for query in queries.captured_queries if query['sql'].startswith('INSERT')
+        ]
+        chunks = -(-len(self.photo) // 100)
+        self.assertEqual(tables, ['board_image'] + ['board_imagechunk'] * chunks + [
+            'board_post', 'board_image', *['board_imagechunk'] * chunks, 'board_postimage',
+        ])
+        self.assertEqual(
+            [b''.join(image.iter_chunks()) for image in Image.objects.all()], [self.photo, self.photo],
+        )
+
+    def test_delete_chunks(self):
+        """Deleting an image deletes its chunks."""
+        img = self.upload(self.photo)
+        img.delete()
+        self.assertFalse(ImageChunk.objects.exists())
+
+
+def measure_startup(settings_module):
+    """
+    Return the total import time in microseconds, and the imported modules, of a worker boot.
+
+    A new interpreter is started with `python -X importtime`, imports the WSGI application with
+    the given settings module and loads the URLconf, as a worker does before its first request.
+    """
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings_module}
+    env.setdefault('SECRET_KEY', settings.SECRET_KEY)
+    result = subprocess.run(
+        [
+            sys.executable, '-X', 'importtime', '-c',
+            'import shiftboard.wsgi; from django.urls import get_resolver; get_resolver().url_patterns',
+        ],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+
+    total = 0
+    modules = set()
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+\d+ \|\s+(\S+)', line)
+        if match:
+            total += int(match.group(1))
+            modules.add(match.group(2))
+    return total, modules
+
+
+class LeanSettingsTests(SimpleTestCase):
+    """Tests the lean settings profile of the workers serving the public board API."""
+
+    def test_lean_profile_skips_admin(self):
+        """The lean profile never imports the admin site, sessions or messages."""
+        _, modules = measure_startup('shiftboard.settings_lean')
+        admin_only = [
+            module for module in modules
+            if module.startswith(('django.contrib.admin', 'django.contrib.sessions', 'django.contrib.messages'))
+        ]
+        self.assertEqual(admin_only, [])
+
+
+@tag('benchmark')
+@skipUnless(os.environ.get('RUN_BENCHMARKS'), 'Wall clock benchmarks only run with RUN_BENCHMARKS set.')
+class StartupBenchmarkTests(SimpleTestCase):
+    """Tracks the cold start time of workers using the lean settings profile."""
+
+    def test_lean_profile_boots_faster(self):
+        """Booting with the lean profile imports less than with the full settings."""
+        # Both profiles are measured in turns, so load from other processes affects them alike.
+        runs = [
+            (measure_startup('shiftboard.settings')[0], measure_startup('shiftboard.settings_lean')[0])
+            for _ in range(5)
+        ]
+        full = min(full for full, _ in runs)
+        lean = min(lean for _, lean in runs)
+        self.assertLess(lean, full)
+
+
+# Django's own middleware, in place of those skipping the public board API.
+STOCK_MIDDLEWARE = {
+    'board.auth_middleware.SessionMiddleware': 'django.contrib.sessions.middleware.SessionMiddleware',
+    'board.auth_middleware.AuthenticationMiddleware': 'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'board.auth_middleware.MessageMiddleware': 'django.contrib.messages.middleware.MessageMiddleware',
+    'board.middleware.XFrameOptionsMiddleware': 'django.middleware.clickjacking.XFrameOptionsMiddleware',
+}
+
+
+@tag('benchmark')
+@skipUnless(os.environ.get('RUN_BENCHMARKS'), 'Wall clock benchmarks only run with RUN_BENCHMARKS set.')
+class PublicAPIMiddlewareBenchmarkTests(TestCase):
+    """Tracks the per request overhead of the middleware on the public board API."""
+
+    def measure(self, requests=200):
+        """Return the mean time in seconds of a `posts-latest` request with the current middleware."""
+        client = Client()
+        url = reverse('board:posts-latest')
+        params = {'board': str(self.board.uuid)}
+        client.get(url, params)
+        start = time.perf_counter()
+        for _ in range(requests):
+            client.get(url, params)
+        return (time.perf_counter() - start) / requests
+
+    def test_public_api_middleware_is_lighter(self):
+        """Skipping sessions, auth, messages and clickjacking makes public API requests cheaper."""
+        self.board = Board.objects.create(title='hi', description='hello')
+        stock_middleware = [STOCK_MIDDLEWARE.get(middleware, middleware) for middleware in settings.MIDDLEWARE]
+        # Both stacks are measured in turns, so load from other processes affects them alike.
+        runs = []
+        for _ in range(5):
+            with override_settings(MIDDLEWARE=stock_middleware):
+                stock = self.measure()
+            runs.append((stock, self.measure()))
+        stock = min(stock for stock, _ in runs)
+        public = min(public for _, public in runs)
+        self.assertLess(public, stock, f'{public * 1e6:.0f}us per request, {stock * 1e6:.0f}us without skipping')
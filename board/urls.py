@@ -7,7 +7,9 @@ urlpatterns = [
     path('', views.GetMainBoard.as_view(), name='main-board'),
     path('api/board/get', views.GetBoardDetails.as_view(), name='board-details-get'),
     path('api/board/posts/get', views.GetPosts.as_view(), name='posts-get'),
+    path('api/board/posts/latest', views.GetLatestPost.as_view(), name='posts-latest'),
     path('api/board/posts/create', views.CreatePost.as_view(), name='posts-create'),
+    path('api/board/images', views.GetImages.as_view(), name='images-get'),
     path('api/board/images/<image>', views.GetImage.as_view(), name='image-get'),
     path('<board>/', views.GetMainBoard.as_view(), name='board'),
 ]
\ No newline at end of file
@@ -1,11 +1,53 @@
+import hashlib
+import os
+import uuid
+from concurrent import futures
+from urllib.parse import urlencode
 from uuid import UUID
-from django.http import HttpResponse, JsonResponse
+
+from django.conf import settings
+from django.db import router, transaction
+from django.core.cache import cache
+from django.db.models import F, OuterRef, Prefetch, Subquery
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.http.response import Http404
+from django.shortcuts import render
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from django.utils.http import quote_etag
 from django.views import View
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 
+from board.archive import restore_image
+from board.batching import get_post_batcher
+from board.cache import (
+    IMAGE_VARIANTS, VARIANT_ORIGINAL, VARIANT_THUMBNAIL, CachedImage, cache_image, get_disk_image_cache,
+    get_image_cache, read_mapped,
+)
 from board.forms import PostForm
-from board.models import Post, Board, Image
+from board.images import make_thumbnail
+from board.models import Post, Board, Image, PostImage
+from board.processing import get_photo_processor
+from board.routers import using_shard
+from board.sharding import shard_for
+from board.storage import BlobStorage
+
+# Images never change once stored, so they may be cached for as long as HTTP allows (a year).
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+
+# The number of images read at once from the rows of a batch (see `GetImages`).
+IMAGE_BATCH_CHUNK_SIZE = 10
+
+# The fields of a post, and the related data embedded in it, which clients may pick from with
+# the `fields` and `embed` query string params of `GetPosts`. All of them are sent by default.
+POST_FIELDS = ('name', 'message', 'created_at', 'cursor')
+POST_EMBEDS = ('photos',)
 
+@method_decorator(cache_control(public=True, no_cache=True), name='get')
 class GetMainBoard(View):
     """
     The landing page serving the React single page board app.
@@ -13,6 +55,11 @@ class GetMainBoard(View):
     This includes displaying the board, the creating post page, and the viewing post popup.
 
     This can be found at the path '/board-name-uuid'.
+
+    The page links the app's bundles by their hashed names (see `board.staticfiles`), which may
+    be cached forever, so the page itself must be revalidated on every use to pick up new
+    bundles. `ConditionalGetMiddleware` tags it with an ETag, so it is answered with a `304`
+    until it changes.
     """
 
     #TODO: replace board uuid with hardcoded board
@@ -21,38 +68,261 @@ class GetMainBoard(View):
         #TODO: write the board app frontend
         #TODO: generalize the board uuid
 
-        board = '<h1>this is the board</h1>'
-        return HttpResponse(board)
+        return render(req, 'board/index.html', {'board': board})
 
-def get_post_dict(post):
+def get_post_fields(values, fields=POST_FIELDS):
+    """
+    Return a formated dictionary of the requested fields of a post, without its photos.
+
+    Params:
+        values -> `dict`: the values of the post's columns, e.g. a row from `values()`. Only
+            the requested fields are read, and `created_at` and `uuid` for the cursor.
+        fields -> `tuple` of `string`: the fields to return, out of `POST_FIELDS`.
+    """
+    post = {field: values[field] for field in POST_FIELDS if field in fields and field != 'cursor'}
+    if ('created_at' in post):
+        post['created_at'] = format_post_marker(post['created_at'])
+    if ('cursor' in fields):
+        post['cursor'] = format_post_cursor(values['created_at'], values['uuid'])
+    return post
+
+def get_post_dict(post, fields=POST_FIELDS, embed=POST_EMBEDS):
     """
     Return a formated dictionary of a post.
 
+    The photos are read from `post.postimage_set`, so posts should be fetched with
+    `prefetch_post_photos` to avoid one query per post.
+
     Params:
-        post -> `Post`: the post.
+        post -> `Post`: the post. Only the requested fields, `created_at` and `uuid` are read,
+            so the others may be deferred.
+        fields -> `tuple` of `string`: the fields to return, out of `POST_FIELDS`.
+        embed -> `tuple` of `string`: the related data to return, out of `POST_EMBEDS`.
     
     JSON fields:
         name -> `string`: the author's name.
         message -> `string`: the message written.
-        photo -> {
-            uuid -> `string`: the photo's uuid.
-            name -> `string`: the photo's name.
-        }
+        created_at -> `string`: the post's creation time (see `format_post_marker`).
+        cursor -> `string`: the post's place in the feed (see `format_post_cursor`).
+        photos -> [
+            {
+                uuid -> `string`: the photo's uuid.
+                name -> `string`: the photo's name.
+                width -> `int`: the photo's width in pixels, or `null` if unknown.
+                height -> `int`: the photo's height in pixels, or `null` if unknown.
+            }
+        ]: the post's photos, in order.
     """
-    if (post.photo is not None):
-        photo = {
-            'uuid': str(post.photo.uuid),
-            'name': post.photo.name,
-        }
-    else:
-        photo = None
+    values = {field: getattr(post, field) for field in fields if field != 'cursor'}
+    data = get_post_fields({**values, 'created_at': post.created_at, 'uuid': post.uuid}, fields)
+    if ('photos' in embed):
+        data['photos'] = [
+            {
+                'uuid': str(post_image.image.uuid),
+                'name': post_image.image.name,
+                'width': post_image.image.width,
+                'height': post_image.image.height,
+            }
+            for post_image in post.postimage_set.all()
+        ]
+    return data
+
+def get_board_dict(board):
+    """
+    Return a formated dictionary of the details of a board, as returned by `GetBoardDetails`.
 
+    Params:
+        board -> `Board`: the board, fetched with its background but without the background
+            BLOB, e.g. with `select_related('bg').defer('bg__photo')`.
+    """
+    bg = board.bg
     return {
-        'name': post.name,
-        'message': post.message,
-        'photo': photo,
+        'title': board.title,
+        'description': board.description,
+        'bg': str(bg.uuid) if bg is not None else None,
+        'bg_preview': {
+            'width': bg.width,
+            'height': bg.height,
+            'color': bg.color,
+            'placeholder': bg.placeholder,
+        } if bg is not None else None,
     }
 
+def prefetch_post_photos(posts_query_set):
+    """
+    Return the posts query set, prefetching the photos of every post in a single query.
+
+    Only the photo details sent with a post are read, not the image BLOBs nor their previews.
+    The photos are matched to the posts by uuid, so the posts must be fetched with it.
+    """
+    return posts_query_set.prefetch_related(Prefetch(
+        'postimage_set',
+        queryset=PostImage.objects.select_related('image').only(
+            'post', 'image', 'image__uuid', 'image__name', 'image__width', 'image__height',
+        ),
+    ))
+
+def parse_post_fieldset(req):
+    """
+    Return the fields and the related data of posts requested with the `fields` and `embed`
+    query string params, as comma separated lists, e.g. `fields=created_at&embed=photos`.
+    A missing param requests everything, and an empty one nothing.
+
+    Raises:
+        `ValueError` if a field or related data does not exist.
+    """
+    def parse(param, names):
+        value = req.GET.get(param)
+        if (value is None):
+            return names
+        requested = tuple(name for name in value.split(',') if name)
+        if (not set(requested) <= set(names)):
+            raise ValueError(f'Invalid {param}.')
+        return requested
+
+    return parse('fields', POST_FIELDS), parse('embed', POST_EMBEDS)
+
+def format_post_marker(created_at):
+    """
+    Return the creation time of a post as sent to clients, an ISO 8601 UTC timestamp such as
+    `2021-05-01T12:00:00.123456Z`.
+    """
+    return created_at.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+def parse_post_marker(marker):
+    """
+    Return the time of a post marker (see `format_post_marker`), or `None` if there is none.
+
+    Raises:
+        `ValueError` if the marker is not a timestamp with a time zone.
+    """
+    if (marker is None):
+        return None
+    created_at = parse_datetime(marker)
+    if (created_at is None or timezone.is_naive(created_at)):
+        raise ValueError('Invalid post marker.')
+    return created_at
+
+def format_post_cursor(created_at, post_uuid):
+    """
+    Return the place of a post in the feed as sent to clients, its creation time (see
+    `format_post_marker`) and uuid, e.g. `2021-05-01T12:00:00.123456Z_<post uuid>`. Clients
+    send it back as `since` to only get newer posts.
+
+    Posts created at the same time are ordered by uuid, so no post is ever skipped, unlike with
+    the creation time alone.
+    """
+    return f'{format_post_marker(created_at)}_{post_uuid}'
+
+def parse_post_cursor(cursor):
+    """
+    Return the creation time and uuid of a post cursor (see `format_post_cursor`), or `None` if
+    there is none. A bare post marker is accepted as well, with a `None` uuid, and stands for
+    the posts created up to its time.
+
+    Raises:
+        `ValueError` if the cursor is invalid.
+    """
+    if (cursor is None):
+        return None
+    marker, _, post_uuid = cursor.partition('_')
+    return parse_post_marker(marker), UUID(post_uuid) if post_uuid else None
+
+def filter_posts_after(posts_query_set, cursor):
+    """
+    Return the posts of a query set which come after a post cursor (see `parse_post_cursor`).
+
+    The posts are filtered as a range of the `(associated_board, created_at, uuid)` index,
+    leaving out the posts created at the cursor's time up to its uuid.
+    """
+    created_at, post_uuid = cursor
+    if (post_uuid is None):
+        return posts_query_set.filter(created_at__gt=created_at)
+    return posts_query_set \
+        .filter(created_at__gte=created_at) \
+        .exclude(created_at=created_at, uuid__lte=post_uuid)
+
+def is_post_after(created_at, post_uuid, cursor):
+    """
+    Return whether the post created at `created_at` with the uuid `post_uuid` comes after a post
+    cursor (see `parse_post_cursor`), as `filter_posts_after` would find it. A post without a
+    uuid created at the cursor's time is taken to come after it.
+    """
+    since, since_uuid = cursor
+    if (since_uuid is None or created_at != since):
+        return created_at > since
+    return post_uuid is None or post_uuid > since_uuid
+
+def get_board_feed_state(board_uuid):
+    """
+    Return what the feed of a board depends on, or `None` if there is no such board.
+
+    This takes a single query: the board's `posts_version`, and a probe of its latest post down
+    the `(associated_board, created_at, uuid)` index, whatever the number of posts. New posts
+    change the latest post, and changing or deleting posts or their photos bumps the version.
+
+    Returns:
+        A dictionary with:
+            latest -> `datetime`: the creation time of the latest post, or `None` if none.
+            latest_uuid -> `UUID`: the uuid of the latest post, or `None` if none.
+            version -> `int`: the board's `posts_version`.
+    """
+    latest = Post.objects \
+        .filter(associated_board=OuterRef('pk')) \
+        .order_by('-created_at', '-uuid')
+    return Board.objects \
+        .filter(uuid=board_uuid) \
+        .annotate(
+            latest=Subquery(latest.values('created_at')[:1]),
+            latest_uuid=Subquery(latest.values('uuid')[:1]),
+        ) \
+        .values('latest', 'latest_uuid', version=F('posts_version')) \
+        .first()
+
+def get_board_post_count(board_uuid, state):
+    """
+    Return the number of posts of a board.
+
+    Counting reads every post of the board, so the count is cached (see `CACHES`) under the
+    board's feed state (see `get_board_feed_state`), and is only counted again once the posts
+    of the board change.
+    """
+    latest = state['latest'].isoformat() if state['latest'] is not None else ''
+    key = f'board-post-count:{board_uuid}:{state["version"]}:{latest}:{state["latest_uuid"]}'
+    return cache.get_or_set(key, lambda: Post.objects.filter(associated_board__uuid=board_uuid).count())
+
+def get_posts_etag(req, *args, **kwargs):
+    """
+    Return the ETag of a feed page, or `None` if the query string is not usable or there is no
+    such board.
+
+    The tag is keyed on the board's feed state (see `get_board_feed_state`), along with the
+    requested page, so it changes whenever a post is added to, changed on or removed from the
+    board, and whenever the photos of a post change. Computing it costs a single probe of the
+    `(associated_board, created_at, uuid)` index, which lets unchanged pages be answered with a
+    `304` before any posts are loaded.
+    """
+    try:
+        board_uuid = UUID(req.GET.get('board'), version=4)
+        since = req.GET.get('since')
+        parse_post_cursor(since)
+        index = int(req.GET.get('index')) if since is None else 0
+        amount = int(req.GET.get('amount'))
+        fields, embed = parse_post_fieldset(req)
+    except:
+        return None
+
+    state = get_board_feed_state(board_uuid)
+    if (state is None):
+        return None
+    latest = state['latest'].isoformat() if state['latest'] is not None else ''
+
+    fieldset = f'{",".join(fields)}:{",".join(embed)}'
+    key = f'{board_uuid}:{latest}:{state["latest_uuid"]}:{state["version"]}:{index}:{amount}:{since or ""}:{fieldset}'
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+@method_decorator(cache_control(public=True, no_cache=True), name='get')
+@method_decorator(condition(etag_func=get_posts_etag), name='get')
 class GetPosts(View):
     """
     An API to get the number of posts for a board from a certain index.
@@ -64,14 +334,42 @@ class GetPosts(View):
     Then, as they scroll down to a certain point, the client (not the user, but the client script)
     requests for more post information and the server responds correspondingly.
 
+    Pages may be stored by browsers and shared caches, but must be revalidated on every use.
+    Each page carries an ETag (see `get_posts_etag`), so a page that has not changed since the
+    client last fetched it is answered with an empty `304 Not Modified`.
+
+    A client refreshing a board it already shows can instead send the `cursor` of the newest
+    post it has as `since`, to only get the posts created after it (see `get`). Whether there
+    are any can be checked first with the `posts-latest` API endpoint (see `GetLatestPost`).
+
+    Whenever a page is full, a `Link` header points at the page to request next with
+    `rel="next"`, so clients may prefetch it.
+
+    Clients which do not need every field of the posts, such as a grid of thumbnails, can pick
+    the fields with `fields` and the related data with `embed` (see `parse_post_fieldset`),
+    e.g. `fields=created_at&embed=photos`. Only the requested columns are read from the
+    database, and only the requested fields are sent.
+
     Returns an array of posts with each post looking like:
         name -> `string`: the author's name.
         message -> `string`: the message written.
-        photo -> {
-            uuid -> `string`: the photo's uuid.
-            name -> `string`: the photo's name.
-        }
+        created_at -> `string`: the post's creation time, as an ISO 8601 UTC timestamp.
+        cursor -> `string`: the post's place in the feed, to send back as `since`.
+        photos -> [
+            {
+                uuid -> `string`: the photo's uuid.
+                name -> `string`: the photo's name.
+                width -> `int`: the photo's width in pixels, or `null` if unknown.
+                height -> `int`: the photo's height in pixels, or `null` if unknown.
+            }
+        ]
+
+    A page always takes two queries for its posts: one for the posts and one for all of
+    their photos, which is skipped if the photos are not embedded.
     """
+    public_api = True
+    shard_by = 'board'
+    read_from_replica = True
 
     def get(self, req):
         """
@@ -85,19 +383,28 @@ class GetPosts(View):
         the query string would be index=50&amount=30. The index is zero-based, inclusive at start
         and exclusive at the end.
 
+        With `since` instead of `index`, e.g. since=<post cursor>&amount=30, only the posts
+        created after the post of the cursor (see `format_post_cursor`) are returned, newest
+        first. If there are more than `amount` of them, the oldest `amount` are returned, and the
+        next ones can be requested with the cursor of the newest post returned as `since` (see
+        the `Link` header).
+
         Returns:
             A JSON representation of the posts.
         """
         try:
             # Ensure all these parameters exist.
             board_uuid = req.GET.get('board')
-            index = req.GET.get('index')
+            since = req.GET.get('since')
+            index = req.GET.get('index') if since is None else 0
             amount = req.GET.get('amount')
 
             # Validating each param.
             board_uuid = UUID(board_uuid, version=4)
+            since = parse_post_cursor(since)
             index = int(index)
             amount = int(amount)
+            fields, embed = parse_post_fieldset(req)
         except:
             return HttpResponse(status=400)
 
@@ -109,15 +416,83 @@ class GetPosts(View):
         if (index < 0 or amount < 0):
             return HttpResponse(status=400)   
 
-        
-        posts_query_set = Post.objects \
-            .filter(associated_board__uuid__exact=board_uuid) \
-            .order_by('-created_at')[index:index+amount]
+        posts_query_set = Post.objects.filter(associated_board__uuid__exact=board_uuid)
+        if (since is None):
+            posts_query_set = posts_query_set.order_by('-created_at', '-uuid')[index:index+amount]
+        else:
+            # The oldest new posts come first, so that clients can catch up page by page.
+            posts_query_set = filter_posts_after(posts_query_set, since) \
+                .order_by('created_at', 'uuid')[:amount]
 
-        posts = [get_post_dict(post) for post in posts_query_set]
-        return JsonResponse(posts, safe=False)
+        # Only the requested columns are read, along with the cursor for the next page.
+        columns = {*fields, 'created_at', 'uuid'} - {'cursor'}
+        if ('photos' in embed):
+            rows = list(prefetch_post_photos(posts_query_set.only(*columns)))
+            posts = [get_post_dict(post, fields, embed) for post in rows]
+            cursors = [format_post_cursor(post.created_at, post.uuid) for post in rows]
+        else:
+            rows = list(posts_query_set.values(*columns))
+            posts = [get_post_fields(row, fields) for row in rows]
+            cursors = [format_post_cursor(row['created_at'], row['uuid']) for row in rows]
 
+        if (since is not None):
+            posts.reverse()
+        response = JsonResponse(posts, safe=False)
 
+        if (posts and len(posts) == amount):
+            if (since is None):
+                next_page = {'board': board_uuid, 'index': index + amount, 'amount': amount}
+            else:
+                next_page = {'board': board_uuid, 'since': cursors[-1], 'amount': amount}
+            for param in ('fields', 'embed'):
+                if (param in req.GET):
+                    next_page[param] = req.GET[param]
+            response['Link'] = f'<{req.path}?{urlencode(next_page)}>; rel="next"'
+        return response
+
+
+@method_decorator(cache_control(public=True, no_cache=True), name='get')
+class GetLatestPost(View):
+    """
+    An API to check whether a board has new posts, without loading any.
+
+    Clients refreshing a board poll this, and only request the new posts from `GetPosts` with
+    `since` once `cursor` differs from the cursor of the newest post they have. It costs a
+    single probe of the `(associated_board, created_at, uuid)` index (see
+    `get_board_feed_state`), as the count is cached until the posts change, and may be
+    requested with `HEAD` and revalidated by `ConditionalGetMiddleware` to skip the body as well.
+
+    This can be found at the path 'api/board/posts/latest?board=<board uuid>'.
+
+    JSON fields:
+        latest -> `string`: the `created_at` of the board's latest post, or `null` if none.
+        cursor -> `string`: the `cursor` of the board's latest post, or `null` if none.
+        count -> `int`: the number of posts on the board.
+    """
+    public_api = True
+    shard_by = 'board'
+    read_from_replica = True
+
+    def get(self, req):
+        """Get the latest post marker of a board as a JSON response."""
+        try:
+            board_uuid = UUID(req.GET.get('board'), version=4)
+        except:
+            return HttpResponse(status=400)
+
+        state = get_board_feed_state(board_uuid)
+        if (state is None):
+            return HttpResponse(status=404)
+
+        latest = state['latest']
+        return JsonResponse({
+            'latest': format_post_marker(latest) if latest is not None else None,
+            'cursor': format_post_cursor(latest, state['latest_uuid']) if latest is not None else None,
+            'count': get_board_post_count(board_uuid, state),
+        })
+
+
+@method_decorator(csrf_exempt, name='dispatch')
 class CreatePost(View):
     """
     The API endpoint responsible for handling new post creations.
@@ -129,7 +504,15 @@ class CreatePost(View):
     A new post may contain photos, messages, or a mix of both. The user can also optionally
     leave their name on the post. The user cannot submit a post with only their names, and 
     of course, an empty post.
+
+    Frozen boards (see `board.snapshots`) are closed, and do not accept any more posts.
+
+    Posting is anonymous and never acts on behalf of a logged in user, so there is nothing for
+    a forged cross-site request to abuse, and the endpoint is exempt from CSRF checks. The
+    board app does not need a CSRF token to post, and never gets a session.
     """
+    public_api = True
+    shard_by = 'board'
 
     def post(self, req):
         """
@@ -138,53 +521,524 @@ class CreatePost(View):
         Either message/photo must exist for the POST request to be valid.
         This will be added to the database along with a created_at timestamp.
         
+        The post and all of its photos are created in one transaction, inserting the photos in
+        a batch (see `PostManager.create_with_photos`). If post batching is on, the post is
+        created along with the other posts submitted at the same time instead, and the response
+        is only sent once it has been committed (see `board.batching`).
+        
         The user will post form data with the following attached:
         Fields:
+            board -> string: the uuid of the board to post on.
             name -> string: the author of the post, optional.
             message -> string: the message the user wish to convey.
-            photo -> Images: the photos the user uploads.
+            photo -> Images: the photos the user uploads, in order.
         Returns:
-            A response of either status `204` for success or `422` for invalid data.
+            A response of either status `204` for success, `403` if the board is frozen, `404`
+            if the board does not exist, `422` for invalid data, or `503` if a batched post
+            was not committed in time, or its photos were not processed in time.
         """
         form = PostForm(req.POST, req.FILES)
 
-        if (form.is_valid()):
-            #TODO: save form data to database
+        if (not form.is_valid()):
+            # 422 meaning the data is valid but does not match business model
+            return HttpResponse(status=422)
 
-            # 204 is an empty response with no content, meaning that the operation was a success
-            return HttpResponse(status=204)
-        # 422 meaning the data is valid but does not match business model
-        return HttpResponse(status=422)
+        try:
+            board = Board.objects.get(uuid=form.cleaned_data['board'])
+        except Board.DoesNotExist:
+            return HttpResponse(status=404)
+
+        if (board.frozen_at is not None):
+            return HttpResponse(status=403)
+
+        fields = {
+            'associated_board': board,
+            'name': form.cleaned_data['name'],
+            'message': form.cleaned_data['message'],
+        }
+        batcher = get_post_batcher()
+        processor = get_photo_processor()
+        try:
+            if (processor is not None):
+                processor.process(form.cleaned_data['photo'], timeout=settings.IMAGE_PROCESS_TIMEOUT)
+            if (batcher is not None):
+                batcher.create(form.cleaned_data['photo'], timeout=settings.POST_BATCH_TIMEOUT, **fields)
+            else:
+                # Some storage backends write the photos right away, so they are written in the
+                # same transaction as the post, and never left behind if creating it fails.
+                with transaction.atomic(using=router.db_for_write(Post)):
+                    photos = [Image.from_upload(photo, board) for photo in form.cleaned_data['photo']]
+                    Post.objects.create_with_photos(photos, **fields)
+        except ValueError:
+            # The photo headers were valid, but the rest of the image is not.
+            return HttpResponse(status=422)
+        except futures.TimeoutError:
+            return HttpResponse(status=503)
+
+        # 204 is an empty response with no content, meaning that the operation was a success
+        return HttpResponse(status=204)
+
+def parse_byte_range(header, size):
+    """
+    Return the byte range requested by a `Range` header, as `(start, end)` with `end` exclusive.
+
+    Only single ranges in bytes are supported. Since servers may ignore `Range` headers, `None`
+    is returned for anything else, in which case the whole image should be sent.
+
+    Params:
+        header -> `string`: the `Range` header, or `None`.
+        size -> `int`: the size of the image in bytes.
+
+    Raises:
+        `ValueError` if the range starts after the end of the image.
+    """
+    if (not header or size is None or not header.startswith('bytes=') or ',' in header):
+        return None
+
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if (not first):
+            # A suffix range, holding the last bytes of the image.
+            start, end = max(size - int(last), 0), size
+        else:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+    except ValueError:
+        return None
+
+    if (start < 0 or end <= start and start < size):
+        return None
+    if (start >= size):
+        raise ValueError('Unsatisfiable range.')
+    return start, end
+
+def uncacheable_response(status):
+    """
+    Return an empty response with the given error status, which must not be stored.
+
+    Errors such as a `404` may only last until a read replica catches up, or a board is moved
+    to its shard, so they must never be cached like the images themselves.
+    """
+    response = HttpResponse(status=status)
+    patch_cache_control(response, no_store=True)
+    return response
+
+def tag_image_response(response, image_uuid):
+    """
+    Mark a response with an image, or a `304` for one, as cacheable forever, tagged with the
+    image uuid since images never change.
+    """
+    patch_cache_control(response, public=True, max_age=IMAGE_MAX_AGE, immutable=True)
+    response['ETag'] = quote_etag(str(image_uuid))
+    return response
+
+def not_modified_image_response(req, image_uuid):
+    """
+    Return a `304` if the request revalidates the image with the given uuid, or `None`.
+
+    Images never change, so this needs no database access.
+    """
+    response = get_conditional_response(req, etag=quote_etag(str(image_uuid)))
+    return tag_image_response(response, image_uuid) if response is not None else None
+
+def image_response(req, content_type, size, read, image_uuid=None):
+    """
+    Return a response with an image, or with the byte range of it requested by the `Range` header.
+
+    Params:
+        req -> `HttpRequest`: the request.
+        content_type -> `string`: the MIME type of the image.
+        size -> `int`: the size of the image in bytes.
+        read -> `function`: called with `(start, end)`, returning the image's bytes from `start`
+            up to `end` (exclusive), either as `bytes`, as an iterator of chunks to stream, or
+            as a file to send whole.
+        image_uuid -> `UUID`: the uuid of the image, if given, with which the response is
+            tagged and cached forever (see `tag_image_response`). Errors never are.
+    """
+    try:
+        byte_range = parse_byte_range(req.META.get('HTTP_RANGE'), size)
+    except ValueError:
+        response = uncacheable_response(416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    start, end = byte_range if byte_range is not None else (0, size)
+    status = 206 if byte_range is not None else 200
+    body = read(start, end)
+    if (isinstance(body, (bytes, memoryview))):
+        response = HttpResponse(body, content_type=content_type, status=status)
+    elif (hasattr(body, 'read')):
+        response = FileResponse(body, content_type=content_type, status=status)
+    else:
+        response = StreamingHttpResponse(body, content_type=content_type, status=status)
+        response['Content-Length'] = end - start
+    if (byte_range is not None):
+        response['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    if (image_uuid is not None):
+        tag_image_response(response, image_uuid)
+    return response
+
+def cached_file_response(req, f, content_type, image_uuid=None):
+    """
+    Return a response with an image cached on disk, or with the requested byte range of it.
+
+    The whole file is sent with a `FileResponse`, which servers may pass to `sendfile`, and byte
+    ranges are read through a memory map. The file is closed once sent. The `Content-Disposition`
+    added by `FileResponse` is left out, so the headers are the same as for images read from the
+    database.
+    """
+    size = os.fstat(f.fileno()).st_size
+
+    def read(start, end):
+        if ((start, end) == (0, size)):
+            return f
+        return read_mapped(f, start, end)
+
+    response = image_response(req, content_type, size, read, image_uuid)
+    if (response.status_code == 416):
+        f.close()
+    if ('Content-Disposition' in response):
+        del response['Content-Disposition']
+    return response
 
 class GetImage(View):
     """
     The API endpoint to retrieve images stored in the database.
 
     Since images are stored as BLOBs, they must be fetched and returned independently from posts.
-    Once a GET request is sent to this view, it will respond with the image BLOB, using the 
-    specified static image URI as a locator. If the image URI cannot be found in the
-    database, a 404 will be returned.
+    Once a GET request is sent to this view, it will respond with the image bytes, using the 
+    specified image uuid as a locator. If the uuid is malformed, a 400 will be returned, and if
+    it cannot be found in the database, a 404 will be returned.
+
+    Images kept by a storage backend which can be read in chunks (see `board.storage`) are
+    streamed into the response one chunk at a time, so serving a large image never holds all
+    of it in memory. A single byte range of an image may be requested with a `Range` header,
+    in which case only the chunks overlapping it are read.
+
+    Images of inactive boards may have been archived (see `board.archive`), in which case they
+    are restored into the database before being returned.
+
+    An image never changes once stored, so responses may be cached forever, and are tagged with
+    the image uuid so revalidating them needs no database access. Errors are never cached, since
+    a `404` may only last until a read replica catches up or a board is moved to its shard.
+
+    Images small enough are also kept in this process's image cache (see `board.cache`), so the
+    hot images of a live board are served from memory without any database access. If a disk
+    cache is configured (`IMAGE_DISK_CACHE_ROOT`), images are cached there instead, once for all
+    of the worker processes of the host.
     """
+    public_api = True
+    shard_by = 'image'
+    read_from_replica = True
 
     def get(self, req, image):
-        """Gets the requested image from the specified image URI."""
-        #TODO: return image blob and fix docstring once finished
-        return HttpResponse(f'<h1>wow u got image {image}</h1>')
+        """Gets the requested image from the specified image uuid."""
+        try:
+            image_uuid = UUID(image, version=4)
+        except:
+            return uncacheable_response(400)
+
+        not_modified = not_modified_image_response(req, image_uuid)
+        if (not_modified is not None):
+            return not_modified
+
+        cache = get_image_cache()
+        cache_key = (image_uuid, VARIANT_ORIGINAL)
+        cached = cache.get(cache_key)
+        if (cached is not None):
+            return image_response(
+                req, cached.content_type, len(cached.data), lambda start, end: cached.data[start:end], image_uuid,
+            )
+
+        disk_cache = get_disk_image_cache()
+        if (disk_cache is not None):
+            f, content_type = disk_cache.open(cache_key)
+            if (f is not None):
+                return cached_file_response(req, f, content_type, image_uuid)
+
+        image = next(iter_images([image_uuid]), None)
+        if (image is None):
+            return uncacheable_response(404)
+
+        if (image.archive):
+            restore_image(image)
+
+        content_type = image.content_type or 'application/octet-stream'
+        if (disk_cache is not None):
+            disk_cache.write(cache_key, image.iter_chunks())
+            f, _ = disk_cache.open(cache_key)
+            # The file may already have been pruned by another process.
+            if (f is not None):
+                return cached_file_response(req, f, content_type, image_uuid)
+        elif (cache.accepts(image.size)):
+            cached = CachedImage(content_type, b''.join(image.iter_chunks()))
+            cache.set(cache_key, cached)
+            return image_response(
+                req, content_type, len(cached.data), lambda start, end: cached.data[start:end], image_uuid,
+            )
+
+        if (image.storage == BlobStorage.name):
+            return image_response(
+                req, content_type, image.size, lambda start, end: image.photo[start:end], image_uuid,
+            )
+        return image_response(req, content_type, image.size, image.iter_chunks, image_uuid)
+
+
+def search_shards(uuids, read):
+    """
+    Yield what `read` yields for the images with the given uuids, looked up shard by shard.
+
+    Images are looked up on the shard their uuid places them on (see `board.sharding`), in one
+    call of `read` per shard. Those not found there are looked up on the other shards, since the
+    images of boards moved between shards, and those posted before boards were sharded, keep
+    their uuids wherever they are. The database of each shard is picked when it is searched, so
+    reads of the default shard may go to its replicas.
 
+    Params:
+        uuids -> `list` of `UUID`: the uuids of the images.
+        read -> `function`: called with a database alias and a list of uuids, yielding
+            `(uuid, value)` pairs for the images found.
+    """
+    def search(alias, shard_uuids):
+        with using_shard(alias):
+            using = router.db_for_read(Image)
+        for image_uuid, value in read(using, shard_uuids):
+            found.add(image_uuid)
+            yield value
+
+    found = set()
+    shards = {}
+    for image_uuid in uuids:
+        shards.setdefault(shard_for(image_uuid), []).append(image_uuid)
+    for alias, shard_uuids in shards.items():
+        yield from search(alias, shard_uuids)
+    for alias in settings.BOARD_SHARDS:
+        missing = [image_uuid for image_uuid in uuids if image_uuid not in found and shard_for(image_uuid) != alias]
+        if (missing):
+            yield from search(alias, missing)
+
+def iter_images(uuids):
+    """
+    Yield the images with the given uuids which exist, in one query per shard searched (see
+    `search_shards`), reading them `IMAGE_BATCH_CHUNK_SIZE` rows at a time.
+    """
+    def read(using, shard_uuids):
+        images = Image.objects.using(using).filter(uuid__in=shard_uuids)
+        return ((image.uuid, image) for image in images.iterator(chunk_size=IMAGE_BATCH_CHUNK_SIZE))
+
+    return search_shards(uuids, read)
+
+def locate_images(uuids):
+    """
+    Return where the images with the given uuids which exist are, as a dictionary of database
+    alias to the uuids of the images found there.
+
+    Only the uuids are read, in one query per shard searched (see `search_shards`). The
+    databases are picked now, within the routing of the request, so the images can be read from
+    them later, e.g. while a response streams, with `iter_located_images`.
+    """
+    def read(using, shard_uuids):
+        found = Image.objects.using(using).filter(uuid__in=shard_uuids).values_list('uuid', flat=True)
+        return ((image_uuid, (using, image_uuid)) for image_uuid in found)
 
+    located = {}
+    for using, image_uuid in search_shards(uuids, read):
+        located.setdefault(using, []).append(image_uuid)
+    return located
+
+def iter_located_images(located):
+    """
+    Yield the images found by `locate_images`, from the databases they were found on, reading
+    them `IMAGE_BATCH_CHUNK_SIZE` rows at a time. Images deleted since are left out.
+    """
+    for using, uuids in located.items():
+        yield from Image.objects.using(using).filter(uuid__in=uuids).iterator(chunk_size=IMAGE_BATCH_CHUNK_SIZE)
+
+def open_cached_image(key):
+    """
+    Return an image variant with the given `(uuid, variant)` key from the image caches of this
+    process or host, as a `(content_type, read)` pair, or `None` if it is not cached.
+
+    Calling `read` returns the bytes of the image. Files of the disk cache are opened now, but
+    only read then, so they may be pruned meanwhile.
+    """
+    cached = get_image_cache().get(key)
+    if (cached is not None):
+        return cached.content_type, lambda: cached.data
+    disk_cache = get_disk_image_cache()
+    f, content_type = disk_cache.open(key) if disk_cache is not None else (None, None)
+    if (f is None):
+        return None
+
+    def read():
+        with f:
+            return f.read()
+    return content_type, read
+
+def load_image_variant(image, variant):
+    """
+    Return a variant of an image fetched from the database, as a `CachedImage`, caching it
+    like `GetImage` does.
+
+    Thumbnails are made from the original image (see `board.images.make_thumbnail`). Images
+    which cannot be decoded have no thumbnail, so the original is returned instead.
+    """
+    if (image.archive):
+        restore_image(image)
+    content_type = image.content_type or 'application/octet-stream'
+    data = b''.join(image.iter_chunks())
+    if (variant == VARIANT_THUMBNAIL):
+        content_type, data = make_thumbnail(data) or (content_type, data)
+    cached = CachedImage(content_type, data)
+    cache_image((image.uuid, variant), cached)
+    return cached
+
+def parse_image_batch(req):
+    """
+    Return the uuids, without duplicates, and the variant of the images requested from
+    `GetImages`.
+
+    Raises:
+        `ValueError` if the query string is invalid, or requests too many images.
+    """
+    uuids = list(dict.fromkeys(UUID(u, version=4) for u in req.GET.get('ids', '').split(',') if u))
+    variant = req.GET.get('variant', VARIANT_ORIGINAL)
+    max_images = settings.IMAGE_BATCH_THUMBNAIL_MAX if variant == VARIANT_THUMBNAIL else settings.IMAGE_BATCH_MAX
+    if (not uuids or len(uuids) > max_images or variant not in IMAGE_VARIANTS):
+        raise ValueError('Invalid image batch.')
+    return uuids, variant
+
+def get_images_etag(uuids, variant):
+    """Return the ETag of a whole batch of images, derived from their uuids since images never change."""
+    key = f'{variant}:{",".join(str(image_uuid) for image_uuid in uuids)}'
+    return quote_etag(hashlib.md5(key.encode('utf-8')).hexdigest())
+
+class GetImages(View):
+    """
+    The API endpoint to retrieve many images at once, e.g. the photos of a whole feed page.
+
+    Fetching the photos of a page one by one from `GetImage` costs a round trip and a query per
+    photo. This takes the uuids of up to `IMAGE_BATCH_MAX` images as a comma separated `ids`
+    query string param, and the variant to return as `variant`: `original` (the default) or
+    `thumbnail` (see `board.images.make_thumbnail`). For example:
+    ```
+    api/board/images?ids=<uuid>,<uuid>,<uuid>&variant=thumbnail
+    ```
+    The images are sent as a `multipart/mixed` stream, with one part per image, in any order:
+    ```
+    --<boundary>
+    Content-Type: image/jpeg
+    Content-Length: 12345
+    Content-ID: <uuid>
+
+    <the image bytes>
+    --<boundary>--
+    ```
+    Images which do not exist are left out, and a batch of which none exist is a `404`. A
+    malformed query string is answered with a `400`.
+
+    The images are read from the image caches where cached. All the others are located before
+    responding, in one query of their uuids per shard (see `locate_images`), and read as the
+    parts are sent, a few rows at a time, so a batch is never held in memory whole. The variants
+    fetched are cached like `GetImage` caches images.
+
+    Thumbnails not cached yet are made while the parts are sent, so at most
+    `IMAGE_BATCH_THUMBNAIL_MAX` of them may be requested at once. Those of photos processed by
+    `board.processing` are cached as soon as their post is created.
+
+    A response holding every requested image never changes, so it may be cached forever, and is
+    tagged from the requested uuids. Responses missing some images may hold them later, e.g. once
+    a read replica catches up, so they are never cached.
+    """
+    public_api = True
+    read_from_replica = True
+
+    def get(self, req):
+        """Get the requested images as a multipart stream."""
+        try:
+            uuids, variant = parse_image_batch(req)
+        except ValueError:
+            return uncacheable_response(400)
+
+        etag = get_images_etag(uuids, variant)
+        not_modified = get_conditional_response(req, etag=etag)
+        if (not_modified is not None):
+            patch_cache_control(not_modified, public=True, max_age=IMAGE_MAX_AGE, immutable=True)
+            not_modified['ETag'] = etag
+            return not_modified
+
+        cached = {}
+        missing = []
+        for image_uuid in uuids:
+            entry = open_cached_image((image_uuid, variant))
+            if (entry is None):
+                missing.append(image_uuid)
+            else:
+                cached[image_uuid] = entry
+        located = locate_images(missing) if missing else {}
+        found = len(cached) + sum(len(located_uuids) for located_uuids in located.values())
+        if (not found):
+            return uncacheable_response(404)
+
+        boundary = uuid.uuid4().hex
+        response = StreamingHttpResponse(
+            self.iter_parts(cached, located, variant, boundary),
+            content_type=f'multipart/mixed; boundary={boundary}',
+        )
+        if (found == len(uuids)):
+            patch_cache_control(response, public=True, max_age=IMAGE_MAX_AGE, immutable=True)
+            response['ETag'] = etag
+        else:
+            patch_cache_control(response, no_store=True)
+        return response
+
+    def iter_parts(self, cached, located, variant, boundary):
+        """Yield the parts of the multipart stream of the images, one image at a time."""
+        def part(image_uuid, content_type, data):
+            headers = (
+                f'--{boundary}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Length: {len(data)}\r\n'
+                f'Content-ID: <{image_uuid}>\r\n\r\n'
+            )
+            return headers.encode('ascii') + data + b'\r\n'
+
+        for image_uuid, (content_type, read) in cached.items():
+            yield part(image_uuid, content_type, read())
+        for image in iter_located_images(located):
+            loaded = load_image_variant(image, variant)
+            yield part(image.uuid, loaded.content_type, loaded.data)
+        yield f'--{boundary}--\r\n'.encode('ascii')
+
+@method_decorator(cache_control(public=True, max_age=settings.BOARD_DETAILS_MAX_AGE), name='get')
 class GetBoardDetails(View):
     """
     The API endpoint to retrieve details regarding the board page.
 
     The details DO NOT include the posts, as they are done through a separate API.
+    Since the details rarely change, they may be cached publicly for `BOARD_DETAILS_MAX_AGE`
+    seconds, after which `ConditionalGetMiddleware` revalidates them with a content ETag.
     This returns a JSON object in the form of:
 
     JSON fields:
         title -> `string`: the title of the board. 
         description -> `string`: the description for the board.
-        bg -> `string`: the uuid of the background image of the board. 
+        bg -> `string`: the uuid of the background image of the board, or `null` if none.
+        bg_preview -> {
+            width -> `int`: the background's width in pixels, or `null` if unknown.
+            height -> `int`: the background's height in pixels, or `null` if unknown.
+            color -> `string`: the background's dominant colour as `#rrggbb`, or `''`.
+            placeholder -> `string`: a `data:` URI of a tiny preview of the background, or `''`.
+        }: a preview to paint before the background has loaded, or `null` if there is no
+            background.
 
+    The background BLOB itself is never loaded, only its precomputed preview (see
+    `get_board_dict`).
     """
+    public_api = True
+    shard_by = 'board'
+    read_from_replica = True
 
     def get(self, req):
         """Get the board details as a JSON response."""
@@ -199,14 +1053,8 @@ class GetBoardDetails(View):
 
         try:
             # Ensure the board exists.
-            board = Board.objects.get(uuid=board_uuid)
+            board = Board.objects.select_related('bg').defer('bg__photo').get(uuid=board_uuid)
         except:
             return HttpResponse(status=404)
 
-        board_json = {
-            'title': board.title,
-            'description': board.description,
-            'bg': str(board.bg.uuid),
-        }
-
-        return JsonResponse(board_json)
\ No newline at end of file
+        return JsonResponse(get_board_dict(board))
\ No newline at end of file
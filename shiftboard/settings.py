@@ -21,9 +21,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/3.2/howto/deployment/checklist/
 
-load_dotenv()
-env_path = Path('.')/'.env'
-load_dotenv(dotenv_path=env_path)
+# Read the environment from the .env file next to manage.py, if any. The path is given so
+# python-dotenv does not have to search for the file on every worker boot.
+load_dotenv(dotenv_path=BASE_DIR / '.env')
 
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = os.getenv('SECRET_KEY')
@@ -48,12 +48,20 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'board.middleware.StaticFilesMiddleware',
+    'board.middleware.ProfilingMiddleware',
+    'board.middleware.GZipMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
+    'board.middleware.FrozenBoardMiddleware',
+    'board.middleware.PublicAPIMiddleware',
+    'board.auth_middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'board.middleware.ReplicaRoutingMiddleware',
+    'board.middleware.ShardRoutingMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'board.auth_middleware.AuthenticationMiddleware',
+    'board.auth_middleware.MessageMiddleware',
+    'board.middleware.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'shiftboard.urls'
@@ -87,6 +95,43 @@ DATABASES = {
     }
 }
 
+# PostgreSQL is used instead of SQLite when POSTGRES_DB is set.
+
+if os.getenv('POSTGRES_DB'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv('POSTGRES_DB'),
+        'USER': os.getenv('POSTGRES_USER', ''),
+        'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+        'HOST': os.getenv('POSTGRES_HOST', ''),
+        'PORT': os.getenv('POSTGRES_PORT', ''),
+    }
+
+# Read replicas of the default database, as a comma separated list of database names (e.g. the
+# paths of SQLite copies for local testing). The read only board API views are served from a
+# random replica, except for clients which wrote something in the last REPLICA_STICKY_SECONDS.
+
+DATABASE_REPLICAS = []
+for i, name in enumerate(filter(None, os.getenv('DATABASE_REPLICAS', '').split(','))):
+    alias = f'replica{i + 1}'
+    DATABASES[alias] = {**DATABASES['default'], 'NAME': name, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(alias)
+
+# Shards holding boards besides the default database, as a comma separated list of database
+# names (e.g. the paths of SQLite databases for local testing). Boards are spread over the
+# default database and these by their uuid (see `board.sharding`). Run `manage.py migrate
+# --database shardN` on a new shard, then `manage.py rebalance_shards`.
+
+BOARD_SHARDS = ['default']
+for i, name in enumerate(filter(None, os.getenv('DATABASE_SHARDS', '').split(','))):
+    alias = f'shard{i + 1}'
+    DATABASES[alias] = {**DATABASES['default'], 'NAME': name}
+    BOARD_SHARDS.append(alias)
+
+DATABASE_ROUTERS = ['board.routers.ShardRouter', 'board.routers.ReplicaRouter']
+
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 10))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -126,7 +171,125 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# `manage.py collectstatic` copies the static files here, with hashed names and precompressed
+# variants, and `board.middleware.StaticFilesMiddleware` serves them when not in DEBUG.
+STATIC_ROOT = Path(os.getenv('STATIC_ROOT', BASE_DIR / 'staticfiles'))
+
+STATICFILES_STORAGE = 'board.staticfiles.CompressedManifestStaticFilesStorage'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# HTTP caching for the board API
+# Board details rarely change, so shared caches may hold them briefly. Feed pages are always
+# revalidated against an ETag derived from the board's latest post.
+
+BOARD_DETAILS_MAX_AGE = int(os.getenv('BOARD_DETAILS_MAX_AGE', 60))
+
+
+# Uploaded images
+# Uploads larger than this many pixels are rejected from their headers alone, before anything
+# tries to decode them (decompression bombs).
+
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', 40_000_000))
+
+MAX_PHOTOS_PER_POST = int(os.getenv('MAX_PHOTOS_PER_POST', 10))
+
+# The most images requested at once from the batch image endpoint (see `board.views.GetImages`),
+# enough for the photos of a feed page.
+IMAGE_BATCH_MAX = int(os.getenv('IMAGE_BATCH_MAX', 100))
+
+# The most thumbnails requested at once, which may have to be made while responding.
+IMAGE_BATCH_THUMBNAIL_MAX = int(os.getenv('IMAGE_BATCH_THUMBNAIL_MAX', 20))
+
+
+# Image archival
+# The images of boards without activity for this many days are moved out of the database into
+# compressed packs under IMAGE_ARCHIVE_ROOT by `manage.py archive_boards`.
+
+BOARD_ARCHIVE_AFTER_DAYS = int(os.getenv('BOARD_ARCHIVE_AFTER_DAYS', 365))
+
+IMAGE_ARCHIVE_ROOT = Path(os.getenv('IMAGE_ARCHIVE_ROOT', BASE_DIR / 'archive'))
+
+
+# Image storage
+# The backend new images are written with: 'blob', 'chunked', 'largeobject' (PostgreSQL only),
+# or 'auto' to use large objects on PostgreSQL and BLOBs elsewhere. See `board.storage`. Chunks
+# bound the memory used by large images on any database, but take one query per chunk to read.
+
+IMAGE_STORAGE = os.getenv('IMAGE_STORAGE', 'auto')
+
+# Images are read and written in chunks of this many bytes by the backends supporting it.
+IMAGE_STORAGE_CHUNK_SIZE = int(os.getenv('IMAGE_STORAGE_CHUNK_SIZE', 256 * 1024))
+
+
+# Image cache
+# Every worker process keeps the most recently served images in memory, up to this many MB in
+# total, and for at most this many seconds. See `board.cache`.
+
+IMAGE_CACHE_MAX_MB = int(os.getenv('IMAGE_CACHE_MAX_MB', 64))
+
+IMAGE_CACHE_TTL = int(os.getenv('IMAGE_CACHE_TTL', 10 * 60))
+
+
+# Image disk cache
+# The worker processes of a host share a cache of served images in this directory, if set,
+# holding up to this many MB of images for at most this many seconds. See `board.cache`.
+
+IMAGE_DISK_CACHE_ROOT = Path(os.getenv('IMAGE_DISK_CACHE_ROOT')) if os.getenv('IMAGE_DISK_CACHE_ROOT') else None
+
+IMAGE_DISK_CACHE_MAX_MB = int(os.getenv('IMAGE_DISK_CACHE_MAX_MB', 1024))
+
+IMAGE_DISK_CACHE_MAX_AGE = int(os.getenv('IMAGE_DISK_CACHE_MAX_AGE', 24 * 60 * 60))
+
+
+# Post batching
+# New posts may be created in grouped transactions, collecting the posts submitted to a worker
+# process within this many milliseconds, and at most this many of them. 0 creates every post in
+# its own transaction. Requests wait at most this many seconds for their post to be committed.
+# Only concurrent requests are grouped, so this needs threaded or ASGI workers. See
+# `board.batching`.
+
+POST_BATCH_WINDOW_MS = int(os.getenv('POST_BATCH_WINDOW_MS', 0))
+
+POST_BATCH_MAX_SIZE = int(os.getenv('POST_BATCH_MAX_SIZE', 100))
+
+POST_BATCH_TIMEOUT = int(os.getenv('POST_BATCH_TIMEOUT', 30))
+
+
+# Photo processing
+# The photos of new posts may be stripped and thumbnailed by a pool of this many processes per
+# worker, holding at most this many photos at once. 0 processes every photo in the worker.
+# Requests wait at most this many seconds for their photos. See `board.processing`.
+
+IMAGE_PROCESS_WORKERS = int(os.getenv('IMAGE_PROCESS_WORKERS', 0))
+
+IMAGE_PROCESS_MAX_PENDING = int(os.getenv('IMAGE_PROCESS_MAX_PENDING', 32))
+
+IMAGE_PROCESS_TIMEOUT = int(os.getenv('IMAGE_PROCESS_TIMEOUT', 30))
+
+
+# Board snapshots
+# Frozen boards are published as static files under this directory, with feed pages of this
+# many posts. See `board.snapshots`.
+
+SNAPSHOT_ROOT = Path(os.getenv('SNAPSHOT_ROOT', BASE_DIR / 'snapshots'))
+
+SNAPSHOT_PAGE_SIZE = int(os.getenv('SNAPSHOT_PAGE_SIZE', 50))
+
+
+# Request profiling
+# Requests with an X-Profile header holding a token from `manage.py profile_token`, valid for
+# this many seconds, and this percentage of all requests are profiled. The last
+# PROFILE_RING_SIZE profiles of all worker processes are kept in the default database, listed
+# on the admin site at /admin/profiles/.
+# A size of 0 turns profiling off. See `board.profiling`.
+
+PROFILE_RING_SIZE = int(os.getenv('PROFILE_RING_SIZE', 50))
+
+PROFILE_SAMPLE_PERCENT = float(os.getenv('PROFILE_SAMPLE_PERCENT', 0))
+
+PROFILE_TOKEN_MAX_AGE = int(os.getenv('PROFILE_TOKEN_MAX_AGE', 60 * 60))
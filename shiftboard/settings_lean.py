@@ -0,0 +1,58 @@
+"""
+Lean production settings for the workers serving the public board API.
+
+The public board API and the board page use neither the admin site nor sessions or messages,
+so this profile leaves them out of INSTALLED_APPS and MIDDLEWARE, which saves importing and
+setting them up every time an autoscaled worker boots. Everything else comes from
+`shiftboard.settings`.
+
+Workers are started with this profile by setting the settings module, e.g.:
+```
+DJANGO_SETTINGS_MODULE=shiftboard.settings_lean gunicorn shiftboard.wsgi
+```
+The admin site is served by separate workers (or `manage.py` commands) using the full
+`shiftboard.settings`.
+"""
+import os
+
+from shiftboard.settings import *  # noqa: F401,F403
+from shiftboard.settings import INSTALLED_APPS, MIDDLEWARE, TEMPLATES
+
+DEBUG = False
+
+ALLOWED_HOSTS = list(filter(None, os.getenv('ALLOWED_HOSTS', '').split(',')))
+
+ADMIN_ONLY_APPS = [
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+]
+
+ADMIN_ONLY_MIDDLEWARE = [
+    'board.auth_middleware.SessionMiddleware',
+    'board.auth_middleware.AuthenticationMiddleware',
+    'board.auth_middleware.MessageMiddleware',
+]
+
+ADMIN_ONLY_CONTEXT_PROCESSORS = [
+    'django.contrib.auth.context_processors.auth',
+    'django.contrib.messages.context_processors.messages',
+]
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in ADMIN_ONLY_APPS]
+
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in ADMIN_ONLY_MIDDLEWARE]
+
+TEMPLATES = [
+    {
+        **template,
+        'OPTIONS': {
+            **template['OPTIONS'],
+            'context_processors': [
+                processor for processor in template['OPTIONS']['context_processors']
+                if processor not in ADMIN_ONLY_CONTEXT_PROCESSORS
+            ],
+        },
+    }
+    for template in TEMPLATES
+]
@@ -13,10 +13,22 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.apps import apps
 from django.urls import path, include
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('', include('board.urls'))
 ]
+
+# The admin site is only imported when it is installed, which it is not in the lean settings
+# profile used by the public board API workers (see `shiftboard.settings_lean`).
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    from board.admin import profile_detail, profile_list
+
+    urlpatterns[:0] = [
+        path('admin/profiles/', admin.site.admin_view(profile_list), name='admin-profiles'),
+        path('admin/profiles/<int:profile_id>/', admin.site.admin_view(profile_detail), name='admin-profile'),
+        path('admin/', admin.site.urls),
+    ]